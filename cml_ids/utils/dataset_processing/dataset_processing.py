@@ -4,18 +4,75 @@
 import pandas as pd
 import numpy as np
 import math
+import time
+import os
+import json
 
 from sklearn.utils import shuffle
 from sklearn.model_selection import train_test_split
 
+from .dataset_storage import read_dataset, write_dataset, read_dataset_columns, iter_dataset_chunks, DatasetChunkWriter, \
+    count_dataset_rows, bucket_shuffle, get_bucket_num, compute_file_hash
+from .flow_schema import downcast_dataset, merge_compact_dtypes
+
+
+# labeling rules of the CIC-IDS2017 dataset per week day. A flow is labeled as "Attack" if its source IP is in
+# "src_ips" or its (source IP, destination IP) pair is in "ip_pairs", otherwise it gets the "default_label".
+LABEL_RULES = {
+    "Monday": {"src_ips": [], "ip_pairs": [], "default_label": "Benign"},
+    "Tuesday": {"src_ips": ["172.16.0.1"], "ip_pairs": [], "default_label": "Benign"},
+    "Wednesday": {"src_ips": ["172.16.0.1"], "ip_pairs": [], "default_label": "Benign"},
+    "Thursday": {"src_ips": ["172.16.0.1", "192.168.10.8"], "ip_pairs": [], "default_label": "Benign"},
+    "Friday": {"src_ips": [],
+               "ip_pairs": [("192.168.10.12", "52.6.13.28"),
+                            ("192.168.10.50", "172.16.0.1"),
+                            ("172.16.0.1", "192.168.10.50"),
+                            ("192.168.10.17", "52.7.235.158"),
+                            ("192.168.10.8", "205.174.165.73"),
+                            ("192.168.10.5", "205.174.165.73"),
+                            ("192.168.10.14", "205.174.165.73"),
+                            ("192.168.10.9", "205.174.165.73"),
+                            ("205.174.165.73", "192.168.10.8"),
+                            ("192.168.10.15", "205.174.165.73")],
+               "default_label": "Benign"},
+    "Unseen": {"src_ips": [], "ip_pairs": [], "default_label": "Attack"},
+}
+
 
 class DatasetPreprocess:
     """Process the flow-based dataset.
+
+    Attributes
+    ----------
+    compact_dtypes: bool
+        Convert the features of the read and preprocessed datasets to their narrowest safe dtypes (see
+        flow_schema), e.g. uint8 packet counts and float32 instead of int64 and float64. The label is kept.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, compact_dtypes=True) -> None:
+        self.compact_dtypes = compact_dtypes
         print("Start processing datasets.")
 
+    def load_dataset(self, dataset_path, columns=None):
+        """Read a flow-based dataset, with compact dtypes if compact_dtypes is set.
+
+        Parameters
+        ----------
+        dataset_path: str
+            Path of the dataset.
+        columns: list, default: None
+            Columns to read. All columns if None.
+
+        Returns
+        -------
+        DataFrame
+            The dataset.
+        """
+        df = read_dataset(dataset_path, columns=columns)
+        if self.compact_dtypes:
+            df, _ = downcast_dataset(df)
+        return df
+
     def labeling_entry(self, dataset_day, src_ip, dst_ip):
         """Label the flow entry of the CIC-IDS2017 dataset.
 
@@ -66,31 +123,170 @@ class DatasetPreprocess:
                 "The given week day name is incorrect. Please give a week day from 'Tuesday', 'Wednesday', 'Thursday' or 'Friday'. Note the capitalization of the first letter.")
         return label
 
-    def preprocess(self, dataset_path, save_path, packet_count, drop_features=None, drop_features_wildcards=None):
+    def label_flows(self, df, dataset_day):
+        """Label the flow entries of the CIC-IDS2017 dataset with the rule table LABEL_RULES.
+
+        Vectorized equivalent of applying labeling_entry() to each row. The IP addresses are 
+        converted to categoricals, so the rules are matched on integer codes.
+
+        Parameters
+        ----------
+        df: DataFrame
+            Flow entries with the columns "src_ip" and "dst_ip".
+        dataset_day: str {"Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Unseen"}
+            The week day of the dataset.
+
+        Returns
+        -------
+        array (numpy)
+            Label ("Benign"/"Attack") of each flow entry.
+        """
+        if dataset_day not in LABEL_RULES:
+            raise ValueError(
+                "The given week day name is incorrect. Please give a week day from 'Tuesday', 'Wednesday', 'Thursday' or 'Friday'. Note the capitalization of the first letter.")
+        rules = LABEL_RULES[dataset_day]
+        src_ip = df["src_ip"].astype("category")
+        is_attack = src_ip.isin(rules["src_ips"]).to_numpy()
+        if rules["ip_pairs"]:
+            dst_ip = df["dst_ip"].astype("category")
+            ip_pairs = pd.MultiIndex.from_arrays([src_ip, dst_ip])
+            is_attack = is_attack | ip_pairs.isin(rules["ip_pairs"])
+        default_label = rules["default_label"]
+        return np.where(is_attack, "Attack", default_label).astype(object)
+
+    def benchmark_labeling(self, dataset_path, dataset_day):
+        """Compare the labeling time of labeling_entry() applied per row and of label_flows().
+
+        Parameters
+        ----------
+        dataset_path: str
+            The flow-based dataset path.
+        dataset_day: str {"Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Unseen"}
+            The week day of the dataset.
+
+        Returns
+        -------
+        dict
+            Labeling time (s) of both paths.
+        """
+        df = read_dataset(dataset_path, columns=[
+                          "src_ip", "dst_ip", "bidirectional_mean_ps"])
+
+        start_timestamp = time.perf_counter()
+        apply_labels = df.apply(lambda x: self.labeling_entry(
+            dataset_day=dataset_day, src_ip=x["src_ip"], dst_ip=x["dst_ip"]), axis=1)
+        apply_floor = df["bidirectional_mean_ps"].apply(lambda x: math.floor(x))
+        apply_time = time.perf_counter() - start_timestamp
+
+        start_timestamp = time.perf_counter()
+        vectorized_labels = self.label_flows(df, dataset_day)
+        vectorized_floor = np.floor(
+            df["bidirectional_mean_ps"]).astype(np.int64)
+        vectorized_time = time.perf_counter() - start_timestamp
+
+        if not (np.array_equal(apply_labels.to_numpy(), vectorized_labels)
+                and np.array_equal(apply_floor.to_numpy(), vectorized_floor.to_numpy())):
+            raise ValueError("Labels differ between both paths.")
+        result = {"apply_seconds": apply_time,
+                  "vectorized_seconds": vectorized_time}
+        print(f"Labeling {len(df)} flows: apply {apply_time:.3f} s, vectorized {vectorized_time:.3f} s, "
+              f"speedup: {apply_time / vectorized_time:.1f}x")
+        return result
+
+    def get_dataset_day(self, dataset_path):
+        """Get the week day of a CIC-IDS2017 flow-based dataset from its path.
+
+        Parameters
+        ----------
+        dataset_path: str
+            The flow-based dataset path containing the week day.
+
+        Returns
+        -------
+        str {"Tuesday", "Wednesday", "Thursday", "Friday"}
+            The week day of the dataset.
+        """
+        if "Tuesday" in dataset_path:
+            day = "Tuesday"
+        elif "Wednesday" in dataset_path:
+            day = "Wednesday"
+        elif "Thursday" in dataset_path:
+            day = "Thursday"
+        elif "Friday" in dataset_path:
+            day = "Friday"
+        else:
+            raise TypeError(
+                "Please give the dataset path containing 'Tuesday', 'Wednesday', 'Thursday', or 'Friday'.")
+        return day
+
+    def get_dropped_features(self, columns, drop_features=None, drop_features_wildcards=None):
+        """Get the features to drop among the given columns.
+
+        Parameters
+        ----------
+        columns: list
+            Column names of the dataset.
+        drop_features: list, default: None
+            The list contains all feature names to drop. 
+        drop_features_wildcards: list, default: None
+            The list contains all wirdcards of dropped features
+
+        Returns
+        -------
+        list
+            Names of the dropped features.
+        """
+        dropped_feature_list = []
+        if drop_features != None:
+            dropped_feature_list.extend(drop_features)
+        if drop_features_wildcards != None:
+            for feature in columns:
+                for wildcard in drop_features_wildcards:
+                    if wildcard in feature and feature not in dropped_feature_list:
+                        dropped_feature_list.append(feature)
+        return dropped_feature_list
+
+    def preprocess(self, dataset_path, save_path, packet_count, drop_features=None, drop_features_wildcards=None,
+                   chunk_size=None):
         """Label each flow entry and remove the unused features and convert the values of the "Label" column.
 
         "Benign" -> 0; "Attack" -> 1
 
+        If chunk_size is given, the dataset is processed out-of-core: only the kept features (and the features
+        needed for filtering and labeling) are read, in chunks of flow entries filtered by packet_count while
+        reading, and every processed chunk is appended to save_path. The memory is bounded by chunk_size. Note that
+        rows with missing data are then only dropped based on the read features, not on the dropped ones. With
+        compact_dtypes, the chunks are read twice: first for the compact dtypes of the whole processed dataset,
+        so both ways write the same schema.
+
         Parameters
         ----------        
         dataset_path: str
-            The flow-based dataset path (.csv). 
+            The flow-based dataset path (.parquet, .feather or .csv). 
         save_path: str
-            The path to store the processed dataset.
+            The path to store the processed dataset, the format is given by the extension (see dataset_storage).
         packet_count: int
             Number of bidirectional packets within a flow,
         drop_features: list, default: None
             The list contains all feature names to drop. 
         drop_features_wildcards: list, default: None
             The list contains all wirdcards of dropped features
+        chunk_size: int, default: None
+            Number of flow entries read per chunk. The whole dataset is processed in memory if None.
 
         Returns
         -------
-        DataFrame
-            The processed flow-based dataset.
+        DataFrame or int
+            The processed flow-based dataset, or the number of processed flow entries if chunk_size is given.
 
         """
-        df = pd.read_csv(dataset_path)
+        # label flow entry (have to be executed before droping features)
+        day = self.get_dataset_day(dataset_path)
+        if chunk_size is not None:
+            return self.__preprocess_chunked(dataset_path, save_path, packet_count, day, drop_features,
+                                             drop_features_wildcards, chunk_size)
+
+        df = self.load_dataset(dataset_path)
 
         print(f"The original size of flow-based dataset: {len(df)}.")
 
@@ -102,83 +298,131 @@ class DatasetPreprocess:
         # drop rows containing missing data
         df = df.dropna()
 
-        # label flow entry (have to be executed before droping features)
-        if "Tuesday" in dataset_path:
-            day = "Tuesday"
-        elif "Wednesday" in dataset_path:
-            day = "Wednesday"
-        elif "Thursday" in dataset_path:
-            day = "Thursday"
-        elif "Friday" in dataset_path:
-            day = "Friday"
-        else:
-            raise TypeError(
-                "Please give the dataset path containing 'Tuesday', 'Wednesday', 'Thursday', or 'Friday'.")
-        df["Label"] = df.apply(lambda x: self.labeling_entry(
-            dataset_day=day, src_ip=x["src_ip"], dst_ip=x["dst_ip"]), axis=1)
+        df["Label"] = self.label_flows(df, day)
 
-        # drop unneeded feature
-        if drop_features != None:
-            df = df.drop(drop_features, axis=1)
-
-        # drop unneeded feature matching any wildcard
-        wildcard_drop_feature_list = []
-        if drop_features_wildcards != None:
-            for feature in df.columns:
-                for wildcard in drop_features_wildcards:
-                    if wildcard in feature:
-                        wildcard_drop_feature_list.append(feature)
-        df = df.drop(wildcard_drop_feature_list, axis=1)
+        # drop unneeded feature and unneeded feature matching any wildcard
+        df = df.drop(self.get_dropped_features(
+            df.columns, drop_features, drop_features_wildcards), axis=1)
 
         # round down the bidirectional_mean_ps feature
         # why? computing the mean of 8 packets can be done in P4
-        df["bidirectional_mean_ps"] = df["bidirectional_mean_ps"].apply(
-            lambda x: math.floor(x))
+        df["bidirectional_mean_ps"] = np.floor(
+            df["bidirectional_mean_ps"]).astype(np.int64)
 
-        # set index=False to avoid reading the first column as Unnamed: 0
-        df.to_csv(save_path, index=False)
+        if self.compact_dtypes:
+            df, _ = downcast_dataset(df)
+        write_dataset(df, save_path)
         return df
 
-    def merge(self, dataset_path_list, save_path):
+    def __preprocess_chunked(self, dataset_path, save_path, packet_count, day, drop_features,
+                             drop_features_wildcards, chunk_size):
+        """Process the flow-based dataset chunk by chunk (see preprocess()).
+        """
+        columns = read_dataset_columns(dataset_path)
+        dropped_features = self.get_dropped_features(
+            columns, drop_features, drop_features_wildcards)
+        kept_features = [
+            feature for feature in columns if feature not in dropped_features]
+        # the IP addresses are needed for labeling even if they are dropped afterwards
+        read_features = list(dict.fromkeys(
+            kept_features + ["src_ip", "dst_ip", "bidirectional_packets"]))
+        read_features = [feature for feature in columns if feature in read_features]
+
+        def processed_chunks():
+            for df in iter_dataset_chunks(dataset_path, chunk_size=chunk_size, columns=read_features,
+                                          filters={"bidirectional_packets": packet_count}):
+                # drop rows containing missing data
+                df = df.dropna()
+                df["Label"] = self.label_flows(df, day)
+                # round down the bidirectional_mean_ps feature
+                df["bidirectional_mean_ps"] = np.floor(
+                    df["bidirectional_mean_ps"]).astype(np.int64)
+                yield df[kept_features + ["Label"]]
+
+        # the schema of the first chunk is kept by the writer, thus the dtypes have to hold all chunks
+        compact_dtypes = {}
+        if self.compact_dtypes:
+            for df in processed_chunks():
+                compact_dtypes = merge_compact_dtypes(compact_dtypes, df)
+
+        writer = DatasetChunkWriter(save_path, kept_features + ["Label"])
+        flow_num = 0
+        for df in processed_chunks():
+            writer.write(df.astype(compact_dtypes))
+            flow_num += len(df)
+        writer.close()
+        print(
+            f"Number of flows with more than or equal to {packet_count}: {flow_num}.")
+        return flow_num
+
+    def merge(self, dataset_path_list, save_path, chunk_size=None, bucket_num=None, seed=None, bucket_dir=None):
         """Merge datasets and shuffle to generate the unified training dataset.
 
+        If chunk_size is given, the datasets are merged and shuffled out-of-core (see dataset_storage.bucket_shuffle()):
+        the rows are streamed in chunks into random on-disk buckets, which are shuffled one by one. The peak 
+        memory is then bounded by chunk_size rows.
+
         Parameters
         ----------  
         dataset_path_list: list
             List of dataset pathes that are merged.
         save_path: str
             The path to store the merged dataset.
+        chunk_size: int, default: None
+            Number of rows read per chunk. The datasets are merged in memory if None.
+        bucket_num: int, default: None
+            Number of on-disk buckets. If None, it is chosen so that a bucket holds chunk_size rows on average.
+        seed: int, default: None
+            Seed of the shuffling.
+        bucket_dir: str, default: None
+            Directory of the temporary bucket files. The default temporary directory is used if None.
 
         Returns
         -------
-        DataFrame
-            The unified training dataset.
+        DataFrame or int
+            The unified training dataset, or its number of rows if chunk_size is given.
         """
+        if chunk_size is not None:
+            row_num = sum(count_dataset_rows(path) for path in dataset_path_list)
+            if bucket_num is None:
+                bucket_num = get_bucket_num(row_num, chunk_size)
+            chunks = (df for path in dataset_path_list
+                      for df in iter_dataset_chunks(path, chunk_size=chunk_size))
+            row_num = bucket_shuffle(chunks, save_path, read_dataset_columns(dataset_path_list[0]),
+                                     bucket_num, seed=seed, bucket_dir=bucket_dir)
+            print(
+                f"Merged and schuffled datasets in {bucket_num} buckets. The size of the final unified dataset is: {row_num}")
+            return row_num
+
         # append all dataset into the list
         sum_length = 0
         df_list = []
         for path in dataset_path_list:
-            df = pd.read_csv(path)
+            df = self.load_dataset(path)
             df_list.append(df)
             sum_length += len(df)
 
         print(sum_length)
         df_merged = pd.concat(df_list)
-        df_merged = shuffle(df_merged)
+        df_merged = shuffle(df_merged, random_state=seed)
 
         print(
             f"Merged and schuffled datasets. The size of the final unified dataset is: {len(df_merged)}")
-        # set index=False to avoid reading the first column as Unnamed: 0
-        df_merged.to_csv(save_path, index=False)
+        write_dataset(df_merged, save_path)
         return df_merged
 
     def split_dataset(self, dataset_path, test_size=0.2):
-        """Split dataset.
+        """Split dataset into stratified training, validation and testing datasets (see load_split()).
+
+        The testing dataset is drawn first, the validation dataset from the remaining rows, so the datasets
+        do not overlap.
 
         Parameters
         ----------
         dataset_path: str
             Path of the training dataset
+        test_size: float, default: 0.2
+            Fraction of the testing dataset and of the validation dataset in the remaining rows.
 
         Returns
         -------
@@ -186,46 +430,161 @@ class DatasetPreprocess:
             Training dataset (X).
         DataFrame (pandas):
             Testing dataset (X).
-        DataFrame (pandas):
+        Series (pandas):
             Training dataset (y, label).
-        DataFrame (pandas):
+        Series (pandas):
             Testing dataset (y, label).
         DataFrame (pandas):
             Validation dataset (X).
-        DataFrame (pandas):
+        Series (pandas):
             Validation dataset (y, label).
         """
-
-        df = pd.read_csv(dataset_path)
-
-        # check the type of "Label" feature. If it's string ("Benign"/"Attack"), convert it to 0/1
-        val_label = df["Label"][0]
-        if type(val_label) is str:
-            # convert "Benign"/"Attack" to 0/1
-            label_mapping = {"Benign": 0, "Attack": 1}
-            df["Label"] = df["Label"].map(label_mapping)
-        elif type(val_label) is int:
-            pass
-        else:
-            raise TypeError("The value of 'Label' feature should be integer.")
-
-        X_tot, X_test, y_tot, y_test = train_test_split(
-            df.iloc[:, :-1], df['Label'], test_size=test_size, random_state=42, stratify=df['Label'])
-        X_train, X_val, y_train, y_val = train_test_split(
-            df.iloc[:, :-1], df['Label'], test_size=test_size, random_state=42, stratify=df['Label'])
-
-        for col in X_train.columns:
-            if 'Unnamed' in col:
-                X_train = X_train.drop(col, axis=1)
-                X_test = X_test.drop(col, axis=1)
-                X_val = X_val.drop(col, axis=1)
-        self.input_dim = X_train.shape[1]
+        X_train, X_test, y_train, y_test, X_val, y_val = self.load_split(dataset_path, test_size=test_size)
+        X_train, X_test, X_val = (pd.DataFrame(X, columns=self.feature_names) for X in (X_train, X_test, X_val))
+        y_train, y_test, y_val = (pd.Series(y, name="Label") for y in (y_train, y_test, y_val))
         print(X_train.columns)
         print(self.input_dim)
         return (X_train, X_test, y_train, y_test, X_val, y_val)
-    
-    def balance_dataset(self, dataset_path, save_path):
+
+    def load_split(self, dataset_path, test_size=0.2, val_size=None, seed=42, cache_dir=None, dtype=np.float32):
+        """Read the dataset once and split it into stratified training, validation and testing datasets.
+
+        The features are stored in a compact matrix (float32 by default, labels as int32). The test rows are 
+        drawn from the whole dataset and the validation rows from the remaining rows. The matrix is cached on
+        disk with its rows ordered as [training, validation, testing], keyed by the dataset content hash, the 
+        sizes and the seed. The returned datasets are zero-copy views of the memory-mapped cache, so repeated 
+        runs skip parsing and splitting.
+
+        Parameters
+        ----------
+        dataset_path: str
+            Path of the training dataset
+        test_size: float, default: 0.2
+            Fraction of the testing dataset.
+        val_size: float, default: None
+            Fraction of the validation dataset in the rows left for training. Same as test_size if None.
+        seed: int, default: 42
+            Seed of the stratified splits.
+        cache_dir: str, default: None
+            Directory of the split cache. <dataset_path>.split_cache if None.
+        dtype: data-type, default: np.float32
+            Data type of the feature matrix.
+
+        Returns
+        -------
+        array (numpy):
+            Training dataset (X).
+        array (numpy):
+            Testing dataset (X).
+        array (numpy):
+            Training dataset (y, label).
+        array (numpy):
+            Testing dataset (y, label).
+        array (numpy):
+            Validation dataset (X).
+        array (numpy):
+            Validation dataset (y, label).
+        """
+        if val_size is None:
+            val_size = test_size
+        if cache_dir is None:
+            cache_dir = dataset_path + ".split_cache"
+        cache_key = f"{compute_file_hash(dataset_path)}_{np.dtype(dtype).name}_test_{test_size}_val_{val_size}_seed_{seed}"
+        cache_path = os.path.join(cache_dir, cache_key)
+
+        if not os.path.exists(os.path.join(cache_path, "split.json")):
+            df = read_dataset(dataset_path)
+            feature_names = [feature for feature in df.columns
+                             if feature != "Label" and "Unnamed" not in feature]
+
+            # convert "Benign"/"Attack" to 0/1
+            y = df["Label"]
+            if not pd.api.types.is_numeric_dtype(y):
+                y = y.map({"Benign": 0, "Attack": 1})
+                if y.isna().any():
+                    raise TypeError(
+                        "The value of 'Label' feature should be 'Benign', 'Attack' or integer.")
+            elif not pd.api.types.is_integer_dtype(y):
+                raise TypeError("The value of 'Label' feature should be integer.")
+            y = y.to_numpy(dtype=np.int32)
+
+            # stratified index arrays of the splits
+            index = np.arange(len(y))
+            index_tot, index_test = train_test_split(
+                index, test_size=test_size, random_state=seed, stratify=y)
+            index_train, index_val = train_test_split(
+                index_tot, test_size=val_size, random_state=seed, stratify=y[index_tot])
+            order = np.concatenate((index_train, index_val, index_test))
+
+            X = df[feature_names].to_numpy(dtype=dtype)[order]
+            del df
+            tmp_path = cache_path + f".tmp{os.getpid()}"
+            os.makedirs(tmp_path, exist_ok=True)
+            np.save(os.path.join(tmp_path, "X.npy"), X)
+            np.save(os.path.join(tmp_path, "y.npy"), y[order])
+            with open(os.path.join(tmp_path, "split.json"), "w") as f:
+                json.dump({"dataset_path": dataset_path,
+                           "feature_names": feature_names,
+                           "train_num": len(index_train),
+                           "val_num": len(index_val),
+                           "test_num": len(index_test)}, f, indent=2)
+            # another process may have written the same cache in the meantime
+            try:
+                os.rename(tmp_path, cache_path)
+            except OSError:
+                for file_name in os.listdir(tmp_path):
+                    os.remove(os.path.join(tmp_path, file_name))
+                os.rmdir(tmp_path)
+
+        with open(os.path.join(cache_path, "split.json")) as f:
+            split_info = json.load(f)
+        X = np.load(os.path.join(cache_path, "X.npy"), mmap_mode="r")
+        y = np.load(os.path.join(cache_path, "y.npy"), mmap_mode="r")
+        train_end = split_info["train_num"]
+        val_end = train_end + split_info["val_num"]
+
+        self.feature_names = split_info["feature_names"]
+        self.input_dim = len(self.feature_names)
+        return (X[:train_end], X[val_end:], y[:train_end], y[val_end:], X[train_end:val_end], y[train_end:val_end])
+
+    def get_balanced_counts(self, label_counts, label_ratios=None):
+        """Compute the number of sampled flow entries of each label for balancing a dataset.
+
+        The largest sample with the given label ratios that is available in the dataset is taken.
+
+        Parameters
+        ----------
+        label_counts: Series (pandas)
+            Number of flow entries of each label.
+        label_ratios: dict, default: None
+            Ratio of each kept label, e.g. {"Benign": 2, "Attack": 1}. Labels which are not given are dropped. 
+            All labels have the same ratio if None.
+
+        Returns
+        -------
+        dict
+            Number of sampled flow entries of each label.
+        """
+        if label_ratios is None:
+            label_ratios = {label: 1 for label in label_counts.index}
+        missing_labels = [label for label, ratio in label_ratios.items()
+                          if ratio > 0 and label not in label_counts.index]
+        if missing_labels:
+            raise ValueError(
+                f"The labels are not contained in the dataset: {missing_labels}")
+        scale = min(label_counts[label] / ratio for label,
+                    ratio in label_ratios.items() if ratio > 0)
+        return {label: min(int(label_counts[label]), int(math.floor(scale * ratio + 1e-9)))
+                for label, ratio in label_ratios.items() if ratio > 0}
+
+    def balance_dataset(self, dataset_path, save_path, label_ratios=None, seed=None, chunk_size=None,
+                        bucket_num=None, bucket_dir=None):
         """Balance the dataset based on their label
+
+        If chunk_size is given, the dataset is balanced in a streaming way with bounded memory. A first pass 
+        only reads the "Label" column to count the labels. The second pass samples each chunk exactly (the number 
+        of kept flow entries of a label follows the hypergeometric distribution of sampling without replacement) 
+        and the kept flow entries are shuffled out-of-core (see dataset_storage.bucket_shuffle()).
         
         Parameters
         ----------
@@ -233,32 +592,79 @@ class DatasetPreprocess:
             Path of the imbalanced dataset.
         save_path: str
             Path for saving the balacned dataset.
+        label_ratios: dict, default: None
+            Ratio of each kept label, e.g. {"Benign": 2, "Attack": 1}. All labels (also beyond Benign/Attack)
+            have the same ratio if None.
+        seed: int, default: None
+            Seed of the sampling and shuffling.
+        chunk_size: int, default: None
+            Number of rows read per chunk. The dataset is balanced in memory if None.
+        bucket_num: int, default: None
+            Number of on-disk buckets for shuffling. If None, a bucket holds chunk_size rows on average.
+        bucket_dir: str, default: None
+            Directory of the temporary bucket files. The default temporary directory is used if None.
 
         Returns
         -------
-        DataFrame
-            The balanced dataset.
+        DataFrame or int
+            The balanced dataset, or its number of rows if chunk_size is given.
         """
-        df = pd.read_csv(dataset_path)
-        df_benign = df[df["Label"] == "Benign"]
-        df_attack = df[df["Label"] == "Attack"]
-
-        # sample dataset based on the minmum flow number of benign of attack
-        benign_count = len(df_benign)
-        attack_count = len(df_attack)
-        if benign_count > attack_count:
-            min_count = attack_count
-            df_benign = df_benign.sample(min_count).reset_index(drop=True)
-        else:
-            min_count = benign_count
-            df_attack = df_attack.sample(min_count).reset_index(drop=True)
-        
-        df = pd.concat([df_benign, df_attack])
-        df = shuffle(df)
-        print(f"Dataset is balanced and shuffled with the size of {2 * min_count}.")
+        if chunk_size is not None:
+            return self.__balance_dataset_streaming(dataset_path, save_path, label_ratios, seed, chunk_size,
+                                                    bucket_num, bucket_dir)
+
+        df = self.load_dataset(dataset_path)
+
+        # sample dataset based on the minmum flow number of the labels (scaled by their ratios)
+        target_counts = self.get_balanced_counts(
+            df["Label"].value_counts(), label_ratios)
+        df = pd.concat([df[df["Label"] == label].sample(count, random_state=seed)
+                        for label, count in target_counts.items()])
+        df = shuffle(df, random_state=seed)
+        print(f"Dataset is balanced and shuffled with the size of {len(df)}.")
 
-        # set index=False to avoid reading the first column as Unnamed: 0
-        df.to_csv(save_path, index=False)
+        write_dataset(df, save_path)
         return df
-        
-        
+
+    def __balance_dataset_streaming(self, dataset_path, save_path, label_ratios, seed, chunk_size, bucket_num,
+                                    bucket_dir):
+        """Balance the dataset chunk by chunk (see balance_dataset()).
+        """
+        # first pass: count the labels
+        label_counts = None
+        for df in iter_dataset_chunks(dataset_path, chunk_size=chunk_size, columns=["Label"]):
+            counts = df["Label"].value_counts()
+            label_counts = counts if label_counts is None else label_counts.add(
+                counts, fill_value=0)
+        label_counts = label_counts.astype(np.int64)
+        target_counts = self.get_balanced_counts(label_counts, label_ratios)
+
+        # second pass: sample without replacement chunk by chunk
+        rng = np.random.default_rng(seed)
+        remaining_counts = {label: int(label_counts[label]) for label in target_counts}
+        needed_counts = dict(target_counts)
+
+        def sampled_chunks():
+            for df in iter_dataset_chunks(dataset_path, chunk_size=chunk_size):
+                labels = df["Label"].to_numpy()
+                keep = np.zeros(len(df), dtype=bool)
+                for label in target_counts:
+                    label_index = np.flatnonzero(labels == label)
+                    if len(label_index) == 0:
+                        continue
+                    sample_num = rng.hypergeometric(needed_counts[label],
+                                                    remaining_counts[label] - needed_counts[label],
+                                                    len(label_index)) if needed_counts[label] > 0 else 0
+                    keep[rng.choice(label_index, sample_num,
+                                    replace=False)] = True
+                    needed_counts[label] -= sample_num
+                    remaining_counts[label] -= len(label_index)
+                yield df[keep]
+
+        total_count = sum(target_counts.values())
+        if bucket_num is None:
+            bucket_num = get_bucket_num(total_count, chunk_size)
+        row_num = bucket_shuffle(sampled_chunks(), save_path, read_dataset_columns(dataset_path), bucket_num,
+                                 seed=None if seed is None else seed + 1, bucket_dir=bucket_dir)
+        print(f"Dataset is balanced and shuffled with the size of {row_num}.")
+        return row_num
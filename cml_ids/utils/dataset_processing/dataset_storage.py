@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import math
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+import pyarrow.dataset as ds
+
+
+# dataset format of each file extension. Paths with other extensions are stored as Parquet.
+DATASET_FORMATS = {".parquet": "parquet",
+                   ".pq": "parquet",
+                   ".feather": "feather",
+                   ".arrow": "feather",
+                   ".csv": "csv"}
+DEFAULT_DATASET_FORMAT = "parquet"
+
+
+def get_dataset_format(path):
+    """Get the storage format of a dataset from its file extension.
+
+    Parameters
+    ----------
+    path: str
+        Path of the dataset.
+
+    Returns
+    -------
+    str {'parquet', 'feather', 'csv'}
+        Storage format. Parquet if the extension is unknown.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    return DATASET_FORMATS.get(extension, DEFAULT_DATASET_FORMAT)
+
+
+def read_dataset(path, columns=None, memory_map=True):
+    """Read a dataset with typed columns.
+
+    Parameters
+    ----------
+    path: str
+        Path of the dataset (.parquet, .feather/.arrow or .csv).
+    columns: list, default: None
+        Columns to read. Only these columns are parsed (column projection). All columns if None.
+    memory_map: bool, default: True
+        Memory-map the file instead of reading it into a buffer (Parquet and Feather only).
+
+    Returns
+    -------
+    DataFrame
+        The dataset.
+    """
+    dataset_format = get_dataset_format(path)
+    if dataset_format == "parquet":
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    elif dataset_format == "feather":
+        table = feather.read_table(path, columns=columns, memory_map=memory_map)
+    else:
+        return pd.read_csv(path, usecols=columns)
+    return table.to_pandas()
+
+
+def read_dataset_columns(path):
+    """Read the column names of a dataset without reading its rows.
+
+    Parameters
+    ----------
+    path: str
+        Path of the dataset.
+
+    Returns
+    -------
+    list
+        Column names.
+    """
+    dataset_format = get_dataset_format(path)
+    if dataset_format == "parquet":
+        return pq.read_schema(path).names
+    elif dataset_format == "feather":
+        return feather.read_table(path, memory_map=True).schema.names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def compute_file_hash(path, digest_size=16):
+    """Compute the BLAKE2b hash of a file content, read in blocks of 1 MB.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file.
+    digest_size: int, default: 16
+        Size of the hash in bytes.
+
+    Returns
+    -------
+    str
+        Hexadecimal hash.
+    """
+    file_hash = hashlib.blake2b(digest_size=digest_size)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def count_dataset_rows(path):
+    """Count the rows of a dataset. Parquet and Feather only read the metadata, CSV is scanned.
+
+    Parameters
+    ----------
+    path: str
+        Path of the dataset.
+
+    Returns
+    -------
+    int
+        Number of rows.
+    """
+    dataset_format = get_dataset_format(path)
+    if dataset_format == "parquet":
+        return pq.ParquetFile(path).metadata.num_rows
+    elif dataset_format == "feather":
+        return feather.read_table(path, memory_map=True).num_rows
+    with open(path, "rb") as f:
+        line_num = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+    # the header is not a row, the last line may not end with a newline
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line_num += 1
+    return max(line_num - 1, 0)
+
+
+def iter_dataset_chunks(path, chunk_size=100000, columns=None, filters=None):
+    """Iterate a dataset in chunks of rows.
+
+    Parameters
+    ----------
+    path: str
+        Path of the dataset.
+    chunk_size: int, default: 100000
+        Maximum number of rows per chunk.
+    columns: list, default: None
+        Columns to read. All columns if None.
+    filters: dict, default: None
+        Only rows whose column values equal the given values ({column: value}) are returned. For Parquet 
+        and Feather the filter is applied while reading (Parquet row groups are skipped by their statistics).
+
+    Yields
+    ------
+    DataFrame
+        A chunk of the dataset.
+    """
+    dataset_format = get_dataset_format(path)
+    if filters and dataset_format != "csv":
+        expression = None
+        for column, value in filters.items():
+            condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+        dataset = ds.dataset(path, format="parquet" if dataset_format == "parquet" else "ipc")
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunk_size):
+            if batch.num_rows > 0:
+                yield batch.to_pandas()
+    elif filters:
+        # the filter columns have to be read even if they are not requested
+        read_columns = None if columns is None else list(
+            dict.fromkeys(list(columns) + list(filters)))
+        for df in pd.read_csv(path, usecols=read_columns, chunksize=chunk_size):
+            for column, value in filters.items():
+                df = df[df[column] == value]
+            yield df if columns is None else df[list(columns)]
+    elif dataset_format == "parquet":
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    elif dataset_format == "feather":
+        # slices of a memory-mapped table do not copy the data
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        for offset in range(0, table.num_rows, chunk_size):
+            yield table.slice(offset, chunk_size).to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+
+
+def write_dataset(df, path):
+    """Write a dataset with typed columns.
+
+    Parameters
+    ----------
+    df: DataFrame
+        The dataset. The index is not stored.
+    path: str
+        Path of the dataset, the format is given by the extension (Parquet if unknown).
+    """
+    dataset_format = get_dataset_format(path)
+    if dataset_format == "parquet":
+        df.to_parquet(path, index=False)
+    elif dataset_format == "feather":
+        # feather requires a default index
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        # set index=False to avoid reading the first column as Unnamed: 0
+        df.to_csv(path, index=False)
+
+
+class DatasetChunkWriter:
+    """Append chunks of rows to a dataset file.
+
+    The schema of the first chunk is kept, later chunks are cast to it.
+
+    Attributes
+    ----------
+    save_path: str
+        Path of the dataset.
+    columns: list
+        Column names of the rows.
+    dataset_format: str {'parquet', 'feather', 'csv'}
+        Storage format given by the extension of save_path.
+    """
+
+    def __init__(self, save_path, columns) -> None:
+        self.save_path = save_path
+        self.columns = list(columns)
+        self.dataset_format = get_dataset_format(save_path)
+        self.arrow_writer = None
+        self.schema = None
+        self.header_written = False
+
+    def write(self, rows):
+        """Append rows given as tuples (ordered as columns) or as a DataFrame.
+        """
+        if isinstance(rows, pd.DataFrame):
+            df = rows[self.columns]
+        else:
+            df = pd.DataFrame.from_records(rows, columns=self.columns)
+        if self.dataset_format == "csv":
+            # set index=False to avoid reading the first column as Unnamed: 0
+            df.to_csv(self.save_path, mode='a' if self.header_written else 'w',
+                      header=not self.header_written, index=False)
+            self.header_written = True
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.arrow_writer is None:
+            self.schema = table.schema
+            if self.dataset_format == "parquet":
+                self.arrow_writer = pq.ParquetWriter(
+                    self.save_path, table.schema)
+            else:
+                self.arrow_writer = pa.ipc.new_file(
+                    self.save_path, table.schema)
+        else:
+            table = table.cast(self.schema)
+        self.arrow_writer.write_table(table)
+
+    def close(self):
+        if self.arrow_writer is None and not self.header_written:
+            # write the header of an empty dataset
+            self.write([])
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+
+
+def _read_bucket_frames(bucket_path):
+    """Read the DataFrames appended to a bucket file by bucket_shuffle().
+    """
+    frames = []
+    with open(bucket_path, "rb") as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                return frames
+
+
+def bucket_shuffle(chunks, save_path, columns, bucket_num, seed=None, bucket_dir=None, buffer_rows=None):
+    """Shuffle a stream of rows out-of-core and write them to a dataset.
+
+    Each row is assigned to a random on-disk bucket while the chunks are streamed. The rows of the buckets are
+    buffered in memory and appended to the bucket files once buffer_rows rows are buffered, so each bucket
+    file gets one large frame per flush and only one file is open at a time, whatever the number of buckets.
+    The buckets are then shuffled one by one in memory and concatenated. The peak memory is given by the chunk
+    size, buffer_rows and the bucket size (number of rows / bucket_num).
+
+    Parameters
+    ----------
+    chunks: iterable
+        DataFrames with the rows to shuffle, e.g. from iter_dataset_chunks().
+    save_path: str
+        Path of the shuffled dataset, the format is given by the extension.
+    columns: list
+        Column names of the rows.
+    bucket_num: int
+        Number of buckets.
+    seed: int, default: None
+        Seed of the random bucket assignment and permutations.
+    bucket_dir: str, default: None
+        Directory of the temporary bucket files. The default temporary directory is used if None.
+    buffer_rows: int, default: None
+        Number of rows buffered over all buckets before they are appended to the bucket files. The number of
+        rows of the first chunk if None.
+
+    Returns
+    -------
+    int
+        Number of shuffled rows.
+    """
+    rng = np.random.default_rng(seed)
+    row_num = 0
+    buffered_row_num = 0
+    bucket_buffers = [[] for _ in range(bucket_num)]
+    with tempfile.TemporaryDirectory(dir=bucket_dir) as tmp_dir:
+        bucket_paths = [os.path.join(tmp_dir, f"bucket_{i}.pkl")
+                        for i in range(bucket_num)]
+        for df in chunks:
+            if buffer_rows is None:
+                buffer_rows = max(1, len(df))
+            df = df[columns]
+            bucket_ids = rng.integers(0, bucket_num, len(df))
+            # group the rows of the chunk by bucket with a single sort
+            df = df.iloc[np.argsort(bucket_ids, kind="stable")]
+            bounds = np.concatenate(
+                ([0], np.cumsum(np.bincount(bucket_ids, minlength=bucket_num))))
+            for i in range(bucket_num):
+                if bounds[i + 1] > bounds[i]:
+                    bucket_buffers[i].append(df.iloc[bounds[i]:bounds[i + 1]])
+            row_num += len(df)
+            buffered_row_num += len(df)
+
+            if buffered_row_num >= buffer_rows:
+                for i in range(bucket_num):
+                    if bucket_buffers[i]:
+                        # append one frame to the bucket file, the file is closed right away
+                        with open(bucket_paths[i], "ab") as f:
+                            pickle.dump(pd.concat(bucket_buffers[i]), f, protocol=pickle.HIGHEST_PROTOCOL)
+                        bucket_buffers[i] = []
+                buffered_row_num = 0
+
+        writer = DatasetChunkWriter(save_path, columns)
+        for i in range(bucket_num):
+            frames = bucket_buffers[i]
+            if os.path.exists(bucket_paths[i]):
+                frames = _read_bucket_frames(bucket_paths[i]) + frames
+            if not frames:
+                continue
+            df = pd.concat(frames)
+            writer.write(df.iloc[rng.permutation(len(df))])
+        writer.close()
+    return row_num
+
+
+def get_bucket_num(row_num, chunk_size):
+    """Get the number of buckets of bucket_shuffle() holding at most chunk_size rows on average.
+    """
+    return max(1, math.ceil(row_num / chunk_size))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import minmax_scale
+
+from .dataset_storage import compute_file_hash
+
+
+# score names of each scorer of FeatureSelection.compute_feature_importances(), ordered as in the ranking
+SCORER_SCORE_NAMES = {"mutual_information": ["mutual_information_score"],
+                      "impurity": ["impurity_score"],
+                      "rf_permutation": ["rf_based_score", "permutation_score"]}
+
+
+class FeatureScoreStore:
+    """Store the feature importance scores of each scorer and repeat.
+
+    The scores are stored per dataset fingerprint (content hash and subsample size), scorer, seed and repeat,
+    so additional repeats only compute the missing scores and the final ranking is recomputed from the
+    stored scores.
+
+    Layout: <store_dir>/<fingerprint>/meta.json and <store_dir>/<fingerprint>/<scorer>_seed_<seed>_repeat_<i>.npz
+
+    Attributes
+    ----------
+    store_dir: str
+        Directory of the store.
+    """
+
+    def __init__(self, store_dir) -> None:
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def get_fingerprint(self, dataset_path, sample_size=None):
+        """Get the fingerprint of the scored dataset.
+
+        Parameters
+        ----------
+        dataset_path: str
+            Path of the scored dataset.
+        sample_size: int or float, default: None
+            Size of the scored subsample (see FeatureSelection.compute_feature_importances()).
+
+        Returns
+        -------
+        str
+            Dataset fingerprint.
+        """
+        return f"{compute_file_hash(dataset_path)}_sample_{sample_size}"
+
+    def save_meta(self, fingerprint, dataset_path, feature_names, seed=None):
+        """Save the dataset path, the feature names and the last used seed of a fingerprint.
+        """
+        os.makedirs(os.path.join(self.store_dir, fingerprint), exist_ok=True)
+        with open(os.path.join(self.store_dir, fingerprint, "meta.json"), "w") as f:
+            json.dump({"dataset_path": dataset_path,
+                       "dataset_hash": fingerprint.split("_")[0],
+                       "feature_names": list(feature_names),
+                       "seed": seed}, f, indent=2)
+
+    def load_meta(self, fingerprint):
+        """Load the dataset path, the feature names and the last used seed of a fingerprint.
+        """
+        with open(os.path.join(self.store_dir, fingerprint, "meta.json")) as f:
+            return json.load(f)
+
+    def find_fingerprint(self, dataset_path=None):
+        """Find the most recently updated fingerprint, optionally of the given dataset.
+
+        Parameters
+        ----------
+        dataset_path: str, default: None
+            Path of the scored dataset. Any dataset if None.
+
+        Returns
+        -------
+        str
+            Dataset fingerprint.
+        """
+        dataset_hash = None if dataset_path is None else compute_file_hash(
+            dataset_path)
+        fingerprints = []
+        for fingerprint in os.listdir(self.store_dir):
+            meta_path = os.path.join(self.store_dir, fingerprint, "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            if dataset_hash is not None and self.load_meta(fingerprint)["dataset_hash"] != dataset_hash:
+                continue
+            fingerprints.append(
+                (os.path.getmtime(os.path.join(self.store_dir, fingerprint)), fingerprint))
+        if not fingerprints:
+            raise ValueError(
+                f"No feature scores of the dataset are stored in {self.store_dir}.")
+        return max(fingerprints)[1]
+
+    def __get_scores_path(self, fingerprint, scorer, seed, repeat_index):
+        return os.path.join(self.store_dir, fingerprint, f"{scorer}_seed_{seed}_repeat_{repeat_index}.npz")
+
+    def has_scores(self, fingerprint, scorer, seed, repeat_index):
+        """Check if the scores of a scorer and repeat are stored.
+        """
+        return os.path.exists(self.__get_scores_path(fingerprint, scorer, seed, repeat_index))
+
+    def save_scores(self, fingerprint, scorer, seed, repeat_index, scores):
+        """Save the scores of a scorer and repeat.
+
+        Parameters
+        ----------
+        fingerprint: str
+            Dataset fingerprint.
+        scorer: str
+            Scorer name (see SCORER_SCORE_NAMES).
+        seed: int
+            Seed of the scoring.
+        repeat_index: int
+            Index of the repeat.
+        scores: dict
+            Feature scores of each score name of the scorer.
+        """
+        scores_path = self.__get_scores_path(
+            fingerprint, scorer, seed, repeat_index)
+        # write to a temporary file first, an interrupted write leaves no partial scores
+        np.savez(scores_path + ".tmp.npz", **scores)
+        os.replace(scores_path + ".tmp.npz", scores_path)
+        os.utime(os.path.join(self.store_dir, fingerprint))
+
+    def load_scores(self, fingerprint, scorer, seed, repeat_index):
+        """Load the scores of a scorer and repeat.
+
+        Returns
+        -------
+        dict
+            Feature scores of each score name of the scorer.
+        """
+        with np.load(self.__get_scores_path(fingerprint, scorer, seed, repeat_index)) as scores:
+            return dict(scores)
+
+    def get_repeat_num(self, fingerprint, seed):
+        """Get the number of consecutive repeats stored for all scorers.
+        """
+        repeat_num = 0
+        while all(self.has_scores(fingerprint, scorer, seed, repeat_num) for scorer in SCORER_SCORE_NAMES):
+            repeat_num += 1
+        return repeat_num
+
+    def get_ranking(self, fingerprint=None, seed=None, repeat_time=None):
+        """Compute the feature ranking from the stored scores.
+
+        The scores of each score name are averaged over the repeats and the final importance score is the
+        min-max scaled sum of the averaged scores.
+
+        Parameters
+        ----------
+        fingerprint: str, default: None
+            Dataset fingerprint. The most recently updated one if None.
+        seed: int, default: None
+            Seed of the scoring.
+        repeat_time: int, default: None
+            Number of averaged repeats. All stored repeats if None.
+
+        Returns
+        -------
+        DataFrame
+            Feature scores sorted by the final importance score.
+        """
+        if fingerprint is None:
+            fingerprint = self.find_fingerprint()
+        if repeat_time is None:
+            repeat_time = self.get_repeat_num(fingerprint, seed)
+        if repeat_time == 0:
+            raise ValueError(
+                f"No complete repeat of feature scores is stored for {fingerprint} with seed {seed}.")
+        features = pd.Index(self.load_meta(fingerprint)["feature_names"])
+
+        score_dict = {}
+        for scorer, score_names in SCORER_SCORE_NAMES.items():
+            for score_name in score_names:
+                score_dict[score_name] = np.zeros(len(features))
+            for i in range(repeat_time):
+                scores = self.load_scores(fingerprint, scorer, seed, i)
+                for score_name in score_names:
+                    score_dict[score_name] += scores[score_name]
+            for score_name in score_names:
+                score_dict[score_name] /= repeat_time
+
+        # final importance score: sum of the scores in terms of different metrics
+        score_dict["final_importance_score"] = minmax_scale(
+            sum(score_dict.values()))
+        df = pd.DataFrame(score_dict, index=features)
+        return df.sort_values(by=["final_importance_score"], ascending=False)
@@ -8,6 +8,8 @@ from matplotlib import pyplot as plt
 import time
 import datetime
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from sklearn.preprocessing import minmax_scale
 from sklearn.feature_selection import mutual_info_classif
@@ -16,9 +18,129 @@ from sklearn.feature_selection import f_classif
 from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.inspection import permutation_importance
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import f1_score
 
 
 from .dataset_processing import DatasetPreprocess
+from .dataset_storage import read_dataset, write_dataset
+from .flow_schema import downcast_dataset
+from .feature_score_store import FeatureScoreStore, SCORER_SCORE_NAMES
+from ..dp_control.p4_code_generator import get_rf_p4_resources, get_bitstring_width
+
+
+# independent scoring tasks of compute_feature_importances(), the permutation importance uses the fitted RF
+FEATURE_SCORERS = tuple(SCORER_SCORE_NAMES)
+
+# split datasets of a scoring worker, set by _init_feature_score_worker()
+_worker_data = {}
+
+
+def _init_feature_score_worker(dataset_path, sample_size, seed, n_jobs):
+    """Load the cached split (memory-mapped) and draw the stratified subsample in a scoring worker.
+    """
+    dataProc = DatasetPreprocess()
+    # the testing dataset is kept out of the scoring and the selection
+    X_train, _, y_train, _, X_val, y_val = dataProc.load_split(
+        dataset_path=dataset_path, test_size=0.3, val_size=0.3)
+    if sample_size is not None:
+        if sample_size < len(y_train):
+            X_train, _, y_train, _ = train_test_split(
+                X_train, y_train, train_size=sample_size, random_state=seed, stratify=y_train)
+        if sample_size < len(y_val):
+            X_val, _, y_val, _ = train_test_split(
+                X_val, y_val, train_size=sample_size, random_state=seed, stratify=y_val)
+    _worker_data.update(X_train=X_train, X_val=X_val, y_train=y_train, y_val=y_val,
+                        seed=seed, n_jobs=n_jobs)
+
+
+def _compute_feature_scores(scorer, repeat_index):
+    """Compute the min-max scaled feature scores of one scorer and repeat.
+
+    Returns
+    -------
+    dict
+        Feature scores of each score name.
+    float
+        Computation time (s).
+    """
+    start_timestamp = time.time()
+    X_train, X_val = _worker_data["X_train"], _worker_data["X_val"]
+    y_train, y_val = _worker_data["y_train"], _worker_data["y_val"]
+    seed = _worker_data["seed"]
+    random_state = None if seed is None else seed + repeat_index
+    n_jobs = _worker_data["n_jobs"]
+    tree_n_jobs = -1 if n_jobs is None else n_jobs
+
+    if scorer == "mutual_information":
+        # 1: Mutual Information
+        scores = {"mutual_information_score": minmax_scale(
+            mutual_info_classif(X_train, y_train, random_state=random_state))}
+    elif scorer == "impurity":
+        # 3: tree-based impurity importance (Extemely Randomized Trees)
+        clf = ExtraTreesClassifier(n_estimators=100, max_depth=10, n_jobs=tree_n_jobs,
+                                   random_state=random_state)
+        clf = clf.fit(X_train, y_train)
+        scores = {"impurity_score": minmax_scale(clf.feature_importances_)}
+    elif scorer == "rf_permutation":
+        # 4: RF-based feature importance
+        # 5: permutation-based feature importance
+        rf = RandomForestClassifier(n_estimators=100, max_depth=10, n_jobs=tree_n_jobs,
+                                    random_state=random_state)
+        rf = rf.fit(X_train, y_train)
+        scores = {"rf_based_score": minmax_scale(rf.feature_importances_),
+                  "permutation_score": minmax_scale(permutation_importance(
+                      rf, X_val, y_val, n_repeats=5, n_jobs=n_jobs, random_state=random_state).importances_mean)}
+    else:
+        raise ValueError(f"Unknown feature scorer: {scorer}")
+    return scores, time.time() - start_timestamp
+
+
+# rank-ordered split datasets of a sweep worker, set by _init_feature_num_worker()
+_sweep_worker_data = {}
+
+
+def _init_feature_num_worker(dataset_path, ranked_features, n_estimators, max_depth, seed, n_jobs):
+    """Load the cached split (memory-mapped) and reorder its columns by the feature ranking in a sweep worker.
+
+    The matrices are copied once in Fortran order, so the top-k features of each candidate are contiguous
+    column views.
+    """
+    dataProc = DatasetPreprocess()
+    # the testing dataset is kept out of the scoring and the selection
+    X_train, _, y_train, _, X_val, y_val = dataProc.load_split(
+        dataset_path=dataset_path, test_size=0.3, val_size=0.3)
+    column_index = [dataProc.feature_names.index(feature) for feature in ranked_features]
+    _sweep_worker_data.update(X_train=np.asfortranarray(X_train[:, column_index]),
+                              X_val=np.asfortranarray(X_val[:, column_index]),
+                              y_train=np.asarray(y_train), y_val=np.asarray(y_val),
+                              ranked_features=list(ranked_features), n_estimators=n_estimators,
+                              max_depth=max_depth, seed=seed, n_jobs=n_jobs)
+
+
+def _evaluate_feature_num(feature_num):
+    """Train the RF with the top-k features and evaluate it on the validation dataset.
+
+    Returns
+    -------
+    dict
+        Macro F1-score, P4 resources and training time of the candidate.
+    """
+    start_timestamp = time.time()
+    X_train = _sweep_worker_data["X_train"][:, :feature_num]
+    X_val = _sweep_worker_data["X_val"][:, :feature_num]
+    rf = RandomForestClassifier(n_estimators=_sweep_worker_data["n_estimators"],
+                                max_depth=_sweep_worker_data["max_depth"],
+                                n_jobs=_sweep_worker_data["n_jobs"],
+                                random_state=_sweep_worker_data["seed"])
+    rf.fit(X_train, _sweep_worker_data["y_train"])
+    result = {"feature_num": feature_num,
+              "f1_score": f1_score(_sweep_worker_data["y_val"], rf.predict(X_val), average="macro")}
+    result.update(get_rf_p4_resources(
+        rf, _sweep_worker_data["ranked_features"][:feature_num]))
+    result["train_time"] = time.time() - start_timestamp
+    return result
+
 
 class FeatureSelection:
     """Select the most relevant features.
@@ -27,9 +149,15 @@ class FeatureSelection:
     def __init__(self) -> None:
         print("Start building RF classifier for DP-IDS.")
 
-    def compute_feature_importances(self, dataset_path, feature_scores_save_path, logging_path, logging_info, repeat_time=1):
+    def compute_feature_importances(self, dataset_path, feature_scores_save_path, logging_path, logging_info, repeat_time=1,
+                                    process_num=1, sample_size=None, n_jobs=None, seed=None, store_dir=None):
         """ Compute the most relavant features.
 
+        The scorers (mutual information, tree-based impurity, random forest with permutation importance) and their 
+        repeats are independent tasks. They run in a process pool if process_num > 1. The score of each task is 
+        kept in a FeatureScoreStore, so an interrupted computation resumes with the missing tasks and a larger 
+        repeat_time only computes the additional repeats. The ranking is recomputed from the stored scores.
+
         Parameters
         ----------
         dataset_path: str
@@ -42,6 +170,18 @@ class FeatureSelection:
             Information for the logging
         repeat_time: int, default: 1
             The computation rounds for the feature score.
+        process_num: int, default: 1
+            Number of processes running the scoring tasks. The tasks run in the current process if 1.
+        sample_size: int or float, default: None
+            Size (number or fraction of rows) of the stratified subsample of the training and validation 
+            datasets used for scoring. The full datasets are used if None.
+        n_jobs: int, default: None
+            Number of jobs of the tree ensembles and of the permutation importance. The tree ensembles use 
+            all CPUs and the permutation importance a single one if None.
+        seed: int, default: None
+            Seed of the subsampling and of the scorers (seed + repeat index).
+        store_dir: str, default: None
+            Directory of the FeatureScoreStore. <feature_scores_save_path without extension>_store if None.
 
         Returns
         -------
@@ -59,32 +199,48 @@ class FeatureSelection:
         logging.info(
             f"The computation of feature importance procedure starts at {time.asctime(time.localtime(start_computing))}")
 
-        # read the preprocessed data
+        # read the preprocessed data once, the workers memory-map the cached split
         dataProc = DatasetPreprocess()
-        X_train, X_val, y_train, y_val, X_tot, y_tot = dataProc.split_dataset(
-            dataset_path=dataset_path, test_size=0.3)
+        dataProc.load_split(dataset_path=dataset_path, test_size=0.3)
+        features = pd.Index(dataProc.feature_names)
 
-        features = X_train.columns
-        features_num = len(features)
+        # the task scores are only valid for the same dataset, subsample and seed
+        if store_dir is None:
+            store_dir = os.path.splitext(feature_scores_save_path)[0] + "_store"
+        store = FeatureScoreStore(store_dir)
+        fingerprint = store.get_fingerprint(dataset_path, sample_size)
+        store.save_meta(fingerprint, dataset_path, features, seed)
 
-        # 1: Mutual Information
-        mutual_info = np.zeros(features_num)
-        for i in range(repeat_time):
-            # record logging
-            start_timestamp = time.time()
-            logging.info(
-                f"Mutual information: {i+1} starts {time.asctime(time.localtime(start_timestamp))}")
-            mutual_info = mutual_info + \
-                minmax_scale(mutual_info_classif(X_train, y_train))
-            # record logging
-            end_timestamp = time.time()
-            logging.info(
-                f"Mutual information: {i+1} ends {time.asctime(time.localtime(end_timestamp))}")
+        pending_tasks = []
+        for scorer in FEATURE_SCORERS:
+            for i in range(repeat_time):
+                if store.has_scores(fingerprint, scorer, seed, i):
+                    logging.info(f"{scorer}: {i+1} is loaded from the store {store_dir}")
+                else:
+                    pending_tasks.append((scorer, i))
+
+        def save_task_scores(scorer, i, task_scores, task_time):
+            store.save_scores(fingerprint, scorer, seed, i, task_scores)
             logging.info(
-                f"Mutual information: {i+1} takes time {datetime.timedelta(seconds=(end_timestamp - start_timestamp))} ")
-        mutual_info = mutual_info / repeat_time
-        mutual_info_serie = pd.Series(
-            mutual_info, index=features, name="mutual_information_score")
+                f"{scorer}: {i+1} takes time {datetime.timedelta(seconds=task_time)}")
+
+        init_args = (dataset_path, sample_size, seed, n_jobs)
+        if process_num is None or process_num > 1:
+            with ProcessPoolExecutor(max_workers=process_num, initializer=_init_feature_score_worker,
+                                     initargs=init_args) as executor:
+                futures = {executor.submit(_compute_feature_scores, scorer, i): (scorer, i)
+                           for scorer, i in pending_tasks}
+                for future in as_completed(futures):
+                    scorer, i = futures[future]
+                    task_scores, task_time = future.result()
+                    save_task_scores(scorer, i, task_scores, task_time)
+        elif pending_tasks:
+            _init_feature_score_worker(*init_args)
+            for scorer, i in pending_tasks:
+                logging.info(
+                    f"{scorer}: {i+1} starts {time.asctime(time.localtime(time.time()))}")
+                task_scores, task_time = _compute_feature_scores(scorer, i)
+                save_task_scores(scorer, i, task_scores, task_time)
 
         # 2: chi2
         # error: input feature values should be non-negative
@@ -93,78 +249,8 @@ class FeatureSelection:
         # chi2_info_serie = pd.Series(
         #     chi2_info, index=features, name="chi2_score")
 
-        # 3: tree-based impurity importance (Extemely Randomized Trees)
-        clf = ExtraTreesClassifier(n_estimators=100, max_depth=10, n_jobs=-1)
-        impurity_info = np.zeros(features_num)
-        for i in range(repeat_time):
-            # record logging
-            start_timestamp = time.time()
-            logging.info(
-                f"Impurity importance: {i+1} starts {time.asctime(time.localtime(start_timestamp))}")
-            clf = clf.fit(X_train, y_train)
-            impurity_info = impurity_info + \
-                minmax_scale(clf.feature_importances_)
-            # record logging
-            end_timestamp = time.time()
-            logging.info(
-                f"Impurity importance: {i+1} ends {time.asctime(time.localtime(end_timestamp))}")
-            logging.info(
-                f"Impurity importance: {i+1} takes time {datetime.timedelta(seconds=(end_timestamp - start_timestamp))}")
-        impurity_info = impurity_info / repeat_time
-        impurity_info_serie = pd.Series(
-            impurity_info, index=features, name="impurity_score")
-
-        # 4: RF-based feature importance
-        # 5: permutation-based feature importance
-        rf = RandomForestClassifier(n_estimators=100, max_depth=10, n_jobs=-1)
-        rf_importance = np.zeros(features_num)
-        permutation_info = np.zeros(features_num)
-        for i in range(repeat_time):
-            # record logging
-            start_timestamp = time.time()
-            logging.info(
-                f"Random forest importance: {i+1} starts {time.asctime(time.localtime(start_timestamp))}")
-            rf = rf.fit(X_train, y_train)
-            rf_importance = rf_importance + \
-                minmax_scale(rf.feature_importances_)
-            # record logging
-            end_timestamp = time.time()
-            logging.info(
-                f"Random forest importance: {i+1} ends {time.asctime(time.localtime(end_timestamp))}")
-            logging.info(
-                f"Random forest importance: {i+1} takes time {datetime.timedelta(seconds=(end_timestamp - start_timestamp))}")
-            # record logging
-            start_timestamp = time.time()
-            logging.info(
-                f"Permutation importance: {i+1} starts {time.asctime(time.localtime(start_timestamp))}")
-            permutation_info = permutation_info + \
-                minmax_scale(permutation_importance(
-                    rf, X_val, y_val, n_repeats=5).importances_mean)
-            # record logging:
-            end_timestamp = time.time()
-            logging.info(
-                f"Permutation importance: {i+1} ends {time.asctime(time.localtime(end_timestamp))}")
-            logging.info(
-                f"Permutation importance: {i+1} takes time {datetime.timedelta(seconds=(end_timestamp - start_timestamp))}")
-        rf_importance = rf_importance / repeat_time
-        permutation_info = permutation_info / repeat_time
-        rf_importance_serie = pd.Series(
-            rf_importance, index=features, name="rf_based_score")
-        permutation_info_serie = pd.Series(
-            permutation_info, index=features, name="permutation_score")
-
-        # final importance score: sum of the scores in terms of different metrics
-        final_score = minmax_scale(
-            mutual_info + impurity_info + rf_importance + permutation_info)
-        final_score_serie = pd.Series(
-            final_score, index=features, name="final_importance_score")
-
-        # concatenate feature importance series to dataframe
-        df = pd.concat([mutual_info_serie, impurity_info_serie,
-                        rf_importance_serie, permutation_info_serie, final_score_serie], axis=1)
-
-        df = df.sort_values(
-            by=["final_importance_score"], ascending=False)
+        # final importance score: sum of the scores in terms of different metrics, averaged over the repeats
+        df = store.get_ranking(fingerprint, seed, repeat_time)
 
         end_computing = time.time()
         logging.info(
@@ -176,31 +262,160 @@ class FeatureSelection:
         df.to_csv(feature_scores_save_path, index=True)
         return df
 
+    def load_feature_scores(self, feature_scores_path, dataset_path=None, seed=None):
+        """Load the feature scores sorted by the final importance score.
+
+        Parameters
+        ----------
+        feature_scores_path: str
+            Path of feature scores (.csv) or directory of a FeatureScoreStore.
+        dataset_path: str, default: None
+            Path of the scored dataset, selecting its scores in a FeatureScoreStore. The most recently 
+            scored dataset if None.
+        seed: int, default: None
+            Seed of the scores in a FeatureScoreStore. The seed of the last computation if None.
+
+        Returns
+        -------
+        DataFrame
+            Feature scores.
+        """
+        if not os.path.isdir(feature_scores_path):
+            return pd.read_csv(feature_scores_path, index_col=0)
+        store = FeatureScoreStore(feature_scores_path)
+        fingerprint = store.find_fingerprint(dataset_path)
+        if seed is None:
+            seed = store.load_meta(fingerprint)["seed"]
+        return store.get_ranking(fingerprint, seed)
+
     def refine_dataset(self, feature_scores_path, dataset_path, dataset_relevant_save_path, relevant_features_num):
         """Build the training dataset with the relevant features. 
 
         Parameters
         ----------
         feature_scores_path: str
-            Path of feature scores.
+            Path of feature scores (.csv) or directory of a FeatureScoreStore.
         dataset_path: str
             Path of training dataset with full features.
         dataset_relevant_save_path: str
-            Path of saving dataset with relevant features
+            Path of saving dataset with relevant features, the format is given by the extension (see dataset_storage).
         relevant_features_num: int
             Number of extracted relevant features.
         """
         # get the relevant features
-        feature_scores_df = pd.read_csv(feature_scores_path, index_col=0)
+        feature_scores_df = self.load_feature_scores(
+            feature_scores_path, dataset_path)
         relevant_features = feature_scores_df.iloc[:relevant_features_num, :]
 
-        # read the preprocessed dataset with full compatibal features
-        df = pd.read_csv(dataset_path)
-        # save the dataset with the relevant features
+        # read only the relevant features of the preprocessed dataset (column projection)
         relevant_features_index = relevant_features.index.tolist()
-        df = df[relevant_features_index + ["Label"]]
-        # set index=False to avoid reading the first column as Unnamed: 0
-        df.to_csv(dataset_relevant_save_path, index=False)
+        df, _ = downcast_dataset(read_dataset(
+            dataset_path, columns=relevant_features_index + ["Label"]))
+        # save the dataset with the relevant features
+        write_dataset(df, dataset_relevant_save_path)
+
+    def sweep_feature_num(self, feature_scores_path, dataset_path, sweep_results_path, feature_nums=None,
+                          n_estimators=3, max_depth=5, process_num=1, n_jobs=None, seed=None):
+        """Evaluate the RF of DP-IDS with the top-k relevant features for several k.
+
+        The dataset is read once (cached split of load_split()) and each candidate trains on column views of
+        the rank-ordered matrix instead of a refined dataset. The candidates run in a process pool if 
+        process_num > 1. Besides the macro F1-score on the validation dataset, the P4 resources of each 
+        candidate (bit width of the flow entry, match action tables and rules, see P4CodeGenerator) are 
+        reported, so the number of relevant features can trade accuracy against switch memory.
+
+        Parameters
+        ----------
+        feature_scores_path: str
+            Path of feature scores (.csv) or directory of a FeatureScoreStore.
+        dataset_path: str
+            Path of training dataset with full features.
+        sweep_results_path: str
+            Path for saving the results of the candidates (.csv).
+        feature_nums: list, default: None
+            Numbers of relevant features to evaluate. All numbers from 1 to the number of features if None.
+        n_estimators: int, default: 3
+            The number of trees in the RF.
+        max_depth: int, default: 5
+            The maximum depth of the tree in the RF.
+        process_num: int, default: 1
+            Number of processes running the candidates. The candidates run in the current process if 1.
+        n_jobs: int, default: None
+            Number of jobs of each RF. A single job in a process pool and all CPUs otherwise if None.
+        seed: int, default: None
+            Seed of the RFs.
+
+        Returns
+        -------
+        DataFrame:
+            Results of the candidates indexed by the number of relevant features.
+        """
+        feature_scores_df = self.load_feature_scores(
+            feature_scores_path, dataset_path)
+        ranked_features = feature_scores_df.index.tolist()
+        if feature_nums is None:
+            feature_nums = range(1, len(ranked_features) + 1)
+        feature_nums = sorted(set(feature_nums))
+        if feature_nums[0] < 1 or feature_nums[-1] > len(ranked_features):
+            raise ValueError(
+                f"The number of relevant features should be between 1 and {len(ranked_features)}.")
+
+        # cache the split once before the workers memory-map it
+        dataProc = DatasetPreprocess()
+        dataProc.load_split(dataset_path=dataset_path, test_size=0.3)
+        missing_features = set(ranked_features) - set(dataProc.feature_names)
+        if missing_features:
+            raise ValueError(
+                f"The ranked features {sorted(missing_features)} are not in the dataset.")
+        # features without a P4 bit width cannot be stored in the switch (raises TypeError)
+        get_bitstring_width(ranked_features[:feature_nums[-1]])
+
+        use_pool = process_num is None or process_num > 1
+        if n_jobs is None:
+            n_jobs = 1 if use_pool else -1
+        init_args = (dataset_path, ranked_features,
+                     n_estimators, max_depth, seed, n_jobs)
+        results = []
+
+        def add_result(result):
+            print(f"Feature num {result['feature_num']}: F1 {result['f1_score']:.4f}, "
+                  f"{result['bitstring_bits']} bits, {result['rule_num']} rules.")
+            results.append(result)
+
+        if use_pool:
+            with ProcessPoolExecutor(max_workers=process_num, initializer=_init_feature_num_worker,
+                                     initargs=init_args) as executor:
+                futures = [executor.submit(_evaluate_feature_num, feature_num)
+                           for feature_num in feature_nums]
+                for future in as_completed(futures):
+                    add_result(future.result())
+        else:
+            _init_feature_num_worker(*init_args)
+            for feature_num in feature_nums:
+                add_result(_evaluate_feature_num(feature_num))
+
+        df = pd.DataFrame(results).set_index("feature_num").sort_index()
+        df.to_csv(sweep_results_path, index=True)
+        return df
+
+    def plot_feature_num_sweep(self, sweep_results_path, fig_path):
+        """Plot the F1-score and the P4 resources against the number of relevant features.
+
+        Parameters
+        ----------
+        sweep_results_path: str
+            Path of the results of sweep_feature_num().
+        fig_path: str
+            Path of saving figures.
+        """
+        df = pd.read_csv(sweep_results_path, index_col="feature_num")
+        fig, axes = plt.subplots(1, 3, figsize=(15, 4))
+        df["f1_score"].plot(ax=axes[0], style=".-", xlabel="number of features", ylabel="macro f1-score")
+        df["bitstring_bits"].plot(ax=axes[1], style=".-", xlabel="number of features",
+                                  ylabel="bits of flow entry")
+        df["rule_num"].plot(ax=axes[2], style=".-", xlabel="number of features", ylabel="number of rules")
+        fig.tight_layout()
+        fig.savefig(fig_path, dpi=300, bbox_inches="tight")
 
     def plot_relevant_features(self, feature_scores_path, fig_path, relevant_features_num):
             """Plot the feature scores of the relevant features.
@@ -208,14 +423,14 @@ class FeatureSelection:
             Parameters
             ----------
             feature_scores_path: str
-                Path of feature scores.
+                Path of feature scores (.csv) or directory of a FeatureScoreStore.
             fig_path: str
                 Path of saving figures.
             relevant_features_num:
                 Number of extrcated relevant features.
             """
             # get the relevant features
-            feature_scores_df = pd.read_csv(feature_scores_path, index_col=0)
+            feature_scores_df = self.load_feature_scores(feature_scores_path)
             relevant_features = feature_scores_df.iloc[:relevant_features_num, :]
             ax = relevant_features.plot(kind="bar", figsize=(
                 15, 5), rot=70)
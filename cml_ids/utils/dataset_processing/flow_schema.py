@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+
+# bit widths of the P4 macros of the feature families (see cml_ids/p4/dp_ids_switch.p4)
+P4_BIT_WIDTHS = {"FLOW_TIME_BITS": 48,
+                 "FLOW_BYTES_BITS": 32,
+                 "FLOW_COUNT_BITS": 8,
+                 "FLOW_SPLT_DIRECTION_BITS": 8,
+                 "1": 1}
+
+# P4 bit width macro of the feature families stored in the flow entry of the switch
+FAMILY_P4_BITS = {"time": "FLOW_TIME_BITS",
+                  "bytes": "FLOW_BYTES_BITS",
+                  "packets": "FLOW_COUNT_BITS",
+                  "ps": "FLOW_BYTES_BITS",
+                  "protocol": "1",
+                  "splt_direction": "FLOW_SPLT_DIRECTION_BITS"}
+
+# narrowest dtype of the feature families holding the values of their P4 bit widths.
+# Families which are not listed (e.g. id, vlan_id) get the narrowest dtype of their values.
+FAMILY_DTYPES = {"time": np.uint64,
+                 "bytes": np.uint32,
+                 "packets": np.uint8,
+                 "ps": np.uint32,
+                 "protocol": np.uint8,
+                 "splt_direction": np.uint8,
+                 "port": np.uint16,
+                 "ip": "category",
+                 "mac": "category",
+                 "oui": "category"}
+
+UNSIGNED_DTYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+SIGNED_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+# largest magnitude of floats downcast to float32 (integers up to 2^24 are exact in float32)
+FLOAT32_MAX_SAFE = 2 ** 24
+# the label keeps its dtype (e.g. "Benign"/"Attack" strings or 0/1 integers)
+LABEL_FEATURE = "Label"
+
+
+def get_feature_family(feature):
+    """Get the family of a flow feature of Pcap2Flow.
+
+    The first families are matched in the same order as the P4 code generator maps the features to bit widths.
+
+    Parameters
+    ----------
+    feature: str
+        Feature name.
+
+    Returns
+    -------
+    str {'time', 'bytes', 'packets', 'ps', 'protocol', 'splt_direction', 'port', 'ip', 'mac', 'oui', 'other'}
+        Feature family.
+    """
+    if ("ms" in feature):
+        return "time"
+    elif ("bytes" in feature):
+        return "bytes"
+    elif ("packets" in feature):
+        return "packets"
+    elif ("ps" in feature and "psh" not in feature):
+        return "ps"
+    elif ("protocol" in feature):
+        return "protocol"
+    elif ("splt_direction" in feature):
+        return "splt_direction"
+    elif ("port" in feature):
+        return "port"
+    elif feature.endswith("_ip"):
+        return "ip"
+    elif feature.endswith("_mac"):
+        return "mac"
+    elif feature.endswith("_oui"):
+        return "oui"
+    return "other"
+
+
+def get_p4_bits_type(feature):
+    """Get the P4 bit width macro of a feature stored in the flow entry of the switch.
+
+    Parameters
+    ----------
+    feature: str
+        Feature name.
+
+    Returns
+    -------
+    str
+        P4 macro of the bit width (or the bit width itself).
+    """
+    family = get_feature_family(feature)
+    if family not in FAMILY_P4_BITS:
+        raise TypeError("Feature name is illegal.")
+    return FAMILY_P4_BITS[family]
+
+
+def get_p4_bit_width(feature):
+    """Get the bit width of a feature stored in the flow entry of the switch.
+
+    Parameters
+    ----------
+    feature: str
+        Feature name.
+
+    Returns
+    -------
+    int
+        Number of bits.
+    """
+    return P4_BIT_WIDTHS[get_p4_bits_type(feature)]
+
+
+def get_compact_dtype(feature, serie):
+    """Get the narrowest safe dtype of a feature column.
+
+    Integers get the dtype of their family, or the narrowest dtype holding their values if the family dtype is
+    too small (fallback) or not given. Floats are downcast to float32 if their magnitude is at most 2^24 and the
+    rounding keeps their integer parts, which the switch uses (e.g. the floored bidirectional_mean_ps). Strings
+    (IP, MAC, OUI and other non-numeric features) become categoricals.
+
+    Parameters
+    ----------
+    feature: str
+        Feature name.
+    serie: Series (pandas)
+        Feature values.
+
+    Returns
+    -------
+    dtype
+        Compact dtype. The current dtype if no safe downcast exists.
+    """
+    family = get_feature_family(feature)
+    if FAMILY_DTYPES.get(family) == "category" or not pd.api.types.is_numeric_dtype(serie) \
+            or isinstance(serie.dtype, pd.CategoricalDtype):
+        return "category"
+    if pd.api.types.is_bool_dtype(serie) or len(serie) == 0:
+        return serie.dtype
+    if pd.api.types.is_float_dtype(serie):
+        values = serie.to_numpy(dtype=np.float64, na_value=np.nan)
+        if serie.notna().any() and np.nanmax(np.abs(values)) > FLOAT32_MAX_SAFE:
+            return serie.dtype
+        with np.errstate(invalid="ignore"):
+            keeps_integer_part = np.array_equal(np.floor(values.astype(np.float32)), np.floor(values),
+                                                equal_nan=True)
+        return np.float32 if keeps_integer_part else serie.dtype
+
+    min_value = serie.min()
+    max_value = serie.max()
+    if min_value < 0:
+        candidates = SIGNED_DTYPES
+    else:
+        family_dtype = FAMILY_DTYPES.get(family, np.uint8)
+        candidates = UNSIGNED_DTYPES[UNSIGNED_DTYPES.index(family_dtype):]
+    for dtype in candidates:
+        if np.iinfo(dtype).min <= min_value and max_value <= np.iinfo(dtype).max:
+            return dtype
+    return serie.dtype
+
+
+def get_compact_dtypes(df):
+    """Get the narrowest safe dtype of each feature of a flow-based dataset (see get_compact_dtype()).
+
+    Parameters
+    ----------
+    df: DataFrame
+        Flow-based dataset.
+
+    Returns
+    -------
+    dict
+        Compact dtype of each feature, without the label.
+    """
+    return {feature: get_compact_dtype(feature, df[feature])
+            for feature in df.columns if feature != LABEL_FEATURE}
+
+
+def merge_compact_dtypes(dtypes, df):
+    """Widen the compact dtypes of the former chunks of a dataset to hold a new chunk.
+
+    The merged dtypes of all chunks are the compact dtypes of the whole dataset, so a dataset written chunk by
+    chunk gets the same schema as when it is downcast in memory. Categoricals get the sorted union of the
+    categories of the chunks.
+
+    Parameters
+    ----------
+    dtypes: dict
+        Compact dtype of each feature of the former chunks (see get_compact_dtypes()), empty for the first chunk.
+    df: DataFrame
+        New chunk.
+
+    Returns
+    -------
+    dict
+        Compact dtype of each feature of the former chunks and the new chunk.
+    """
+    if len(df) == 0:
+        return dtypes
+    merged_dtypes = dict(dtypes)
+    for feature, dtype in get_compact_dtypes(df).items():
+        if dtype == "category":
+            categories = set(df[feature].dropna().unique())
+            if feature in dtypes:
+                categories |= set(dtypes[feature].categories)
+            merged_dtypes[feature] = pd.CategoricalDtype(sorted(categories))
+        elif feature in dtypes:
+            merged_dtype = np.result_type(dtypes[feature], dtype)
+            # no integer dtype holds both (uint64 and signed values), the chunk dtype is kept as downcast_dataset()
+            if pd.api.types.is_float_dtype(merged_dtype) and pd.api.types.is_integer_dtype(dtype) \
+                    and pd.api.types.is_integer_dtype(dtypes[feature]):
+                merged_dtype = df[feature].dtype
+            merged_dtypes[feature] = merged_dtype
+        else:
+            merged_dtypes[feature] = dtype
+    return merged_dtypes
+
+
+def downcast_dataset(df, report=True):
+    """Convert the features of a flow-based dataset to their narrowest safe dtypes, the label is kept.
+
+    Parameters
+    ----------
+    df: DataFrame
+        Flow-based dataset, e.g. from Pcap2Flow or DatasetPreprocess.
+    report: bool, default: True
+        Print the memory of the dataset before and after the conversion.
+
+    Returns
+    -------
+    DataFrame
+        The dataset with compact dtypes.
+    dict
+        Memory (MB) before and after the conversion and the saved fraction.
+    """
+    memory_before = df.memory_usage(deep=True).sum() / 2 ** 20
+    df = df.astype(get_compact_dtypes(df))
+    memory_after = df.memory_usage(deep=True).sum() / 2 ** 20
+
+    memory_report = {"memory_before_mb": memory_before,
+                     "memory_after_mb": memory_after,
+                     "saving_ratio": 1 - memory_after / memory_before if memory_before > 0 else 0.0}
+    if report:
+        print(f"Compact dtypes: {memory_before:.1f} MB -> {memory_after:.1f} MB "
+              f"({memory_report['saving_ratio']:.0%} saved).")
+    return df, memory_report
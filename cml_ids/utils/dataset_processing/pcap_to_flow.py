@@ -4,6 +4,66 @@
 from nfstream import NFStreamer, NFPlugin
 import pandas as pd
 import numpy as np
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import threading
+import time
+import psutil
+
+from .dataset_storage import write_dataset, iter_dataset_chunks, DatasetChunkWriter
+
+
+class PeakRSSSampler:
+    """Sample the memory of the current process and its children (e.g. the meters of NFStreamer) in a
+    background thread, as a context manager.
+
+    The forked children share pages with the process, so the proportional set size (PSS, shared pages split
+    among the processes) is summed where available (Linux) instead of the RSS.
+
+    Attributes
+    ----------
+    interval: float
+        Time (in seconds) between two samples.
+    peak_rss: int
+        Largest sampled sum of the PSS (RSS if not available) in bytes of the process and its children.
+    """
+
+    def __init__(self, interval=0.05) -> None:
+        self.interval = interval
+        self.peak_rss = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        """Sample the RSS of the process and its children once.
+        """
+        process = psutil.Process()
+        rss = 0
+        for p in [process] + process.children(recursive=True):
+            try:
+                memory = p.memory_full_info()
+                rss += getattr(memory, "pss", memory.rss)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                # the child exited in between
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
 
 
 class FlowSlicer(NFPlugin):
@@ -106,6 +166,47 @@ class FlowSlicer(NFPlugin):
             self.__feature_copy(flow)
 
 
+class FlowSnapshotSlicer(NFPlugin):
+    """Aggregate packets into flows including the first few packets, copying the features only once.
+
+    Implements NFPlugin. FlowSlicer copies all features into .udps on every packet up to the limit. This plugin
+    snapshots the features once: when the flow reaches bidirectional_pkt_count packets, or at flow expiry if the
+    flow is shorter. Flows shorter than the limit therefore keep the expiration_id assigned at expiry (FlowSlicer
+    keeps the value of the last copied packet).
+
+    Attributes
+    -----------
+    bidirectional_pkt_count: int
+        Number of packets to aggregate.
+    features: tuple
+        Names of the copied flow features. All features in Pcap2Flow.__slots__ if None is given.
+
+    """
+
+    def __init__(self, bidirectional_pkt_count, features=None):
+        if features is None:
+            features = Pcap2Flow.__slots__
+        super().__init__(bidirectional_pkt_count=bidirectional_pkt_count,
+                         features=tuple(features))
+
+    def __snapshot(self, flow):
+        udps = flow.udps
+        for feature in self.features:
+            setattr(udps, feature, getattr(flow, feature))
+
+    def on_init(self, packet, flow):
+        if flow.bidirectional_packets >= self.bidirectional_pkt_count:
+            self.__snapshot(flow)
+
+    def on_update(self, packet, flow):
+        if flow.bidirectional_packets == self.bidirectional_pkt_count:
+            self.__snapshot(flow)
+
+    def on_expire(self, flow):
+        if flow.bidirectional_packets < self.bidirectional_pkt_count:
+            self.__snapshot(flow)
+
+
 class Pcap2Flow:
     """Aggregate pcap (packet-based) dataset into flow-based dataset.
 
@@ -219,7 +320,7 @@ class Pcap2Flow:
         pcap_path: str 
             Path of pcap dataset.
         save_path: str
-            Path of the aggregated dataset.
+            Path of the aggregated dataset, the format is given by the extension (see dataset_storage).
         flow_extract_type: str, {'sub-flow', 'complete-flow', 'packet'}
             Flow aggregation type
         limit: int, optional
@@ -239,17 +340,20 @@ class Pcap2Flow:
             df = df.iloc[:, len(self.__slots__):]
             # change the names of columns (delete "udps.")
             df.rename(columns=self.__map_udps_features(), inplace=True)
-            # set index=False to avoid reading the first column as Unnamed: 0
-            df.to_csv(save_path, index=False)
+            write_dataset(df, save_path)
         elif flow_extract_type == 'complete-flow':
             print('Extracting complete flow information......')
             my_streamer = NFStreamer(source=pcap_path,
                                      n_dissections=0,
                                      accounting_mode=3,
                                      statistical_analysis=True) 
-            my_streamer.to_csv(path=save_path, columns_to_anonymize=(),
-                               flows_per_file=0,
-                               rotate_files=0)
+            if save_path.endswith(".csv"):
+                my_streamer.to_csv(path=save_path, columns_to_anonymize=(),
+                                   flows_per_file=0,
+                                   rotate_files=0)
+            else:
+                write_dataset(my_streamer.to_pandas(
+                    columns_to_anonymize=[]), save_path)
         elif flow_extract_type == 'packet':
             print('Extracting packet-based information......')
             my_streamer = NFStreamer(source=pcap_path,
@@ -264,8 +368,7 @@ class Pcap2Flow:
             df = df.iloc[:, len(self.__slots__):]
             # change the names of columns (delete "udps.")
             df.rename(columns=self.__map_udps_features(), inplace=True)
-            # set index=False to avoid reading the first column as Unnamed: 0
-            df.to_csv(save_path, index=False)
+            write_dataset(df, save_path)
         print(f'Flow extraction is accomplished. Saving path: {save_path}')
 
         # split features of early statstical analysis.
@@ -281,3 +384,270 @@ class Pcap2Flow:
         
         df = df.drop(split_columns, axis=1)
         """
+
+    def to_flow_streaming(self, pcap_path, save_path, flow_extract_type, limit=None, chunk_size=100000, bpf_filter=None,
+                          features=None):
+        """Aggregate pcap datasets into flow-based datasets with bounded memory.
+
+        Iterate the flows of NFStreamer instead of materializing all flows in a DataFrame. Only the features
+        in __slots__ (or the given features) are kept and written in chunks. For 'sub-flow' and 'packet', the 
+        features are snapshotted once per flow by FlowSnapshotSlicer.
+
+        Parameters
+        ----------
+        pcap_path: str 
+            Path of pcap dataset.
+        save_path: str
+            Path of the aggregated dataset, the format is given by the extension (see dataset_storage).
+        flow_extract_type: str, {'sub-flow', 'complete-flow', 'packet'}
+            Flow aggregation type
+        limit: int, optional
+            Number of bidirectional packets within a flow to aggregate ('sub-flow' only).
+        chunk_size: int, default: 100000
+            Number of flows kept in memory before they are written.
+        bpf_filter: str, default: None
+            BPF filter applied to the packets, e.g. to extract one shard of a pcap.
+        features: list, default: None
+            Flow features to extract, e.g. the features in used_features.csv. The flow id is always kept. 
+            All features in __slots__ if None.
+
+        Returns
+        -------
+        dict
+            Number of flows, extraction time (s), flows per second and peak RSS (MB) of the process and its
+            children during the extraction.
+        """
+        start_timestamp = time.time()
+        if features is None:
+            features = self.__slots__
+        feature_names = tuple(feature for feature in features if feature != 'id')
+        if flow_extract_type == 'sub-flow':
+            print('Extrcating sub-flow information (streaming)......')
+            udps = FlowSnapshotSlicer(bidirectional_pkt_count=limit, features=feature_names)
+        elif flow_extract_type == 'complete-flow':
+            print('Extracting complete flow information (streaming)......')
+            udps = None
+        elif flow_extract_type == 'packet':
+            print('Extracting packet-based information (streaming)......')
+            udps = FlowSnapshotSlicer(bidirectional_pkt_count=1, features=feature_names)
+        else:
+            raise ValueError(
+                "The flow extraction type should be 'sub-flow', 'complete-flow' or 'packet'.")
+        my_streamer = NFStreamer(source=pcap_path,
+                                 n_dissections=0,
+                                 accounting_mode=3,
+                                 udps=udps,
+                                 statistical_analysis=True,
+                                 bpf_filter=bpf_filter)
+
+        # the udps features have the same names as the flow features.
+        # the flow id is taken from the flow, it is not assigned yet when the udps features are initialized
+        if len(feature_names) > 1:
+            get_features = attrgetter(*feature_names)
+        else:
+            # attrgetter returns a single value instead of a tuple for one attribute
+            def get_features(obj): return tuple(getattr(obj, feature) for feature in feature_names)
+        writer = DatasetChunkWriter(save_path, ('id',) + feature_names)
+        flow_num = 0
+        rows = []
+        # the peak RSS of this call, including the meter processes of NFStreamer
+        with PeakRSSSampler() as rss_sampler:
+            for flow in my_streamer:
+                rows.append((flow.id,) + get_features(flow if udps is None else flow.udps))
+                if len(rows) >= chunk_size:
+                    writer.write(rows)
+                    flow_num += len(rows)
+                    rows = []
+            if rows:
+                writer.write(rows)
+                flow_num += len(rows)
+            writer.close()
+
+        extraction_time = time.time() - start_timestamp
+        stats = {"flows": flow_num,
+                 "seconds": extraction_time,
+                 "flows_per_sec": flow_num / extraction_time if extraction_time > 0 else 0.0,
+                 "peak_rss_mb": rss_sampler.peak_rss / 2 ** 20}
+        print(f'Flow extraction is accomplished. Saving path: {save_path}. '
+              f'{stats["flows"]} flows, {stats["flows_per_sec"]:.0f} flows/s, peak RSS {stats["peak_rss_mb"]:.1f} MB')
+        return stats
+
+    @staticmethod
+    def get_shard_bpf_filters(shard_num):
+        """Build BPF filters splitting the packets of a pcap into shards by a symmetric IP hash.
+
+        The shard of a packet is the sum of the last bytes of its source and destination IPv4 addresses
+        modulo shard_num. Both directions of a flow are therefore in the same shard and no flow crosses 
+        shard boundaries. Non-IPv4 packets (e.g. IPv6) are extracted by the first shard.
+
+        Parameters
+        ----------
+        shard_num: int
+            Number of shards.
+
+        Returns
+        -------
+        list
+            BPF filter of each shard.
+        """
+        bpf_filters = [f"(ip and ((ip[15] + ip[19]) % {shard_num} = {i}))" for i in range(shard_num)]
+        bpf_filters[0] = bpf_filters[0] + " or (not ip)"
+        return bpf_filters
+
+    def to_flow_parallel(self, pcap_path_list, save_path, flow_extract_type, limit=None, process_num=None,
+                         shard_num=1, chunk_size=100000, shard_dir=None, features=None):
+        """Aggregate several pcap datasets (or shards of one pcap) into one flow-based dataset in parallel.
+
+        Each pcap (or each shard if shard_num > 1) is extracted by to_flow_streaming() in a process pool.
+        The per-shard outputs are merged and flows appearing in several shards (e.g. pcaps split by time with
+        overlaps) are deduplicated by 5-tuple and bidirectional_first_seen_ms. A flow can only be duplicated in
+        the shards of the same IP hash of other pcaps, within the first seen time range of such a shard. Only
+        the keys of the flows in these overlap windows are kept for the deduplication. The flow ids are
+        renumbered.
+
+        Parameters
+        ----------
+        pcap_path_list: list
+            Paths of pcap datasets, e.g. the pcaps of several days or a huge pcap pre-split by time.
+        save_path: str
+            Path of the merged dataset, the format is given by the extension (see dataset_storage).
+        flow_extract_type: str, {'sub-flow', 'complete-flow', 'packet'}
+            Flow aggregation type
+        limit: int, optional
+            Number of bidirectional packets within a flow to aggregate ('sub-flow' only).
+        process_num: int, default: None
+            Number of processes. Use the number of CPUs if None.
+        shard_num: int, default: 1
+            Number of shards each pcap is split into by a symmetric IP hash (see get_shard_bpf_filters()).
+        chunk_size: int, default: 100000
+            Number of flows kept in memory before they are written.
+        shard_dir: str, default: None
+            Directory for the per-shard outputs. A temporary directory is used and removed if None.
+        features: list, default: None
+            Flow features to extract (see to_flow_streaming()). They have to include the 5-tuple and 
+            bidirectional_first_seen_ms used for deduplication. All features in __slots__ if None.
+
+        Returns
+        -------
+        list
+            Statistics of each shard returned by to_flow_streaming().
+        """
+        start_timestamp = time.time()
+        flow_key = ["src_ip", "dst_ip", "src_port", "dst_port",
+                    "protocol", "bidirectional_first_seen_ms"]
+        if features is None:
+            features = self.__slots__
+        columns = ('id',) + tuple(feature for feature in features if feature != 'id')
+        missing_key = [column for column in flow_key if column not in columns]
+        if missing_key:
+            raise ValueError(f"The features for deduplication are not extracted: {missing_key}")
+        with tempfile.TemporaryDirectory(dir=shard_dir) as tmp_dir:
+            shard_dir = shard_dir or tmp_dir
+            bpf_filters = self.get_shard_bpf_filters(shard_num) if shard_num > 1 else [None]
+            tasks = []
+            for i, pcap_path in enumerate(pcap_path_list):
+                for j, bpf_filter in enumerate(bpf_filters):
+                    shard_path = os.path.join(shard_dir, f"shard_{i}_{j}.parquet")
+                    tasks.append((pcap_path, shard_path, bpf_filter))
+
+            with ProcessPoolExecutor(max_workers=process_num) as executor:
+                futures = [executor.submit(self.to_flow_streaming, pcap_path, shard_path,
+                                           flow_extract_type, limit, chunk_size, bpf_filter, features)
+                           for pcap_path, shard_path, bpf_filter in tasks]
+                shard_stats = [future.result() for future in futures]
+
+            # first seen time range of each shard
+            time_ranges = []
+            for _, shard_path, _ in tasks:
+                time_range = (np.inf, -np.inf)
+                for df in iter_dataset_chunks(shard_path, chunk_size=chunk_size, columns=[flow_key[-1]]):
+                    if len(df):
+                        time_range = (min(time_range[0], df[flow_key[-1]].min()),
+                                      max(time_range[1], df[flow_key[-1]].max()))
+                time_ranges.append(time_range)
+
+            # merge the shards, dropping flows already seen in a previous shard
+            seen_keys = {}
+            writer = DatasetChunkWriter(save_path, columns)
+            flow_num = 0
+            duplicate_num = 0
+            for k, (_, shard_path, _) in enumerate(tasks):
+                # shards of the same IP hash (index in bpf_filters) in the other pcaps
+                hash_index = k % len(bpf_filters)
+                other_ranges = [time_ranges[m] for m in range(hash_index, len(tasks), len(bpf_filters)) if m != k]
+                for df in iter_dataset_chunks(shard_path, chunk_size=chunk_size):
+                    first_seen = df[flow_key[-1]].to_numpy()
+                    overlapping = np.zeros(len(df), dtype=bool)
+                    for start, end in other_ranges:
+                        overlapping |= (first_seen >= start) & (first_seen <= end)
+                    if overlapping.any():
+                        keys = pd.MultiIndex.from_frame(df.loc[overlapping, flow_key])
+                        duplicated = keys.duplicated()
+                        if hash_index in seen_keys:
+                            duplicated |= keys.isin(seen_keys[hash_index])
+                            seen_keys[hash_index] = seen_keys[hash_index].append(keys[~duplicated])
+                        else:
+                            seen_keys[hash_index] = keys[~duplicated]
+                        keep = np.ones(len(df), dtype=bool)
+                        keep[np.flatnonzero(overlapping)[duplicated]] = False
+                        df = df[keep]
+                        duplicate_num += len(keep) - len(df)
+                    df = df.copy()
+                    df["id"] = np.arange(flow_num, flow_num + len(df))
+                    flow_num += len(df)
+                    writer.write(df)
+            writer.close()
+
+        print(f"Merged {len(tasks)} shards into {flow_num} flows ({duplicate_num} duplicates removed) "
+              f"in {time.time() - start_timestamp:.1f} s. Saving path: {save_path}")
+        return shard_stats
+
+    def benchmark_flow_slicer(self, pcap_path, limit, features=None):
+        """Compare the sub-flow extraction throughput of FlowSlicer and FlowSnapshotSlicer.
+
+        Both plugins are run on the same pcap and the extracted features are checked to be identical
+        (except id and expiration_id, see FlowSnapshotSlicer).
+
+        Parameters
+        ----------
+        pcap_path: str 
+            Path of pcap dataset.
+        limit: int
+            Number of bidirectional packets within a flow to aggregate.
+        features: list, default: None
+            Flow features copied by FlowSnapshotSlicer, e.g. the features in used_features.csv.
+            All features in __slots__ if None.
+
+        Returns
+        -------
+        dict
+            Number of flows and flows per second of both plugins.
+        """
+        if features is None:
+            features = self.__slots__
+        feature_names = [feature for feature in features
+                         if feature not in ('id', 'expiration_id')]
+        get_features = attrgetter(*feature_names)
+        result = {}
+        rows_dict = {}
+        for name, udps in (("flow_slicer", FlowSlicer(bidirectional_pkt_count=limit)),
+                           ("flow_snapshot_slicer", FlowSnapshotSlicer(bidirectional_pkt_count=limit,
+                                                                       features=features))):
+            my_streamer = NFStreamer(source=pcap_path,
+                                     n_dissections=0,
+                                     accounting_mode=3,
+                                     udps=udps,
+                                     statistical_analysis=True)
+            start_timestamp = time.perf_counter()
+            rows = [get_features(flow.udps) for flow in my_streamer]
+            extraction_time = time.perf_counter() - start_timestamp
+            rows_dict[name] = rows
+            result[name + "_flows"] = len(rows)
+            result[name + "_flows_per_sec"] = len(rows) / extraction_time if extraction_time > 0 else 0.0
+
+        if rows_dict["flow_slicer"] != rows_dict["flow_snapshot_slicer"]:
+            raise ValueError("Extracted features differ between both plugins.")
+        print(f"FlowSlicer: {result['flow_slicer_flows_per_sec']:.0f} flows/s, "
+              f"FlowSnapshotSlicer: {result['flow_snapshot_slicer_flows_per_sec']:.0f} flows/s, "
+              f"speedup: {result['flow_snapshot_slicer_flows_per_sec'] / result['flow_slicer_flows_per_sec']:.2f}x")
+        return result
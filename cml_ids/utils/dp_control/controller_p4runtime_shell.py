@@ -7,12 +7,15 @@ import pandas as pd
 import pickle
 import numpy as np
 import threading
+import queue
 import time
 
 from .p4_proto_parser import P4ProtoTxtParser
+from .packet_in_decoder import PacketInDecoder
+from .p4runtime_writer import P4RuntimeTableWriter
+from .p4runtime_status_poller import P4RuntimeStatusPoller
+from ..ml_model_training.ensemble_artifact import EnsembleScorer, CompactNN
 import p4runtime_sh.shell as sh
-from keras.models import load_model
-from xgboost import XGBClassifier
 
 
 class Controller():
@@ -21,11 +24,18 @@ class Controller():
     Attributes
     ----------
     model_nn_dir: saved by calling save() method in keras.
-        Dictionary of NN model.
+        Dictionary of NN model, or the path (.npz) of the compact NN saved by CPIDSBuilder.optimize_nn().
     model_rf_path: .pkl (pickle)
         Path of RF model.
     model_xgb_path: .json 
         Path of XGB model.
+    ensemble_path: .npz
+        Path of the ensemble artifact exported by CPIDSBuilder.export_ensemble(). If given, the NN, RF 
+        and XGB models are not loaded.
+    ensemble_scorer: EnsembleScorer
+        Scorer of the ensemble artifact. None if the models are loaded.
+    ensemble_time_sum: float
+        Sum of the prediction time of the ensemble artifact.
     used_features: list
         Features used for prediction.
     number_to_switch: int
@@ -38,6 +48,27 @@ class Controller():
         Sum of the prediction time of XGB classifier. 
     id2name_dict: dict
         Mapping feature ID to name. (ID from proto file)
+    decoder: PacketInDecoder
+        Precompiled decoder of the PacketIn metadata.
+    classify_queue: Queue
+        Queue of the classification requests waiting to be classified in batches.
+    batch_num: int
+        Number of classified batches.
+    batch_size_sum: int
+        Number of flows in the classified batches.
+    batch_latency_sum: float
+        Sum of the latency of the classified batches, from enqueuing the first request of a batch to sending its
+        last response.
+    batch_latency_max: float
+        Maximum latency of the classified batches.
+    ingest_queue: Queue
+        Bounded queue of the received packets between the receiver and the inference workers (pipeline).
+    response_queue: Queue
+        Bounded queue of the predicted batches between the inference workers and the sender (pipeline).
+    pipeline_stats: dict
+        Counters of the pipeline (received, dropped, classified and sent flows, maximum queue depths).
+    status_poller: P4RuntimeStatusPoller
+        Poller of the counters and trace registers of the switch. None before reading the switch status.
     """
     # Packet sent to this CPU_PORT will be sent to controller or switch
     CPU_PORT = 101
@@ -53,21 +84,52 @@ class Controller():
     CLASSIFY_REQUEST = '1'
     CLASSIFY_RESPONSE = '2'
 
-    def __init__(self, model_nn_dir, model_rf_path, model_xgb_path, features_path) -> None:
+    # end marker of the classification and pipeline queues, passed on by each stage when it is stopped
+    PIPELINE_SENTINEL = None
+
+    def __init__(self, model_nn_dir, model_rf_path, model_xgb_path, features_path, ensemble_path=None) -> None:
         # load ml models
-        self.model_nn = load_model(model_nn_dir)
-        print("Loaded NN model.")
-        with open(model_rf_path, 'rb') as f:
-            self.model_rf = pickle.load(f)
-        print("Loaded RF model.")
-        self.model_xgb = XGBClassifier()
-        self.model_xgb.load_model(model_xgb_path)
-        print("Loaded XGB model.")
+        if ensemble_path:
+            # Keras, TensorFlow and XGBoost are not needed for the ensemble artifact
+            self.ensemble_scorer = EnsembleScorer(ensemble_path)
+            print("Loaded ensemble artifact.")
+        else:
+            from xgboost import XGBClassifier
+            self.ensemble_scorer = None
+            if model_nn_dir.endswith(".npz"):
+                self.model_nn = CompactNN.load(model_nn_dir)
+            else:
+                from keras.models import load_model
+                self.model_nn = load_model(model_nn_dir)
+            print("Loaded NN model.")
+            with open(model_rf_path, 'rb') as f:
+                self.model_rf = pickle.load(f)
+            print("Loaded RF model.")
+            self.model_xgb = XGBClassifier()
+            self.model_xgb.load_model(model_xgb_path)
+            print("Loaded XGB model.")
         self.used_features = pd.read_csv(features_path)["feature_name"].tolist()
         self.number_to_switch = 0
         self.nn_time_sum = 0
         self.rf_time_sum = 0
         self.xgb_time_sum = 0
+        self.ensemble_time_sum = 0
+        # micro-batching of classification requests
+        self.classify_queue = queue.Queue()
+        self.batch_num = 0
+        self.batch_size_sum = 0
+        self.batch_latency_sum = 0.0
+        self.batch_latency_max = 0.0
+        self.batch_thread = None
+        self.batch_buffer = None
+        # pipelined receiver / inference / sender threads
+        self.ingest_queue = None
+        self.response_queue = None
+        self.pipeline_stats = {}
+        self.pipeline_threads = []
+        self.pipeline_stop_event = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.status_poller = None
 
     def setUp(self, device_grpc_addr, device_id, p4_info_path, p4_bin_path):
         sh.setup(device_id=device_id,
@@ -75,16 +137,54 @@ class Controller():
                  election_id=(0,  1),
                  config=sh.FwdPipeConfig(p4_info_path, p4_bin_path))
         print("Setup the connection to switch.")
+        self.p4_info_path = p4_info_path
         self.packetIn_handler = sh.PacketIn()
         self.pktOut_handler = sh.PacketOut()
         # get the mapping from feature ID to name (ID from proto file)
         proto_parser = P4ProtoTxtParser(p4_info_path)
         self.id2name_dict = proto_parser.get_packet_in_id2name_dict()
+        # compile the mapping from metadata id to feature column once
+        self.decoder = PacketInDecoder(self.id2name_dict, self.used_features)
 
 
     def tearDown(self):
         sh.teardown()
 
+    def get_table_writer(self, batch_size=1000):
+        """Get the writer of table entries over the shell session, e.g. for RuleVersionSwapper.
+
+        Parameters
+        ----------
+        batch_size: int, default: 1000
+            Maximum number of updates per WriteRequest.
+
+        Returns
+        -------
+        P4RuntimeTableWriter
+            Writer of table entries.
+        """
+        return P4RuntimeTableWriter(self.p4_info_path, sh.client.stub, device_id=sh.client.device_id,
+                                    election_id=sh.client.election_id, batch_size=batch_size)
+
+    def install_table_entries(self, entries, batch_size=1000, update_type="INSERT"):
+        """Install table entries on the switch with batched P4Runtime WriteRequests over the shell session.
+
+        Parameters
+        ----------
+        entries: list
+            Table entries (P4TableEntry), e.g. from P4CodeGenerator.generate_p4_table_entries() or parse_p4_rules().
+        batch_size: int, default: 1000
+            Maximum number of updates per WriteRequest.
+        update_type: str {'INSERT', 'MODIFY', 'DELETE'}, default: 'INSERT'
+            Update type of all entries.
+
+        Returns
+        -------
+        dict
+            Number of entries and requests, writing time (s) and entries per second.
+        """
+        return self.get_table_writer(batch_size).write_entries(entries, update_type)
+
     def send_packet(self, header_dict):
         """Send packet to the switch.
 
@@ -112,8 +212,7 @@ class Controller():
         """
         packet_features_dict = {}
         for metadata in pkt.packet.metadata:
-            feature_id = str(metadata.metadata_id)
-            feature_name = self.id2name_dict[feature_id]
+            feature_name = self.decoder.get_feature_name(metadata.metadata_id)
             packet_features_dict[feature_name] = int.from_bytes(
                 metadata.value, byteorder="big")
         return packet_features_dict
@@ -127,13 +226,87 @@ class Controller():
             An incoming packet from switch.
         """
         for metadata in pkt.packet.metadata:
-            feature_id = str(metadata.metadata_id)
-            feature_name = self.id2name_dict[feature_id]
+            feature_name = self.decoder.get_feature_name(metadata.metadata_id)
             print(
                 f"{feature_name}: {int.from_bytes(metadata.value, byteorder='big')}")
 
+    def _get_status_poller(self, interval=1.0, history_size=600):
+        return P4RuntimeStatusPoller(self.p4_info_path, sh.client.stub, device_id=sh.client.device_id,
+                                     interval=interval, history_size=history_size)
+
     def read_counter(self):
-        pass
+        """Read all counters and trace registers of the switch in one batched ReadRequest.
+
+        Returns
+        -------
+        dict
+            Value of each counter and register (see P4RuntimeStatusPoller.read_status()).
+        """
+        if self.status_poller is None:
+            self.status_poller = self._get_status_poller()
+        return self.status_poller.read_status()
+
+    def start_status_polling(self, interval=1.0, history_size=600):
+        """Start the thread polling the counters and trace registers of the switch.
+
+        The samples are kept in the ring buffers of status_poller, e.g. for get_status_rates() and
+        status_poller.get_early_exit_counts().
+
+        Parameters
+        ----------
+        interval: float, default: 1.0
+            Time (in seconds) between two polls.
+        history_size: int, default: 600
+            Number of samples kept in the ring buffers.
+        """
+        self.stop_status_polling()
+        self.status_poller = self._get_status_poller(interval, history_size)
+        self.status_poller.start()
+
+    def stop_status_polling(self):
+        """Stop the status polling thread.
+        """
+        if self.status_poller is not None:
+            self.status_poller.stop()
+
+    def get_status_rates(self, window=None):
+        """Get the rates (per second) of the switch counters over the latest window samples of the status polling.
+        """
+        return self.status_poller.get_rates(window)
+
+    def extract_relevant_features(self, pkt):
+        """Extract the flow id and the feature values fed to the ML models.
+
+        Parameters
+        ----------
+        pkt:
+            An incoming packet from switch.
+
+        Returns
+        -------
+        int
+            Flow id.
+        array (numpy)
+            Feature values ordered as in used_features. The view is overwritten by the next call.
+        """
+        return self.decoder.decode(pkt)
+
+    def send_classify_response(self, flow_id, flow_label):
+        """Send the predicted flow label to switch.
+
+        Parameters
+        ----------
+        flow_id: int
+            Flow id given by the switch.
+        flow_label: int
+            Predicted class of the flow.
+        """
+        self.pktOut_handler.metadata["packet_type"] = Controller.PACKET_OUT
+        self.pktOut_handler.metadata["opcode"] = Controller.CLASSIFY_RESPONSE
+        self.pktOut_handler.metadata["flow_id"] = str(flow_id)
+        self.pktOut_handler.metadata["class"] = str(flow_label)
+        self.pktOut_handler.metadata["reserved"] = '0'
+        self.pktOut_handler.send()
 
     def predict_flow(self, pkt, model_weights):
         """Predict the flow entry sent from switch
@@ -144,23 +317,17 @@ class Controller():
             An incoming packet from switch.
         """
         self.number_to_switch += 1
-        # extract feature values in packet from switch
-        feature_dict = {}
-        for metadata in pkt.packet.metadata:
-            feature_id = str(metadata.metadata_id)
-            feature_name = self.id2name_dict[feature_id]
-            feature_dict[feature_name] = int.from_bytes(
-                metadata.value, byteorder="big")
-        # extract flow id
-        flow_id = feature_dict["flow_id"]
+        # extract flow id and feature list fed to NN model
+        flow_id, relevant_feature_row = self.extract_relevant_features(pkt)
 
-        # extract feature list fed to NN model
-        relevant_feature_dict = {}
-        for feature in self.used_features:
-            relevant_feature_dict[feature] = feature_dict[feature]
-        # print(relevant_feature_dict)
+        if self.ensemble_scorer is not None:
+            flow_label = self.predict_batch(
+                relevant_feature_row[np.newaxis, :], model_weights)[0]
+            self.send_classify_response(flow_id, flow_label)
+            return
 
-        relevant_feature_df = pd.DataFrame([relevant_feature_dict])
+        relevant_feature_df = pd.DataFrame(
+            relevant_feature_row[np.newaxis, :], columns=self.used_features)
 
         # predict the label of flow (NN)
         start_timestamp = time.time()
@@ -186,12 +353,339 @@ class Controller():
             [y_predict_rf, y_predict_xgb, y_predict_nn]), axis=0, weights=model_weights).argmax(axis=1)[0]
 
         # send the predicted flow label to switch
-        self.pktOut_handler.metadata["packet_type"] = Controller.PACKET_OUT
-        self.pktOut_handler.metadata["opcode"] = Controller.CLASSIFY_RESPONSE
-        self.pktOut_handler.metadata["flow_id"] = str(flow_id)
-        self.pktOut_handler.metadata["class"] = str(flow_label)
-        self.pktOut_handler.metadata["reserved"] = '0'
-        self.pktOut_handler.send()
+        self.send_classify_response(flow_id, flow_label)
+
+    def predict_batch(self, X, model_weights):
+        """Predict a batch of flow entries with one call per model.
+
+        Parameters
+        ----------
+        X: array (numpy)
+            Feature matrix, one row per flow, columns ordered as in used_features.
+        model_weights: list
+            Weights for each model. Ignored for the ensemble artifact, its weights are folded in at export.
+
+        Returns
+        -------
+        array
+            Predicted class of each flow.
+        """
+        if self.ensemble_scorer is not None:
+            start_timestamp = time.time()
+            flow_labels = self.ensemble_scorer.predict(X)
+            end_timestamp = time.time()
+            with self.stats_lock:
+                self.ensemble_time_sum += end_timestamp - start_timestamp
+            return flow_labels
+
+        # predict the labels of flows (NN)
+        start_timestamp = time.time()
+        y_predict_nn = self.model_nn.predict(X)
+        y_predict_nn = np.hstack([1 - y_predict_nn, y_predict_nn])
+        nn_timestamp = time.time()
+
+        # predict the labels of flows (RF)
+        y_predict_rf = self.model_rf.predict_proba(X)
+        rf_timestamp = time.time()
+
+        # predict the labels of flows (XGB)
+        y_predict_xgb = self.model_xgb.predict_proba(X)
+        xgb_timestamp = time.time()
+
+        # several inference workers may predict concurrently
+        with self.stats_lock:
+            self.nn_time_sum += nn_timestamp - start_timestamp
+            self.rf_time_sum += rf_timestamp - nn_timestamp
+            self.xgb_time_sum += xgb_timestamp - rf_timestamp
+
+        # compute the final predicted labels from each model
+        return np.average(np.array(
+            [y_predict_rf, y_predict_xgb, y_predict_nn]), axis=0, weights=model_weights).argmax(axis=1)
+
+    def enqueue_flow(self, pkt):
+        """Put the flow entry sent from switch into the classification queue.
+
+        Used as the sniff callback when the batch classification is started.
+
+        Parameters
+        ----------
+        pkt:
+            An incoming packet from switch.
+        """
+        self.classify_queue.put((time.time(), pkt))
+
+    def collect_batch(self, batch_size, batch_timeout, request_queue=None):
+        """Collect queued classification requests until the batch is full or the deadline expires.
+
+        The deadline starts when the first request of the batch is taken from the queue.
+
+        Parameters
+        ----------
+        batch_size: int
+            Maximum number of flows in a batch.
+        batch_timeout: float
+            Maximum time (in seconds) to wait for filling the batch.
+        request_queue: Queue, default: None
+            Queue to collect the requests from. Use classify_queue if None.
+
+        Returns
+        -------
+        list
+            Queued items of the batch, (enqueue timestamp, packet) tuples for classify_queue. 
+            Empty if no request arrived.
+        """
+        if request_queue is None:
+            request_queue = self.classify_queue
+        try:
+            # wake up periodically to check whether the batch classification is stopped
+            batch = [request_queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + batch_timeout
+        while len(batch) < batch_size:
+            remaining_time = deadline - time.time()
+            if remaining_time <= 0:
+                break
+            try:
+                batch.append(request_queue.get(timeout=remaining_time))
+            except queue.Empty:
+                break
+        return batch
+
+    def classify_batch(self, batch, model_weights):
+        """Classify a batch of flow entries and send the responses to switch.
+
+        Parameters
+        ----------
+        batch: list
+            (enqueue timestamp, packet) tuples returned by collect_batch().
+        model_weights: list
+            Weights for each model.
+        """
+        self.number_to_switch += len(batch)
+        if self.batch_buffer is None or len(self.batch_buffer) < len(batch):
+            self.batch_buffer = self.decoder.allocate_buffer(len(batch))
+        flow_ids, X = self.decoder.decode_batch(
+            [pkt for _, pkt in batch], self.batch_buffer)
+
+        flow_labels = self.predict_batch(X, model_weights)
+        for flow_id, flow_label in zip(flow_ids, flow_labels):
+            self.send_classify_response(flow_id, flow_label)
+
+        with self.stats_lock:
+            self._record_batch(time.time() - batch[0][0], len(batch))
+
+    def _record_batch(self, latency, size):
+        # running aggregates, the memory does not grow with the number of batches
+        self.batch_num += 1
+        self.batch_size_sum += size
+        self.batch_latency_sum += latency
+        self.batch_latency_max = max(self.batch_latency_max, latency)
+
+    def _batch_classification_loop(self, model_weights, batch_size, batch_timeout):
+        # classify until the sentinel is taken, all requests enqueued before stopping are queued ahead of it
+        while True:
+            batch = self.collect_batch(batch_size, batch_timeout)
+            requests = [item for item in batch if item is not self.PIPELINE_SENTINEL]
+            if requests:
+                self.classify_batch(requests, model_weights)
+            if len(requests) < len(batch):
+                break
+
+    def start_batch_classification(self, model_weights, batch_size=256, batch_timeout=0.002):
+        """Start the thread classifying the queued flow entries in batches.
+
+        Packets have to be passed to enqueue_flow() (e.g. as the sniff callback) instead of predict_flow().
+
+        Parameters
+        ----------
+        model_weights: list
+            Weights for each model.
+        batch_size: int, default: 256
+            Maximum number of flows in a batch.
+        batch_timeout: float, default: 0.002
+            Maximum time (in seconds) to wait for filling a batch.
+        """
+        self.batch_thread = threading.Thread(target=self._batch_classification_loop,
+                                             args=(model_weights, batch_size, batch_timeout),
+                                             daemon=True)
+        self.batch_thread.start()
+        print(
+            f"Started batch classification (batch size: {batch_size}, batch timeout: {batch_timeout * 1000} ms).")
+
+    def stop_batch_classification(self):
+        """Stop the batch classification thread. All queued requests are still classified and sent to the switch.
+
+        A sentinel is queued behind the requests, the thread stops when it takes the sentinel.
+        """
+        if self.batch_thread is not None:
+            self.classify_queue.put(self.PIPELINE_SENTINEL)
+            self.batch_thread.join()
+            self.batch_thread = None
+
+    def _update_pipeline_stat(self, stat_name, increment):
+        with self.stats_lock:
+            self.pipeline_stats[stat_name] += increment
+
+    def _update_max_queue_depth(self, stat_name, request_queue):
+        depth = request_queue.qsize()
+        with self.stats_lock:
+            if depth > self.pipeline_stats[stat_name]:
+                self.pipeline_stats[stat_name] = depth
+
+    def _put_with_back_pressure(self, request_queue, item):
+        """Block until the item is put into the queue or the pipeline is stopped.
+        """
+        while not self.pipeline_stop_event.is_set():
+            try:
+                request_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _receiver_loop(self, drop_when_full):
+        # packets are put into packet_in_queue by the stream thread of P4Runtime Shell
+        packet_in_queue = self.packetIn_handler.packet_in_queue
+        while not self.pipeline_stop_event.is_set():
+            try:
+                pkt = packet_in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self._update_pipeline_stat("received", 1)
+            item = (time.time(), pkt)
+            if drop_when_full:
+                try:
+                    self.ingest_queue.put_nowait(item)
+                except queue.Full:
+                    # the switch cannot be back-pressured, shed the load instead of stalling the stream
+                    self._update_pipeline_stat("dropped", 1)
+                    continue
+            elif not self._put_with_back_pressure(self.ingest_queue, item):
+                # stopped while the ingest queue was full, the packet is not classified
+                self._update_pipeline_stat("dropped", 1)
+                break
+            self._update_max_queue_depth("max_ingest_queue_depth", self.ingest_queue)
+
+    def _inference_loop(self, model_weights, batch_size, batch_timeout):
+        # each worker decodes into its own buffer
+        buffer = self.decoder.allocate_buffer(batch_size)
+        # classify until the sentinel is taken, all packets received before stopping are queued ahead of it
+        while True:
+            batch = self.collect_batch(
+                batch_size, batch_timeout, self.ingest_queue)
+            requests = [item for item in batch if item is not self.PIPELINE_SENTINEL]
+            sentinel_num = len(batch) - len(requests)
+            if requests:
+                flow_ids, X = self.decoder.decode_batch(
+                    [pkt for _, pkt in requests], buffer)
+                flow_labels = self.predict_batch(X, model_weights)
+                flow_id_list = flow_ids.tolist()
+                self._update_pipeline_stat("classified", len(requests))
+                # block the worker if the sender falls behind, the sender runs until all workers are finished
+                self.response_queue.put((requests[0][0], flow_id_list, flow_labels))
+                self._update_max_queue_depth(
+                    "max_response_queue_depth", self.response_queue)
+            if sentinel_num:
+                # pass on the sentinels of the other workers
+                for _ in range(sentinel_num - 1):
+                    self.ingest_queue.put(self.PIPELINE_SENTINEL)
+                break
+
+    def _sender_loop(self):
+        # keep sending until the sentinel, which is queued after all workers are finished
+        while True:
+            item = self.response_queue.get()
+            if item is self.PIPELINE_SENTINEL:
+                break
+            timestamp, flow_id_list, flow_labels = item
+            for flow_id, flow_label in zip(flow_id_list, flow_labels):
+                self.send_classify_response(flow_id, flow_label)
+            self._update_pipeline_stat("sent", len(flow_id_list))
+            with self.stats_lock:
+                self.number_to_switch += len(flow_id_list)
+                self._record_batch(time.time() - timestamp, len(flow_id_list))
+
+    def start_pipeline(self, model_weights, worker_num=1, batch_size=256, batch_timeout=0.002,
+                       ingest_queue_size=4096, response_queue_size=64, drop_when_full=True):
+        """Start the pipelined receiver, inference and sender threads.
+
+        The receiver takes the PacketIns from the switch, the inference workers decode and classify them in 
+        batches and the sender answers with packet-outs. The stages are connected by bounded queues. A full response 
+        queue blocks the inference workers (back-pressure). A full ingest queue drops the incoming requests 
+        if drop_when_full is set, otherwise the receiver blocks.
+
+        The pipeline replaces the sniff loop, do not call my_sniff() while it is running.
+
+        Parameters
+        ----------
+        model_weights: list
+            Weights for each model.
+        worker_num: int, default: 1
+            Number of inference worker threads.
+        batch_size: int, default: 256
+            Maximum number of flows in a batch.
+        batch_timeout: float, default: 0.002
+            Maximum time (in seconds) to wait for filling a batch.
+        ingest_queue_size: int, default: 4096
+            Maximum number of received PacketIns waiting for decoding and inference.
+        response_queue_size: int, default: 64
+            Maximum number of predicted batches waiting to be sent.
+        drop_when_full: bool, default: True
+            Drop incoming requests if the ingest queue is full.
+        """
+        self.ingest_queue = queue.Queue(maxsize=ingest_queue_size)
+        self.response_queue = queue.Queue(maxsize=response_queue_size)
+        self.pipeline_stats = {"received": 0,
+                               "dropped": 0,
+                               "classified": 0,
+                               "sent": 0,
+                               "max_ingest_queue_depth": 0,
+                               "max_response_queue_depth": 0}
+        self.pipeline_stop_event.clear()
+
+        self.pipeline_threads = [threading.Thread(
+            target=self._receiver_loop, args=(drop_when_full,), daemon=True)]
+        for _ in range(worker_num):
+            self.pipeline_threads.append(threading.Thread(target=self._inference_loop,
+                                                          args=(model_weights, batch_size, batch_timeout), daemon=True))
+        self.pipeline_threads.append(threading.Thread(
+            target=self._sender_loop, daemon=True))
+        for thread in self.pipeline_threads:
+            thread.start()
+        print(f"Started pipeline with {worker_num} inference worker(s).")
+
+    def stop_pipeline(self):
+        """Stop the pipeline threads. All received requests are still classified and sent to the switch.
+
+        The receiver stops first. A sentinel per worker is queued behind the received packets, so the workers
+        drain the ingest queue, and the sender stops at its sentinel after all workers are finished.
+        """
+        receiver_thread, worker_threads, sender_thread = \
+            self.pipeline_threads[0], self.pipeline_threads[1:-1], self.pipeline_threads[-1]
+        self.pipeline_stop_event.set()
+        receiver_thread.join()
+        for _ in worker_threads:
+            self.ingest_queue.put(self.PIPELINE_SENTINEL)
+        for thread in worker_threads:
+            thread.join()
+        self.response_queue.put(self.PIPELINE_SENTINEL)
+        sender_thread.join()
+        self.pipeline_threads = []
+
+    def get_pipeline_stats(self):
+        """Get the pipeline counters and the current queue depths.
+
+        Returns
+        -------
+        dict
+            Number of received, dropped, classified and sent flows, current and maximum queue depths.
+        """
+        with self.stats_lock:
+            stats = self.pipeline_stats.copy()
+        stats["ingest_queue_depth"] = self.ingest_queue.qsize()
+        stats["response_queue_depth"] = self.response_queue.qsize()
+        return stats
 
     def get_number_flow_to_switch(self):
         return self.number_to_switch
@@ -205,6 +699,9 @@ class Controller():
     def get_prediction_time_sum_xgb(self):
         return self.xgb_time_sum
 
+    def get_prediction_time_sum_ensemble(self):
+        return self.ensemble_time_sum
+
     def get_prediction_time_avg_nn(self):
         return self.nn_time_sum / self.number_to_switch
 
@@ -213,3 +710,19 @@ class Controller():
 
     def get_prediction_time_avg_xgb(self):
         return self.xgb_time_sum / self.number_to_switch
+
+    def get_prediction_time_avg_ensemble(self):
+        return self.ensemble_time_sum / self.number_to_switch
+
+    def get_batch_number(self):
+        return self.batch_num
+
+    # the batch statistics are NaN before the first batch is classified
+    def get_batch_size_avg(self):
+        return self.batch_size_sum / self.batch_num if self.batch_num else np.nan
+
+    def get_batch_latency_avg(self):
+        return self.batch_latency_sum / self.batch_num if self.batch_num else np.nan
+
+    def get_batch_latency_max(self):
+        return self.batch_latency_max if self.batch_num else np.nan
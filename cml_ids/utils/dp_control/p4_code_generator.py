@@ -5,6 +5,275 @@ from sklearn.tree import _tree
 import pandas as pd
 import numpy as np
 import pickle
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from ..dataset_processing.flow_schema import get_p4_bits_type, get_p4_bit_width
+
+
+# bits of the flow entry states stored before the features in the bitstring (see struct_to_bitstring):
+# flow_id, src/dst IPv4 address, src/dst port, protocol, first seen/8th packet seen time and the 9 1-bit states
+FLOW_ENTRY_STATE_BITS = 32 + 32 + 32 + 16 + 16 + 8 + 48 + 48 + 9
+# bits of the node ids (index + 1, 0 is the dummy root node) in the match action tables (see NODE_ID_BITS in P4)
+NODE_ID_BITS = 8
+
+# rule version in the match key of the tree tables (two-phase swap of the rules, see p4_rule_diff), the version
+# of each packet is set by the default action of the version table
+RULE_VERSION_BITS = 1
+RULE_VERSION_TABLE = "table_rule_version"
+RULE_VERSION_ACTION = "set_rule_version"
+
+# entry of a match action table: table and action names (aliases in P4Info), match values ordered as the match
+# fields of the table (integers, or "address/prefix length" of LPM fields) and action parameters (integers)
+P4TableEntry = namedtuple("P4TableEntry", ["table", "action", "match", "params"])
+
+# forwarding entries for two ports
+FORWARD_ENTRIES = [P4TableEntry("forward_table", "ipv4_forward", ("10.0.0.1/32",), (0,)),
+                   P4TableEntry("forward_table", "ipv4_forward", ("10.0.0.3/32",), (1,))]
+
+
+def format_table_entry(entry):
+    """Format a table entry as a simple_switch_CLI rule (table_add command, without newline).
+    """
+    return f"table_add {entry.table} {entry.action} {' '.join(map(str, entry.match))} => " \
+        f"{' '.join(map(str, entry.params))}"
+
+
+def parse_table_entry(rule):
+    """Parse a simple_switch_CLI rule (table_add command) into a table entry.
+    """
+    keys, params = rule.split("=>")
+    _, table, action, *match = keys.split()
+    match = tuple(int(value) if value.isdigit() else value for value in match)
+    return P4TableEntry(table, action, match, tuple(int(value) for value in params.split()))
+
+
+def parse_p4_rules(rules_path):
+    """Parse the table entries of a rule file, e.g. from P4CodeGenerator.generate_p4_rules().
+
+    Parameters
+    ----------
+    rules_path: str
+        Path of the rules (table_add commands, one per line).
+
+    Returns
+    -------
+    list
+        Table entries (P4TableEntry).
+    """
+    with open(rules_path) as f:
+        return [parse_table_entry(line) for line in f if line.startswith("table_add")]
+
+
+def get_bitstring_width(features):
+    """Get the bit width of the flow entry bitstring (FLOW_SIZE_BITS) storing the given features.
+
+    Parameters
+    ----------
+    features: list
+        Features stored in the flow entry.
+
+    Returns
+    -------
+    int
+        Number of bits.
+    """
+    return FLOW_ENTRY_STATE_BITS + sum(get_p4_bit_width(feature) for feature in features)
+
+
+def get_tree_levels(dt):
+    """Get the nodes of a decision tree on each depth, level by level over the children arrays.
+
+    Parameters
+    ----------
+    dt:
+        Fitted decision tree.
+
+    Returns
+    -------
+    list
+        Node indices (array) on each depth (index 0 is the root node).
+    """
+    dt_structure = dt.tree_
+    levels = []
+    nodes = np.array([0])
+    while len(nodes) > 0:
+        levels.append(nodes)
+        internal_nodes = nodes[dt_structure.feature[nodes] != _tree.TREE_UNDEFINED]
+        nodes = np.concatenate((dt_structure.children_left[internal_nodes],
+                                dt_structure.children_right[internal_nodes]))
+    return levels
+
+
+def get_tree_level_node_nums(dt):
+    """Count the nodes of a decision tree on each depth.
+
+    The nodes on depth d (d >= 1) are the entries of the match action table of level d, the root node is
+    compared by the single entry of the dummy root node in the table of level 0.
+
+    Parameters
+    ----------
+    dt:
+        Fitted decision tree.
+
+    Returns
+    -------
+    array (numpy)
+        Number of nodes on each depth (index 0 is the root node).
+    """
+    return np.array([len(nodes) for nodes in get_tree_levels(dt)])
+
+
+def compile_tree_entries(dt, tree_index, feature_ids, rule_version=None):
+    """Compile a decision tree into the entries of its match action tables.
+
+    The depth, parent and preorder position of all nodes are computed level by level with NumPy, as well as
+    the quantized thresholds and the classes and Gini impurities of the leaves. The rules are ordered as a
+    preorder traversal emitting the rules of the left and the right child of each internal node.
+
+    Parameters
+    ----------
+    dt:
+        Fitted decision tree.
+    tree_index: int
+        Index of the tree in the P4 program (starting from 1).
+    feature_ids: array (numpy)
+        Feature id of each feature index of the tree (None if the feature has no id).
+    rule_version: int, default: None
+        Rule version appended to the match of each entry (meta.rule_version). No version key if None.
+
+    Returns
+    -------
+    list
+        Table entries (P4TableEntry) of the tree.
+    """
+    dt_structure = dt.tree_
+    node_num = dt_structure.node_count
+    children_left = dt_structure.children_left
+    children_right = dt_structure.children_right
+    is_internal = dt_structure.feature != _tree.TREE_UNDEFINED
+    levels = get_tree_levels(dt)
+
+    depths = np.zeros(node_num, dtype=np.int64)
+    for depth, nodes in enumerate(levels):
+        depths[nodes] = depth
+    internal_nodes = np.flatnonzero(is_internal)
+    parents = np.zeros(node_num, dtype=np.int64)
+    parents[children_left[internal_nodes]] = internal_nodes
+    parents[children_right[internal_nodes]] = internal_nodes
+    # 1: left child, 2: right child
+    sides = np.zeros(node_num, dtype=np.int64)
+    sides[children_left[internal_nodes]] = 1
+    sides[children_right[internal_nodes]] = 2
+
+    # subtree sizes bottom-up, then preorder positions top-down
+    subtree_sizes = np.ones(node_num, dtype=np.int64)
+    for nodes in reversed(levels):
+        nodes = nodes[is_internal[nodes]]
+        subtree_sizes[nodes] = 1 + subtree_sizes[children_left[nodes]] + subtree_sizes[children_right[nodes]]
+    preorder = np.zeros(node_num, dtype=np.int64)
+    for nodes in levels:
+        nodes = nodes[is_internal[nodes]]
+        preorder[children_left[nodes]] = preorder[nodes] + 1
+        preorder[children_right[nodes]] = preorder[nodes] + 1 + subtree_sizes[children_left[nodes]]
+
+    # feature value is ten times the original value (improve the precision)
+    thresholds = (np.around(dt_structure.threshold, 1) * 10).astype(np.int64)
+    # keep three decimal place of the Gini impurity to improve the precision
+    leaf_ginis = (np.around(dt_structure.impurity, 3) * 1000).astype(np.int64)
+    leaf_classes = np.where(dt_structure.value[:, 0, 0] > dt_structure.value[:, 0, 1], 0, 1)
+    node_feature_ids = feature_ids[dt_structure.feature]
+    missing_ids = is_internal & (node_feature_ids == None)  # noqa: E711, elementwise comparison
+    if missing_ids.any():
+        raise KeyError(f"Feature index {dt_structure.feature[missing_ids][0]} of tree {tree_index} has no id.")
+
+    # the rules of the children of each node, ordered by the preorder position of the node
+    children = np.arange(1, node_num)
+    children = children[np.lexsort((sides[children], preorder[parents[children]]))]
+
+    version_key = () if rule_version is None else (rule_version,)
+    # add the entry for the dummy root node (dummy root node index = 0, real root node index = 1)
+    entries = [P4TableEntry(f"table_cmp_feature_tree_{tree_index}_level_0", "compare_feature", (0, 0) + version_key,
+                            (int(node_feature_ids[0]), thresholds[0].item(), 1))]
+    # index 0 is the index of the dummy root node, thus, the node index has to be added with 1 for each node
+    for child, parent, side, depth, internal, feature_id, threshold, leaf_class, leaf_gini in zip(
+            children.tolist(), parents[children].tolist(), sides[children].tolist(), depths[children].tolist(),
+            is_internal[children].tolist(), node_feature_ids[children].tolist(), thresholds[children].tolist(),
+            leaf_classes[children].tolist(), leaf_ginis[children].tolist()):
+        table = f"table_cmp_feature_tree_{tree_index}_level_{depth}"
+        if internal:
+            # the child is not a leaf node, compare the feature and update the node index
+            entries.append(P4TableEntry(table, "compare_feature", (parent + 1, side) + version_key,
+                                        (int(feature_id), threshold, child + 1)))
+        else:
+            # the child is a leaf node, classify the flow
+            entries.append(P4TableEntry(table, "classify_flow", (parent + 1, side) + version_key,
+                                        (tree_index, leaf_class, leaf_gini, child + 1)))
+    return entries
+
+
+def compile_tree_rules(dt, tree_index, feature_ids, rule_version=None):
+    """Compile a decision tree into the rules (table_add commands) of its match action tables.
+    """
+    return "".join(format_table_entry(entry) + "\n"
+                   for entry in compile_tree_entries(dt, tree_index, feature_ids, rule_version))
+
+
+def get_rf_level_entries(rf_estimator):
+    """Get the number of entries of each match action table (tree, level) of a random forest.
+
+    Parameters
+    ----------
+    rf_estimator:
+        Fitted random forest.
+
+    Returns
+    -------
+    DataFrame
+        Entries indexed by tree (tree_1, ...) with a column per level (level_0, ...). Levels below the depth
+        of a tree have 0 entries.
+    """
+    level_entries = [get_tree_level_node_nums(dt) for dt in rf_estimator.estimators_]
+    level_num = max(len(entries) for entries in level_entries)
+    df = pd.DataFrame([np.pad(entries, (0, level_num - len(entries))) for entries in level_entries],
+                      index=[f"tree_{i+1}" for i in range(len(level_entries))],
+                      columns=[f"level_{depth}" for depth in range(level_num)])
+    return df
+
+
+def get_rf_p4_resources(rf_estimator, features):
+    """Get the P4 resources of a random forest as generated by P4CodeGenerator.
+
+    Parameters
+    ----------
+    rf_estimator:
+        Fitted random forest.
+    features: list
+        Features stored in the flow entry.
+
+    Returns
+    -------
+    dict
+        Bit width of the flow entry bitstring, number of match action tables, number of pipeline stages (tables
+        of the deepest tree, the trees are independent), number of table entries (rules without the forwarding
+        rules) and the largest number of entries of a table.
+    """
+    table_num = 0
+    stage_num = 0
+    rule_num = 0
+    max_table_entries = 0
+    for dt in rf_estimator.estimators_:
+        level_node_nums = get_tree_level_node_nums(dt)
+        # one table per level, the entry of the dummy root node in level 0 replaces the root node
+        table_num += len(level_node_nums)
+        stage_num = max(stage_num, len(level_node_nums))
+        rule_num += level_node_nums.sum()
+        max_table_entries = max(max_table_entries, level_node_nums.max())
+    return {"bitstring_bits": get_bitstring_width(features),
+            "table_num": table_num,
+            "stage_num": stage_num,
+            "rule_num": int(rule_num),
+            "max_table_entries": int(max_table_entries)}
 
 
 class P4CodeGenerator():
@@ -107,10 +376,6 @@ class P4CodeGenerator():
     def generate_bitstring_to_struct_action(self):
         """Generate P4 code for converting bitstring to struct.
         """
-        flow_time_bits_str = "FLOW_TIME_BITS"
-        flow_bytes_bits_str = "FLOW_BYTES_BITS"
-        flow_count_bits_str = "FLOW_COUNT_BITS"
-        flow_splt_direction_bits_str = "FLOW_SPLT_DIRECTION_BITS"
         # flow entry features with 1 bit length
         flow_entry_1_bit_features = ["stored",
                                      "class",
@@ -179,21 +444,8 @@ class P4CodeGenerator():
                 /************************* features ***********************/'''
 
         for feature in self.features:
-            # map the type of bits length of features
-            if ("ms" in feature):
-                type_bits_str = flow_time_bits_str
-            elif ("bytes" in feature):
-                type_bits_str = flow_bytes_bits_str
-            elif ("packets" in feature):
-                type_bits_str = flow_count_bits_str
-            elif ("ps" in feature and "psh" not in feature):
-                type_bits_str = flow_bytes_bits_str
-            elif ("protocol" in feature):
-                type_bits_str = "1"
-            elif ("splt_direction" in feature):
-                type_bits_str = flow_splt_direction_bits_str
-            else:
-                raise TypeError("Feature name is illegal.")
+            # map the type of bits length of features (shared with the dataset schema)
+            type_bits_str = get_p4_bits_type(feature)
 
             temp_str = '''
 
@@ -239,38 +491,146 @@ class P4CodeGenerator():
         fh.close()
         print("Generated compare feature action code")
 
-    def generate_mathch_action_tables(self):
+    def get_tree_depth(self):
+        """Get the largest depth reached by the trees (tree_.max_depth, not the max_depth hyperparameter).
+        """
+        return max(dt.tree_.max_depth for dt in self.rf_estimator.estimators_)
+
+    def get_level_entry_nums(self, max_depth=None):
+        """Get the number of entries of the match action tables of each tree.
+
+        Parameters
+        ----------
+        max_depth: int, default: None
+            Deepest table level of each tree, the levels below the depth of a tree have 0 entries. Each tree
+            has one table per level down to its own depth if None.
+
+        Returns
+        -------
+        list
+            Number of entries (array) of each level of each tree (see get_tree_level_node_nums()).
+        """
+        level_entry_nums = [get_tree_level_node_nums(dt) for dt in self.rf_estimator.estimators_]
+        if max_depth is None:
+            return level_entry_nums
+        if self.get_tree_depth() > max_depth:
+            raise ValueError(f"The trees reach depth {self.get_tree_depth()}, only {max_depth} levels are generated.")
+        return [np.pad(entry_nums, (0, max_depth + 1 - len(entry_nums))) for entry_nums in level_entry_nums]
+
+    def generate_mathch_action_tables(self, table_size=None, max_depth=None, with_version=False):
         ''' Generate match action tables in p4
+
+        Parameters
+        ----------
+        table_size: int, default: None
+            Number of entries of each table. The number of entries of the table if None, i.e. only the rules
+            of the current RF fit.
+        max_depth: int, default: None
+            Deepest table level of each tree (see generate_classfication_logic()). The depth of each tree if
+            None. Retrained RFs are installed without recompiling only if their trees are not deeper than
+            max_depth and their tables fit into table_size.
+        with_version: bool, default: False
+            Add the rule version (meta.rule_version, bit<RULE_VERSION_BITS> in the metadata) to the keys and
+            generate the version table setting it (two-phase swap of the rules, see p4_rule_diff). The tables
+            then hold the rules of two RFs, which requires a fixed table_size and max_depth. The declaration
+            of meta.rule_version is generated into p4_rule_version_metadata.txt and has to be added to
+            struct metadata.
         '''
+        bank_num = 1
+        if with_version:
+            if table_size is None or max_depth is None:
+                raise ValueError("Versioned tables hold the rules of two RFs, table_size and max_depth are required.")
+            bank_num = 2
+        level_entry_nums = self.get_level_entry_nums(max_depth)
+        if table_size is not None:
+            max_entry_num = max(int(entry_nums.max()) for entry_nums in level_entry_nums)
+            if max_entry_num * bank_num > table_size:
+                raise ValueError(f"{bank_num} x {max_entry_num} entries do not fit into tables of size {table_size}.")
+
         output_str = ""
-        trees = self.rf_estimator.estimators_
-        for i in range(len(trees)):
-            for depth in range(trees[i].max_depth+1):
+        version_key_str = ""
+        if with_version:
+            output_str = f"""
+                action {RULE_VERSION_ACTION}(bit<{RULE_VERSION_BITS}> rule_version) {{
+                    meta.rule_version = rule_version;
+                }}
+
+                // the default action selects the rule version of the packets
+                table {RULE_VERSION_TABLE} {{
+                    actions = {{
+                        {RULE_VERSION_ACTION};
+                    }}
+                    default_action = {RULE_VERSION_ACTION}(0);
+                    size = 1;
+                }}\n\n"""
+            version_key_str = """
+                        meta.rule_version: exact;"""
+        for i, entry_nums in enumerate(level_entry_nums):
+            for depth, entry_num in enumerate(entry_nums):
                 output_str = output_str + """
                 table table_cmp_feature_tree_{0}_level_{1} {{
                     key = {{
                         meta.current_node_id: exact;
-                        meta.feature_larger_than_thr: exact;
+                        meta.feature_larger_than_thr: exact;{3}
                     }}
                     actions = {{
                         compare_feature;
                         classify_flow;
                     }}
-                    size = 100;
-                }}\n""".format(i+1, depth)
+                    size = {2};
+                }}\n""".format(i+1, depth, entry_num if table_size is None else table_size, version_key_str)
             output_str = output_str + "\n"
 
-        file_name = f"p4_match_action_tables_action_depth_{trees[i].max_depth}.txt"
+        table_depth = self.get_tree_depth() if max_depth is None else max_depth
+        file_name = f"p4_match_action_tables_action_depth_{table_depth}.txt"
+        fh = open(self.p4_base_path + file_name, 'w')
+        fh.write(output_str)
+        fh.close()
+        # the trees are independent, the tables of a level can share a stage
+        table_num = sum(len(entry_nums) for entry_nums in level_entry_nums)
+        stage_num = max(len(entry_nums) for entry_nums in level_entry_nums) + int(with_version)
+        entry_num = sum(int(entry_nums.sum()) for entry_nums in level_entry_nums)
+        print(f"Generated match action table code: {table_num} tables in {stage_num} stages, {entry_num} entries.")
+        if with_version:
+            self.generate_rule_version_metadata()
+
+    def generate_rule_version_metadata(self):
+        ''' Generate the declaration of the rule version (meta.rule_version) for struct metadata
+        '''
+        field_type = f"bit<{RULE_VERSION_BITS}>"
+        output_str = f"""
+    {field_type:<24}rule_version;"""
+        file_name = "p4_rule_version_metadata.txt"
         fh = open(self.p4_base_path + file_name, 'w')
         fh.write(output_str)
         fh.close()
-        print("Generated match action table code")
+        print("Generated rule version metadata code")
 
-    def generate_classfication_logic(self, with_trace=False):
+    def generate_classfication_logic(self, with_trace=False, with_version=False, max_depth=None):
         ''' Generate the random forest classification logic block
+
+        Parameters
+        ----------
+        with_trace: bool, default: False
+            Write the node ids and comparison results of each level to the trace registers.
+        with_version: bool, default: False
+            Apply the version table selecting the rule version first (see generate_mathch_action_tables()),
+            which requires max_depth.
+        max_depth: int, default: None
+            Deepest applied table level of each tree, as the tables generated by generate_mathch_action_tables().
+            The depth of each tree if None.
         '''
+        if with_version and max_depth is None:
+            raise ValueError("Versioned tables hold the rules of two RFs, max_depth is required.")
+        if max_depth is not None and self.get_tree_depth() > max_depth:
+            raise ValueError(f"The trees reach depth {self.get_tree_depth()}, only {max_depth} levels are applied.")
         output_str = ""
+        if with_version:
+            output_str = f'''
+                        {RULE_VERSION_TABLE}.apply();'''
         trees = self.rf_estimator.estimators_
+        tree_depths = [dt.tree_.max_depth if max_depth is None else max_depth for dt in trees]
+        tree_depth = max(tree_depths)
 
         if with_trace:
             for i in range(len(trees)):
@@ -282,14 +642,14 @@ class P4CodeGenerator():
                         larger_than_thr_l1_tree_{tree_index}_register.write(0, meta.feature_larger_than_thr);
                         current_node_id_l1_tree_{tree_index}_register.write(0, meta.current_node_id);'''
 
-                for depth in range(trees[i].max_depth):
+                for depth in range(tree_depths[i]):
                     output_str = output_str + '''
                         if (meta.flow.classified_tree_{0} == 0) {{
                             table_cmp_feature_tree_{0}_level_{1}.apply();
                             larger_than_thr_l{1}_tree_{0}_register.write(0, meta.feature_larger_than_thr);
                             current_node_id_l{1}_tree_{0}_register.write(0, meta.current_node_id);
                         }}'''.format(tree_index, depth+1)
-                file_name = f"p4_random_forest_classification_logic_depth_{trees[i].max_depth}_with_trace.txt"
+            file_name = f"p4_random_forest_classification_logic_depth_{tree_depth}_with_trace.txt"
         else:
             for i in range(len(trees)):
                 tree_index = i + 1
@@ -298,112 +658,83 @@ class P4CodeGenerator():
                         // tree {i+1}
                         table_cmp_feature_tree_{tree_index}_level_0.apply();'''
 
-                for depth in range(trees[i].max_depth):
+                # levels below the depth of the tree have no table unless max_depth is given
+                for depth in range(tree_depths[i]):
                     output_str = output_str + '''
                         if (meta.flow.classified_tree_{0} == 0) {{
                             table_cmp_feature_tree_{0}_level_{1}.apply();
                         }}'''.format(tree_index, depth+1)
-            file_name = f"p4_random_forest_classification_logic_depth_{trees[i].max_depth}.txt"
+            file_name = f"p4_random_forest_classification_logic_depth_{tree_depth}.txt"
 
         fh = open(self.p4_base_path + file_name, 'w')
         fh.write(output_str)
         fh.close()
-        print("Generated classification logic code")
+        print(f"Generated classification logic code: {tree_depth + 1 + int(with_version)} stages.")
 
-    def generate_p4_rules(self):
+    def generate_p4_rules(self, process_num=1, rule_version=None):
         ''' Generate the rules to the p4 switch
+
+        The rules of each tree are compiled by compile_tree_rules() and streamed to the rule file, the trees
+        are compiled in a process pool if process_num > 1.
+
+        Parameters
+        ----------
+        process_num: int, default: 1
+            Number of processes compiling the trees. The trees are compiled in the current process if 1.
+        rule_version: int, default: None
+            Rule version in the match of the tree rules (tables generated with_version). No version if None.
         '''
-        rules = ""
-        for i, dt in enumerate(self.rf_estimator.estimators_):
-            dt_structure = dt.tree_
-            # add the rule for the dummy root node (dummy root node index = 0, real root node index = 1)
-            root_feature_name = self.relevant_features[dt_structure.feature[0]]
-            root_feature_id = self.feature_to_id_dict[root_feature_name]
-            root_threshold = int(np.around(dt_structure.threshold[0], 1) * 10)
-            dummy_node_rule = f"table_add table_cmp_feature_tree_{i+1}_level_{0} compare_feature 0 0 => {root_feature_id} {root_threshold} 1\n"
-            rules = rules + dummy_node_rule
-
-            def traversal_tree(node_index, depth, rules, tree_index):
-                # if the node is not the leaf node, then generate the rules. Otherwise, do nothing.
-                if dt_structure.feature[node_index] != _tree.TREE_UNDEFINED:
-                    # get children node index
-                    left_child_index = dt_structure.children_left[node_index]
-                    right_child_index = dt_structure.children_right[node_index]
-
-                    # if the left child is not a leaf node, compare the feature and update the node index
-                    if (dt_structure.feature[left_child_index] != _tree.TREE_UNDEFINED):
-                        # get the left child node feature name and id
-                        left_child_feature_name = self.relevant_features[
-                            dt_structure.feature[left_child_index]]
-                        left_child_feature_id = self.feature_to_id_dict[left_child_feature_name]
-                        # get the threshold of left child node
-                        # feature value is ten times the original value (improve the precision)
-                        # the time unit is different to the unit in P4
-                        left_child_threshold = int(np.around(
-                            dt_structure.threshold[left_child_index], 1) * 10)
-                        # index 0 is the index of the dummy root node, thus, the node index has to be added with 1 for each node
-                        rules = rules + \
-                            f"table_add table_cmp_feature_tree_{i+1}_level_{depth} compare_feature {node_index+1} {1} => {left_child_feature_id} {left_child_threshold} {left_child_index+1}\n"
-
-                    # if the left child is a leaf node, classify the flow
-                    else:
-                        # determine the class of left child node
-                        if dt_structure.value[left_child_index][0][0] > dt_structure.value[left_child_index][0][1]:
-                            left_child_class_id = 0
-                        else:
-                            left_child_class_id = 1
-                        # keep three decimal place to improve the precision
-                        leaf_gini = int(np.around(
-                            dt_structure.impurity[left_child_index], 3) * 1000)
-                        rules = rules + \
-                            f"table_add table_cmp_feature_tree_{i+1}_level_{depth} classify_flow {node_index+1} {1} => {tree_index} {left_child_class_id} {leaf_gini} {left_child_index+1}\n"
-
-                    # if the right child is not a leaf node, compare the feature and update the node index
-                    if (dt_structure.feature[right_child_index] != _tree.TREE_UNDEFINED):
-                        # get the right child node feature name and id
-                        right_child_feature_name = self.relevant_features[
-                            dt_structure.feature[right_child_index]]
-                        right_child_feature_id = self.feature_to_id_dict[right_child_feature_name]
-                        # get the threshold of right child node
-                        # feature value is ten times the original value (improve the precision)
-                        # the time unit is different to the unit in P4
-                        right_child_threshold = int(np.around(
-                            dt_structure.threshold[right_child_index], 1) * 10)
-                        # index 0 is the index of the dummy root node, thus, the node index has to be added with 1 for each node
-                        rules = rules + \
-                            f"table_add table_cmp_feature_tree_{i+1}_level_{depth} compare_feature {node_index+1} {2} => {right_child_feature_id} {right_child_threshold} {right_child_index+1}\n"
-
-                    # if the right child is a leaf node, classify the flow
-                    else:
-                        # determine the class of right child node
-                        if dt_structure.value[right_child_index][0][0] > dt_structure.value[right_child_index][0][1]:
-                            right_child_class_id = 0
-                        else:
-                            right_child_class_id = 1
-                        # keep three decimal place to improve the precision
-                        leaf_gini = int(np.around(
-                            dt_structure.impurity[right_child_index], 3) * 1000)
-                        rules = rules + \
-                            f"table_add table_cmp_feature_tree_{i+1}_level_{depth} classify_flow {node_index+1} {2} => {tree_index} {right_child_class_id} {leaf_gini} {right_child_index+1}\n"
-
-                    # traverse the tree
-                    rules = traversal_tree(
-                        left_child_index, depth + 1, rules, i+1)
-                    rules = traversal_tree(
-                        right_child_index, depth + 1, rules, i+1)
-
-                return rules
-
-            # start with the root node with depth 1 (depth 0 is for the dummy root node)
-            rules = traversal_tree(0, 1, rules, i+1)
-
-        # add the forwarding rules for two ports.
-        forward_rules = "table_add forward_table ipv4_forward 10.0.0.1/32 => 0\ntable_add forward_table ipv4_forward 10.0.0.3/32 => 1"
-        rules = rules + forward_rules
-
-        max_depth = self.rf_estimator.estimators_[i].max_depth
-        file_name = f"rf_rules_depth_{max_depth}_feature_num_{len(self.relevant_features)}.txt"
-        fh = open(self.p4_base_path + file_name, 'w')
-        fh.write(rules)
-        fh.close()
+        trees = self.rf_estimator.estimators_
+        feature_ids = self._get_feature_ids()
+        tree_indexes = range(1, len(trees) + 1)
+
+        file_name = f"rf_rules_depth_{self.get_tree_depth()}_feature_num_{len(self.relevant_features)}"
+        if rule_version is not None:
+            file_name = file_name + f"_version_{rule_version}"
+        file_name = file_name + ".txt"
+        with open(self.p4_base_path + file_name, 'w', buffering=1 << 20) as fh:
+            if process_num is None or process_num > 1:
+                with ProcessPoolExecutor(max_workers=process_num) as executor:
+                    # the compiled trees are returned in order
+                    for tree_rules in executor.map(compile_tree_rules, trees, tree_indexes,
+                                                   [feature_ids] * len(trees), [rule_version] * len(trees)):
+                        fh.write(tree_rules)
+            else:
+                for dt, tree_index in zip(trees, tree_indexes):
+                    fh.write(compile_tree_rules(dt, tree_index, feature_ids, rule_version))
+
+            # add the forwarding rules for two ports.
+            forward_rules = "\n".join(format_table_entry(entry) for entry in FORWARD_ENTRIES)
+            fh.write(forward_rules)
         print("Generated P4 rules.")
+
+    def _get_feature_ids(self):
+        """Get the feature id of each feature index of the trees (None if the feature has no id).
+        """
+        feature_ids = np.empty(len(self.relevant_features), dtype=object)
+        feature_ids[:] = [self.feature_to_id_dict.get(feature) for feature in self.relevant_features]
+        return feature_ids
+
+    def generate_p4_table_entries(self, rule_version=None, with_forwarding=True):
+        ''' Generate the table entries of the rules as structured entries, e.g. for installing them with
+        P4Runtime (see P4RuntimeTableWriter) or for updating them (see p4_rule_diff).
+
+        Parameters
+        ----------
+        rule_version: int, default: None
+            Rule version in the match of the tree entries (tables generated with_version). No version if None.
+        with_forwarding: bool, default: True
+            Add the forwarding entries.
+
+        Returns
+        -------
+        list
+            Table entries (P4TableEntry) of the trees and the forwarding entries.
+        '''
+        feature_ids = self._get_feature_ids()
+        entries = []
+        for i, dt in enumerate(self.rf_estimator.estimators_):
+            entries.extend(compile_tree_entries(dt, i + 1, feature_ids, rule_version))
+        if with_forwarding:
+            entries = entries + FORWARD_ENTRIES
+        return entries
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import pandas as pd
+
+from .p4_code_generator import RULE_VERSION_TABLE, RULE_VERSION_ACTION, RULE_VERSION_BITS
+
+
+# prefix of the match action tables of the trees, only their entries carry the rule version
+TREE_TABLE_PREFIX = "table_cmp_feature_tree_"
+
+
+def get_entry_key(entry):
+    """Get the key of a table entry on the switch: table and match.
+    """
+    return (entry.table, entry.match)
+
+
+def diff_table_entries(old_entries, new_entries):
+    """Compute the minimal updates turning the old table entries into the new ones.
+
+    Entries are identified by their table and match. An entry is inserted if its key is new, modified if its
+    action or parameters changed and deleted if its key is not used anymore. Unchanged entries are not touched.
+
+    Parameters
+    ----------
+    old_entries: list
+        Installed table entries (P4TableEntry), e.g. from parse_p4_rules() of the old rule file.
+    new_entries: list
+        Table entries (P4TableEntry) to install, e.g. from P4CodeGenerator.generate_p4_table_entries().
+
+    Returns
+    -------
+    dict
+        Entries to insert, modify and delete ({'insert': list, 'modify': list, 'delete': list}), ordered as
+        the new and the old entries.
+    """
+    old_entry_dict = {get_entry_key(entry): entry for entry in old_entries}
+    new_keys = set()
+    table_diff = {"insert": [], "modify": [], "delete": []}
+    for entry in new_entries:
+        key = get_entry_key(entry)
+        if key in new_keys:
+            raise ValueError(f"The match of entry {entry} is used twice.")
+        new_keys.add(key)
+        old_entry = old_entry_dict.get(key)
+        if old_entry is None:
+            table_diff["insert"].append(entry)
+        elif old_entry != entry:
+            table_diff["modify"].append(entry)
+    table_diff["delete"] = [entry for entry in old_entries
+                            if get_entry_key(entry) not in new_keys]
+    return table_diff
+
+
+def summarize_table_diff(table_diff):
+    """Count the updates of each table.
+
+    Parameters
+    ----------
+    table_diff: dict
+        Updates from diff_table_entries().
+
+    Returns
+    -------
+    DataFrame
+        Number of inserted, modified and deleted entries indexed by table.
+    """
+    counts = {update_type: pd.Series([entry.table for entry in entries], dtype=object).value_counts()
+              for update_type, entries in table_diff.items()}
+    return pd.DataFrame(counts).fillna(0).astype(int).sort_index()
+
+
+def apply_table_diff(writer, table_diff):
+    """Write the updates of the table entries to the switch.
+
+    The entries are deleted first, then modified and inserted, so the tables never hold more entries than
+    before or after the update. The updated tables must not be used by the packets (e.g. the standby bank of
+    RuleVersionSwapper), the tables are inconsistent while the updates are written.
+
+    Parameters
+    ----------
+    writer: P4RuntimeTableWriter
+        Writer of the P4Runtime connection.
+    table_diff: dict
+        Updates from diff_table_entries().
+
+    Returns
+    -------
+    dict
+        Number of updates and writing time (s).
+    """
+    start_timestamp = time.time()
+    for update_type in ("delete", "modify", "insert"):
+        if table_diff[update_type]:
+            writer.write_entries(table_diff[update_type], update_type.upper())
+    return {"update_num": sum(len(entries) for entries in table_diff.values()),
+            "write_time": time.time() - start_timestamp}
+
+
+def set_rule_version(entries, rule_version):
+    """Add the rule version to the match of the tree entries without version.
+
+    Parameters
+    ----------
+    entries: list
+        Table entries (P4TableEntry) without rule version.
+    rule_version: int
+        Rule version.
+
+    Returns
+    -------
+    list
+        Table entries with rule version. Entries of other tables (e.g. forwarding) are unchanged.
+    """
+    return [entry._replace(match=entry.match + (rule_version,)) if entry.table.startswith(TREE_TABLE_PREFIX)
+            else entry for entry in entries]
+
+
+class RuleVersionSwapper:
+    """Update the tree entries on the switch with an atomic two-phase swap.
+
+    The match keys of the tree tables contain the rule version (P4 code generated with_version) and the version
+    table sets the version of each packet. The switch holds two banks of entries: the active bank classifies
+    the packets while the standby bank keeps the previous rules. An update writes only the differences between
+    the standby bank and the new rules into the standby bank (phase 1) and then switches the version of all
+    packets to it with a single default action write (phase 2). Packets are classified either with the old or
+    with the new rules, never with a mix of both.
+
+    Attributes
+    ----------
+    writer: P4RuntimeTableWriter
+        Writer of the P4Runtime connection.
+    active_version: int
+        Rule version used by the packets.
+    bank_entries: dict
+        Installed tree entries (without version) of each rule version, None if unknown after a failed update.
+    """
+
+    def __init__(self, writer, active_version=0, active_entries=None, standby_entries=None) -> None:
+        self.writer = writer
+        self.active_version = active_version
+        self.bank_entries = {active_version: list(active_entries or []),
+                             self.get_standby_version(): list(standby_entries or [])}
+
+    def check_entries(self, entries, other_version):
+        """Check that the tree entries fit into the compiled tables next to the entries of the other bank.
+
+        Parameters
+        ----------
+        entries: list
+            Tree entries (P4TableEntry) without version to write into one bank.
+        other_version: int
+            Rule version of the other bank, which keeps its entries.
+        """
+        entry_nums = pd.Series([entry.table for entry in entries], dtype=object).value_counts()
+        other_entry_nums = pd.Series([entry.table for entry in self.bank_entries[other_version] or []],
+                                     dtype=object).value_counts()
+        for table, entry_num in entry_nums.items():
+            if table not in self.writer.table_sizes:
+                raise ValueError(f"Table {table} does not exist on the switch, the P4 program has to be recompiled.")
+            table_size = self.writer.table_sizes[table]
+            if table_size and entry_num + other_entry_nums.get(table, 0) > table_size:
+                raise ValueError(f"Table {table} of size {table_size} cannot hold {entry_num} entries next to the "
+                                 f"{other_entry_nums.get(table, 0)} entries of the other bank.")
+
+    def get_standby_version(self):
+        """Get the rule version of the standby bank.
+        """
+        return (self.active_version + 1) % (2 ** RULE_VERSION_BITS)
+
+    def install(self, entries):
+        """Install the tree entries into the empty active bank and select its version.
+
+        Parameters
+        ----------
+        entries: list
+            Tree entries (P4TableEntry) without version.
+        """
+        if self.bank_entries[self.active_version]:
+            raise ValueError("The active bank holds entries, use update() instead.")
+        self.check_entries(entries, self.get_standby_version())
+        self.writer.write_entries(set_rule_version(entries, self.active_version))
+        self.writer.modify_default_action(RULE_VERSION_TABLE, RULE_VERSION_ACTION, (self.active_version,))
+        self.bank_entries[self.active_version] = list(entries)
+
+    def update(self, new_entries):
+        """Install the new tree entries in the standby bank and swap the banks.
+
+        Parameters
+        ----------
+        new_entries: list
+            Tree entries (P4TableEntry) without version, e.g. from
+            P4CodeGenerator.generate_p4_table_entries(with_forwarding=False).
+
+        Returns
+        -------
+        DataFrame
+            Number of inserted, modified and deleted entries of each table.
+        """
+        start_timestamp = time.time()
+        standby_version = self.get_standby_version()
+        if self.bank_entries[standby_version] is None:
+            raise RuntimeError(f"The entries of the standby bank (version {standby_version}) are unknown after a "
+                               "failed update, pass them as standby_entries to a new RuleVersionSwapper.")
+        self.check_entries(new_entries, self.active_version)
+        # phase 1: prepare the standby bank, the packets still use the active bank
+        table_diff = diff_table_entries(set_rule_version(self.bank_entries[standby_version], standby_version),
+                                        set_rule_version(new_entries, standby_version))
+        try:
+            apply_table_diff(self.writer, table_diff)
+        except Exception as e:
+            # the writes may have been applied partially
+            self.bank_entries[standby_version] = None
+            raise RuntimeError(f"Failed to write the standby bank (version {standby_version}), the packets still "
+                               f"use rule version {self.active_version}.") from e
+        # phase 2: switch all packets to the new rules at once
+        self.writer.modify_default_action(RULE_VERSION_TABLE, RULE_VERSION_ACTION, (standby_version,))
+        self.bank_entries[standby_version] = list(new_entries)
+        self.active_version = standby_version
+
+        diff_summary = summarize_table_diff(table_diff)
+        print(f"Swapped to rule version {standby_version} with {diff_summary.to_numpy().sum()} updates "
+              f"in {time.time() - start_timestamp:.2f} s.")
+        return diff_summary
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from p4.v1 import p4runtime_pb2
+
+from .p4_proto_parser import P4ProtoTxtParser
+
+
+# prefixes of the trace registers written by the classification logic generated with_trace
+# (see P4CodeGenerator.generate_classfication_logic())
+TRACE_REGISTER_PREFIXES = ("larger_than_thr_", "current_node_id_")
+# trace register of the node id of a tree after a level, e.g. current_node_id_l2_tree_1_register
+NODE_ID_REGISTER_PATTERN = re.compile(r"current_node_id_l(\d+)_tree_(\d+)_register")
+
+# counter of the flows sent to the controller for classification
+CLASSIFY_REQUEST_COUNTER = "flow_predicted_controller_sum_counter"
+
+
+class P4RuntimeStatusPoller:
+    """Poll the counters and trace registers of the switch with batched P4Runtime ReadRequests.
+
+    All polled counters and registers are read with a single ReadRequest (one wildcard entity per counter and
+    register), at a fixed interval in a background thread. The samples are kept in ring buffers, so the memory
+    does not grow and the rates are computed over the latest samples. The poller has its own thread and
+    lock and only uses the P4Runtime stub, so it does not block the PacketIn path of the controller.
+
+    Attributes
+    ----------
+    p4_info_path: str
+        Path of the P4Info file (text format).
+    stub: P4RuntimeStub
+        Stub of the P4Runtime connection, e.g. p4runtime_sh.shell.client.stub.
+    device_id: int
+        Id of the switch.
+    interval: float
+        Time (in seconds) between two polls.
+    history_size: int
+        Number of samples kept in the ring buffers.
+    counters: dict
+        Counter id, unit and size of each counter alias.
+    registers: dict
+        Register id and size of each polled register alias (trace registers).
+    timestamps: deque
+        Time of each sample.
+    history: dict
+        Samples (deque) of each counter and register value. Counters and registers with more than one index
+        are stored per index (alias[index]).
+    """
+
+    def __init__(self, p4_info_path, stub, device_id=0, interval=1.0, history_size=600,
+                 register_prefixes=TRACE_REGISTER_PREFIXES) -> None:
+        self.p4_info_path = p4_info_path
+        self.stub = stub
+        self.device_id = device_id
+        self.interval = interval
+        self.history_size = history_size
+        self.register_prefixes = tuple(register_prefixes)
+        self.counters = {}
+        self.registers = {}
+        self.timestamps = deque(maxlen=history_size)
+        self.history = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self._initialize()
+
+    def _initialize(self):
+        """Map the aliases of the counters and the trace registers to their P4Info ids.
+        """
+        proto_parser = P4ProtoTxtParser(self.p4_info_path)
+        for key, entry in proto_parser.dict_proto.items():
+            if key.startswith("counters_"):
+                self.counters[entry["preamble"]["alias"]] = (int(entry["preamble"]["id"]), entry["spec"]["unit"],
+                                                             int(entry.get("size", 1)))
+            elif key.startswith("registers_") and entry["preamble"]["alias"].startswith(self.register_prefixes):
+                self.registers[entry["preamble"]["alias"]] = (int(entry["preamble"]["id"]), int(entry.get("size", 1)))
+        self.counter_names = {counter[0]: name for name, counter in self.counters.items()}
+        self.register_names = {register[0]: name for name, register in self.registers.items()}
+
+    def build_read_request(self):
+        """Build the ReadRequest of all polled counters and registers (all indices of each).
+
+        Returns
+        -------
+        ReadRequest (p4runtime_pb2)
+            Request with one wildcard entity per counter and register.
+        """
+        request = p4runtime_pb2.ReadRequest(device_id=self.device_id)
+        for counter_id, _, _ in self.counters.values():
+            request.entities.add().counter_entry.counter_id = counter_id
+        for register_id, _ in self.registers.values():
+            request.entities.add().register_entry.register_id = register_id
+        return request
+
+    def read_status(self):
+        """Read all polled counters and registers in one round trip.
+
+        Returns
+        -------
+        dict
+            Value of each counter (packets, or bytes for byte counters) and register, counters and registers
+            with more than one index per index (alias[index]).
+        """
+        status = {}
+        for response in self.stub.Read(self.build_read_request()):
+            for entity in response.entities:
+                if entity.HasField("counter_entry"):
+                    counter_entry = entity.counter_entry
+                    name = self.counter_names[counter_entry.counter_id]
+                    if self.counters[name][1] == "BYTES":
+                        value = counter_entry.data.byte_count
+                    else:
+                        value = counter_entry.data.packet_count
+                    if self.counters[name][2] > 1:
+                        name = f"{name}[{counter_entry.index.index}]"
+                    status[name] = value
+                elif entity.HasField("register_entry"):
+                    register_entry = entity.register_entry
+                    name = self.register_names[register_entry.register_id]
+                    if self.registers[name][1] > 1:
+                        name = f"{name}[{register_entry.index.index}]"
+                    status[name] = int.from_bytes(register_entry.data.bitstring, "big")
+        return status
+
+    def poll(self):
+        """Read the counters and registers once and add the sample to the ring buffers.
+
+        Returns
+        -------
+        dict
+            Value of each counter and register (see read_status()).
+        """
+        status = self.read_status()
+        timestamp = time.time()
+        with self.lock:
+            self.timestamps.append(timestamp)
+            for name, value in status.items():
+                if name not in self.history:
+                    # values missing in the former samples are NaN
+                    self.history[name] = deque([np.nan] * (len(self.timestamps) - 1), maxlen=self.history_size)
+                self.history[name].append(value)
+            for name, values in self.history.items():
+                if len(values) < len(self.timestamps):
+                    values.append(np.nan)
+        return status
+
+    def _poll_loop(self):
+        next_timestamp = time.time()
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                # a failed read (e.g. the switch restarts) must not stop the polling
+                print(f"Failed to poll the switch status: {e}")
+            next_timestamp += self.interval
+            self.stop_event.wait(max(0.0, next_timestamp - time.time()))
+
+    def start(self):
+        """Start the thread polling the switch status every interval seconds.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self.thread.start()
+        print(f"Started polling {len(self.counters)} counters and {len(self.registers)} registers "
+              f"(interval: {self.interval} s).")
+
+    def stop(self):
+        """Stop the polling thread after the current poll.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get_history(self):
+        """Get the samples in the ring buffers.
+
+        Returns
+        -------
+        DataFrame
+            Value of each counter and register (columns) indexed by the time of the sample.
+        """
+        with self.lock:
+            return pd.DataFrame({name: list(values) for name, values in self.history.items()},
+                                index=pd.Index(list(self.timestamps), name="timestamp"))
+
+    def get_rates(self, window=None):
+        """Compute the rates of the counters over the latest samples.
+
+        Parameters
+        ----------
+        window: int, default: None
+            Number of latest samples. All samples in the ring buffers if None.
+
+        Returns
+        -------
+        Series (pandas)
+            Increase per second of each counter (e.g. CLASSIFY_REQUEST_COUNTER: classify requests per second).
+            Empty if less than two samples are available.
+        """
+        df = self.get_history()
+        counter_columns = [column for column in df.columns if column.split("[")[0] in self.counters]
+        df = df[counter_columns]
+        if window is not None:
+            df = df.iloc[-window:]
+        if len(df) < 2:
+            return pd.Series(dtype=float)
+        return (df.iloc[-1] - df.iloc[0]) / (df.index[-1] - df.index[0])
+
+    def get_classify_request_rate(self, window=None):
+        """Get the number of flows sent to the controller for classification per second.
+        """
+        return self.get_rates(window).get(CLASSIFY_REQUEST_COUNTER, np.nan)
+
+    def get_early_exit_counts(self, new_only_counter="flow_classified_counter"):
+        """Count the levels at which each tree classified the traced flows.
+
+        The trace registers hold the node id after each level of the last classified flow. The classifying
+        level resets the node id to 0 (classify_flow), the deeper levels are not applied. The exit level of a
+        tree is the first level with node id 0; it is an early exit if the tree has deeper traced levels.
+        As the registers only hold the last flow, one flow is sampled per poll.
+
+        Parameters
+        ----------
+        new_only_counter: str, default: 'flow_classified_counter'
+            Only count the samples in which this counter increased, i.e. a new flow has been classified since
+            the former sample. All samples if None.
+
+        Returns
+        -------
+        DataFrame
+            Number of sampled flows classified at each level (columns level_1, ...) and of early exits
+            (column early_exit), indexed by tree (tree_1, ...).
+        """
+        df = self.get_history()
+        if new_only_counter is not None and new_only_counter in df.columns:
+            df = df[df[new_only_counter].diff() > 0]
+        node_id_registers = {}
+        for column in df.columns:
+            match = NODE_ID_REGISTER_PATTERN.fullmatch(column)
+            if match:
+                node_id_registers.setdefault(int(match.group(2)), {})[int(match.group(1))] = column
+
+        exit_counts = {}
+        for tree_index, level_columns in sorted(node_id_registers.items()):
+            levels = sorted(level_columns)
+            node_ids = df[[level_columns[level] for level in levels]].to_numpy(dtype=float)
+            exited = node_ids == 0
+            # samples without exit (e.g. no trace yet) are not counted
+            has_exit = exited.any(axis=1)
+            exit_levels = np.array(levels)[exited.argmax(axis=1)[has_exit]]
+            counts = {f"level_{level}": int((exit_levels == level).sum()) for level in levels}
+            counts["early_exit"] = int((exit_levels < levels[-1]).sum())
+            exit_counts[f"tree_{tree_index}"] = counts
+        return pd.DataFrame.from_dict(exit_counts, orient="index").fillna(0).astype(int)
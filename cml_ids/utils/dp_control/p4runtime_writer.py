@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ipaddress
+import time
+import threading
+from concurrent import futures
+
+import grpc
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+from .p4_proto_parser import P4ProtoTxtParser
+
+
+# P4Runtime update types of the table entries
+UPDATE_TYPES = {"INSERT": p4runtime_pb2.Update.INSERT,
+                "MODIFY": p4runtime_pb2.Update.MODIFY,
+                "DELETE": p4runtime_pb2.Update.DELETE}
+
+
+def encode_value(value, bitwidth):
+    """Encode an unsigned integer as a P4Runtime binary string (canonical, without leading zero bytes).
+
+    Parameters
+    ----------
+    value: int
+        Value of a match field or an action parameter.
+    bitwidth: int
+        Bit width of the match field or the action parameter.
+
+    Returns
+    -------
+    bytes
+        Binary string.
+    """
+    value = int(value)
+    if value < 0 or value >= 1 << bitwidth:
+        raise ValueError(f"Value {value} does not fit into {bitwidth} bits.")
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+
+
+class P4RuntimeTableWriter:
+    """Install table entries (P4TableEntry) on the switch with batched P4Runtime WriteRequests.
+
+    The ids and bit widths of the tables, match fields, actions and action parameters are taken from the P4Info
+    file. Each WriteRequest carries up to batch_size updates.
+
+    Attributes
+    ----------
+    p4_info_path: str
+        Path of the P4Info file (text format).
+    stub: P4RuntimeStub
+        Stub of the P4Runtime connection, e.g. p4runtime_sh.shell.client.stub.
+    device_id: int
+        Id of the switch.
+    election_id: tuple
+        Election id (high, low) of the controller holding the mastership.
+    batch_size: int
+        Maximum number of updates per WriteRequest.
+    tables: dict
+        Table id and match fields (id, bit width, match type) of each table name and alias.
+    actions: dict
+        Action id and parameters (id, bit width) of each action name and alias.
+    table_sizes: dict
+        Number of entries of each table name and alias.
+    """
+
+    def __init__(self, p4_info_path, stub, device_id=0, election_id=(0, 1), batch_size=1000) -> None:
+        self.p4_info_path = p4_info_path
+        self.stub = stub
+        self.device_id = device_id
+        self.election_id = election_id
+        self.batch_size = batch_size
+        self.tables = {}
+        self.actions = {}
+        self.table_sizes = {}
+        self._initialize()
+
+    def _initialize(self):
+        """Map the names and aliases of the tables and actions to their P4Info ids.
+        """
+        proto_parser = P4ProtoTxtParser(self.p4_info_path)
+        for key, entry in proto_parser.dict_proto.items():
+            if key.startswith("tables_"):
+                match_fields = [(int(field["id"]), int(field["bitwidth"]), field["match_type"])
+                                for field_key, field in entry.items() if field_key.startswith("match_fields")]
+                table = (int(entry["preamble"]["id"]), sorted(match_fields))
+                self.tables[entry["preamble"]["name"]] = table
+                self.tables[entry["preamble"]["alias"]] = table
+                self.table_sizes[entry["preamble"]["name"]] = int(entry.get("size", 0))
+                self.table_sizes[entry["preamble"]["alias"]] = int(entry.get("size", 0))
+            elif key.startswith("actions_"):
+                params = [(int(param["id"]), int(param["bitwidth"]))
+                          for param_key, param in entry.items() if param_key.startswith("params")]
+                action = (int(entry["preamble"]["id"]), sorted(params))
+                self.actions[entry["preamble"]["name"]] = action
+                self.actions[entry["preamble"]["alias"]] = action
+
+    def build_table_entry(self, entry, table_entry=None):
+        """Build the P4Runtime table entry of a P4TableEntry.
+
+        Parameters
+        ----------
+        entry: P4TableEntry
+            Table entry, e.g. from P4CodeGenerator.generate_p4_table_entries().
+        table_entry: TableEntry (p4runtime_pb2), default: None
+            Empty P4Runtime table entry to fill in place, e.g. of an update in a WriteRequest. A new one if None.
+
+        Returns
+        -------
+        TableEntry (p4runtime_pb2)
+            P4Runtime table entry.
+        """
+        table_id, match_fields = self.tables[entry.table]
+        action_id, params = self.actions[entry.action]
+        if len(entry.match) != len(match_fields) or len(entry.params) != len(params):
+            raise ValueError(f"Entry {entry} does not match the P4Info of table {entry.table}.")
+
+        if table_entry is None:
+            table_entry = p4runtime_pb2.TableEntry()
+        table_entry.table_id = table_id
+        for (field_id, bitwidth, match_type), value in zip(match_fields, entry.match):
+            field_match = table_entry.match.add(field_id=field_id)
+            if match_type == "EXACT":
+                field_match.exact.value = encode_value(value, bitwidth)
+            elif match_type == "LPM":
+                # address/prefix length, e.g. 10.0.0.1/32
+                network = ipaddress.ip_network(value, strict=False)
+                field_match.lpm.value = encode_value(int(network.network_address), bitwidth)
+                field_match.lpm.prefix_len = network.prefixlen
+            else:
+                raise ValueError(f"Match type {match_type} is not supported.")
+        table_entry.action.action.action_id = action_id
+        for (param_id, bitwidth), value in zip(params, entry.params):
+            table_entry.action.action.params.add(
+                param_id=param_id, value=encode_value(value, bitwidth))
+        return table_entry
+
+    def _new_write_request(self):
+        request = p4runtime_pb2.WriteRequest(device_id=self.device_id)
+        request.election_id.high = self.election_id[0]
+        request.election_id.low = self.election_id[1]
+        return request
+
+    def build_write_requests(self, entries, update_type="INSERT"):
+        """Build the batched WriteRequests of the table entries.
+
+        Parameters
+        ----------
+        entries: list
+            Table entries (P4TableEntry).
+        update_type: str {'INSERT', 'MODIFY', 'DELETE'}, default: 'INSERT'
+            Update type of all entries.
+
+        Yields
+        ------
+        WriteRequest (p4runtime_pb2)
+            Request with up to batch_size updates.
+        """
+        for offset in range(0, len(entries), self.batch_size):
+            request = self._new_write_request()
+            for entry in entries[offset:offset + self.batch_size]:
+                update = request.updates.add(type=UPDATE_TYPES[update_type])
+                # fill the entry in the request, no copy
+                self.build_table_entry(entry, update.entity.table_entry)
+            yield request
+
+    def write_entries(self, entries, update_type="INSERT"):
+        """Write the table entries to the switch, one WriteRequest per batch.
+
+        Parameters
+        ----------
+        entries: list
+            Table entries (P4TableEntry).
+        update_type: str {'INSERT', 'MODIFY', 'DELETE'}, default: 'INSERT'
+            Update type of all entries.
+
+        Returns
+        -------
+        dict
+            Number of entries and requests, writing time (s) and entries per second.
+        """
+        start_timestamp = time.time()
+        request_num = 0
+        for request in self.build_write_requests(entries, update_type):
+            self.stub.Write(request)
+            request_num += 1
+        write_time = time.time() - start_timestamp
+        write_stats = {"entry_num": len(entries),
+                       "request_num": request_num,
+                       "write_time": write_time,
+                       "entries_per_second": len(entries) / write_time if write_time > 0 else float("inf")}
+        print(f"Wrote {len(entries)} table entries in {request_num} requests "
+              f"({write_stats['entries_per_second']:.0f} entries/s).")
+        return write_stats
+
+    def modify_default_action(self, table, action, params=()):
+        """Set the default action of a table, e.g. of the rule version table (see p4_rule_diff).
+
+        Parameters
+        ----------
+        table: str
+            Table name or alias.
+        action: str
+            Action name or alias.
+        params: tuple, default: ()
+            Action parameters (integers).
+        """
+        table_id, _ = self.tables[table]
+        action_id, action_params = self.actions[action]
+        if len(params) != len(action_params):
+            raise ValueError(
+                f"The default action {action} of table {table} requires {len(action_params)} parameters.")
+        request = self._new_write_request()
+        update = request.updates.add(type=p4runtime_pb2.Update.MODIFY)
+        table_entry = update.entity.table_entry
+        table_entry.table_id = table_id
+        table_entry.is_default_action = True
+        table_entry.action.action.action_id = action_id
+        for (param_id, bitwidth), value in zip(action_params, params):
+            table_entry.action.action.params.add(
+                param_id=param_id, value=encode_value(value, bitwidth))
+        self.stub.Write(request)
+
+
+class P4RuntimeStandInServicer(p4runtime_pb2_grpc.P4RuntimeServicer):
+    """Local stand-in of the P4Runtime server of the switch, for testing the table programming without a switch.
+
+    It accepts WriteRequests and keeps the written table entries, keyed by table id and match. ReadRequests of
+    counters and registers (all indices, see P4RuntimeStatusPoller) are answered from counter_values and
+    register_values, which are set by the test.
+
+    Attributes
+    ----------
+    table_entries: dict
+        Written table entries of each (table id, serialized match).
+    default_actions: dict
+        Written default action (TableEntry) of each table id.
+    counter_values: dict
+        Packet and byte count of each (counter id, index).
+    register_values: dict
+        Value (integer) of each (register id, index).
+    request_num: int
+        Number of received WriteRequests.
+    update_num: int
+        Number of received updates.
+    """
+
+    def __init__(self) -> None:
+        self.table_entries = {}
+        self.default_actions = {}
+        self.counter_values = {}
+        self.register_values = {}
+        self.request_num = 0
+        self.update_num = 0
+        self.lock = threading.Lock()
+
+    def Write(self, request, context):
+        with self.lock:
+            self.request_num += 1
+            for update in request.updates:
+                table_entry = update.entity.table_entry
+                self.update_num += 1
+                if table_entry.is_default_action:
+                    self.default_actions[table_entry.table_id] = table_entry
+                    continue
+                key = (table_entry.table_id,
+                       tuple(field_match.SerializeToString(deterministic=True) for field_match in table_entry.match))
+                if update.type == p4runtime_pb2.Update.INSERT and key in self.table_entries:
+                    context.abort(grpc.StatusCode.ALREADY_EXISTS, f"Entry of table {key[0]} exists.")
+                if update.type != p4runtime_pb2.Update.INSERT and key not in self.table_entries:
+                    context.abort(grpc.StatusCode.NOT_FOUND, f"Entry of table {key[0]} does not exist.")
+                if update.type == p4runtime_pb2.Update.DELETE:
+                    del self.table_entries[key]
+                else:
+                    self.table_entries[key] = table_entry
+        return p4runtime_pb2.WriteResponse()
+
+    def Read(self, request, context):
+        response = p4runtime_pb2.ReadResponse()
+        with self.lock:
+            for entity in request.entities:
+                if entity.HasField("counter_entry"):
+                    for (counter_id, index), (packet_count, byte_count) in sorted(self.counter_values.items()):
+                        if counter_id == entity.counter_entry.counter_id:
+                            counter_entry = response.entities.add().counter_entry
+                            counter_entry.counter_id = counter_id
+                            counter_entry.index.index = index
+                            counter_entry.data.packet_count = packet_count
+                            counter_entry.data.byte_count = byte_count
+                elif entity.HasField("register_entry"):
+                    for (register_id, index), value in sorted(self.register_values.items()):
+                        if register_id == entity.register_entry.register_id:
+                            register_entry = response.entities.add().register_entry
+                            register_entry.register_id = register_id
+                            register_entry.index.index = index
+                            register_entry.data.bitstring = encode_value(value, max(1, value.bit_length()))
+                else:
+                    context.abort(grpc.StatusCode.UNIMPLEMENTED, "Only counters and registers can be read.")
+        yield response
+
+
+def start_stand_in_server(address="127.0.0.1:0", max_workers=4):
+    """Start a local P4Runtime stand-in server.
+
+    Parameters
+    ----------
+    address: str, default: '127.0.0.1:0'
+        Address of the server, a free port is chosen for port 0.
+    max_workers: int, default: 4
+        Number of threads handling the requests.
+
+    Returns
+    -------
+    Server (grpc)
+        The started server.
+    str
+        Address of the server.
+    P4RuntimeStandInServicer
+        Servicer keeping the written table entries.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    servicer = P4RuntimeStandInServicer()
+    p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(servicer, server)
+    port = server.add_insecure_port(address)
+    server.start()
+    return server, f"{address.rsplit(':', 1)[0]}:{port}", servicer
+
+
+def benchmark_table_writer(p4_info_path, entries, batch_sizes=(1, 10, 100, 1000)):
+    """Compare the writing rates of the table entries with different batch sizes against a stand-in server.
+
+    Parameters
+    ----------
+    p4_info_path: str
+        Path of the P4Info file (text format).
+    entries: list
+        Table entries (P4TableEntry).
+    batch_sizes: tuple, default: (1, 10, 100, 1000)
+        Numbers of updates per WriteRequest. A batch size of 1 corresponds to one command per entry.
+
+    Returns
+    -------
+    dict
+        Writing statistics (see P4RuntimeTableWriter.write_entries()) of each batch size.
+    """
+    benchmark_results = {}
+    for batch_size in batch_sizes:
+        server, address, servicer = start_stand_in_server()
+        channel = grpc.insecure_channel(address)
+        try:
+            # connect before the timing starts
+            grpc.channel_ready_future(channel).result(timeout=10)
+            writer = P4RuntimeTableWriter(p4_info_path, p4runtime_pb2_grpc.P4RuntimeStub(channel),
+                                          batch_size=batch_size)
+            benchmark_results[batch_size] = writer.write_entries(entries)
+            if len(servicer.table_entries) != len(entries):
+                raise RuntimeError(
+                    f"The stand-in server holds {len(servicer.table_entries)} of {len(entries)} entries.")
+        finally:
+            channel.close()
+            server.stop(None)
+    return benchmark_results
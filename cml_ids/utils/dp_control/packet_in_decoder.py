@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import time
+
+from .p4_proto_parser import P4ProtoTxtParser
+
+
+class PacketInDecoder():
+    """Decode the metadata of PacketIn messages into preallocated NumPy buffers.
+
+    The mapping from metadata id to buffer column is compiled once, so decoding a packet neither converts
+    the ids to strings nor builds intermediate dictionaries. Each buffer row holds the features ordered as
+    in used_features, followed by the flow id and a scratch column for the unused metadata fields.
+
+    Attributes
+    ----------
+    used_features: list
+        Features used for prediction.
+    feature_num: int
+        Number of features used for prediction.
+    flow_id_slot: int
+        Buffer column of the flow id.
+    column_slots: list
+        Buffer column of each metadata id (list index is the metadata id).
+    metadata_names: list
+        Feature name of each metadata id (list index is the metadata id).
+    row_template: list
+        Zero-initialized row values copied for each decoded packet.
+    row_buffer: array (numpy)
+        Preallocated buffer for decoding a single packet.
+    """
+
+    def __init__(self, id2name_dict, used_features) -> None:
+        self.used_features = list(used_features)
+        self.feature_num = len(self.used_features)
+        self.flow_id_slot = self.feature_num
+        scratch_slot = self.feature_num + 1
+
+        max_metadata_id = max(int(metadata_id) for metadata_id in id2name_dict)
+        self.column_slots = [scratch_slot] * (max_metadata_id + 1)
+        self.metadata_names = [None] * (max_metadata_id + 1)
+        feature_to_slot_dict = {feature: slot for slot,
+                                feature in enumerate(self.used_features)}
+        for metadata_id, feature_name in id2name_dict.items():
+            metadata_id = int(metadata_id)
+            self.metadata_names[metadata_id] = feature_name
+            if feature_name == "flow_id":
+                self.column_slots[metadata_id] = self.flow_id_slot
+            elif feature_name in feature_to_slot_dict:
+                self.column_slots[metadata_id] = feature_to_slot_dict[feature_name]
+
+        missing_features = set(self.used_features) - \
+            set(self.metadata_names)
+        if missing_features:
+            raise ValueError(
+                f"Features are not contained in the PacketIn header: {sorted(missing_features)}")
+        self.row_template = [0] * (self.feature_num + 2)
+        self.row_buffer = self.allocate_buffer(1)[0]
+
+    def allocate_buffer(self, batch_size):
+        """Allocate a buffer for decoding a batch of packets.
+
+        Parameters
+        ----------
+        batch_size: int
+            Maximum number of packets decoded into the buffer.
+
+        Returns
+        -------
+        array (numpy)
+            Buffer with the shape (batch_size, feature_num + 2).
+        """
+        return np.zeros((batch_size, self.feature_num + 2))
+
+    def decode_into(self, pkt, row):
+        """Decode the metadata of a packet into a buffer row.
+
+        Parameters
+        ----------
+        pkt:
+            An incoming packet from switch.
+        row: array (numpy)
+            Buffer row with feature_num + 2 columns.
+        """
+        column_slots = self.column_slots
+        # fill a plain list first, element-wise writes into a NumPy array are slower
+        values = self.row_template.copy()
+        for metadata in pkt.packet.metadata:
+            values[column_slots[metadata.metadata_id]] = int.from_bytes(
+                metadata.value, byteorder="big")
+        row[:] = values
+
+    def decode(self, pkt):
+        """Decode a single packet.
+
+        Parameters
+        ----------
+        pkt:
+            An incoming packet from switch.
+
+        Returns
+        -------
+        int
+            Flow id.
+        array (numpy)
+            Feature values ordered as in used_features. The view is overwritten by the next call.
+        """
+        self.decode_into(pkt, self.row_buffer)
+        return int(self.row_buffer[self.flow_id_slot]), self.row_buffer[:self.feature_num]
+
+    def decode_batch(self, pkt_list, buffer):
+        """Decode a batch of packets into a preallocated buffer.
+
+        Parameters
+        ----------
+        pkt_list: list
+            Incoming packets from switch.
+        buffer: array (numpy)
+            Buffer returned by allocate_buffer() with at least len(pkt_list) rows.
+
+        Returns
+        -------
+        array (numpy)
+            Flow ids of the packets.
+        array (numpy)
+            Feature matrix, one row per packet. The view is overwritten by the next call with the same buffer.
+        """
+        batch_size = len(pkt_list)
+        for i in range(batch_size):
+            self.decode_into(pkt_list[i], buffer[i])
+        return buffer[:batch_size, self.flow_id_slot].astype(np.int64), buffer[:batch_size, :self.feature_num]
+
+    def get_feature_name(self, metadata_id):
+        """Get the feature name of a metadata id.
+        """
+        return self.metadata_names[metadata_id]
+
+
+def benchmark_decoder(p4_info_path, features_path, pkt_num=10000, batch_size=256):
+    """Compare the precompiled decoder with the dictionary-based decoding on synthetic PacketIns.
+
+    Parameters
+    ----------
+    p4_info_path: str
+        Path of the P4Info text file.
+    features_path: str
+        Path of the features used for prediction.
+    pkt_num: int, default: 10000
+        Number of synthetic packets.
+    batch_size: int, default: 256
+        Batch size of the precompiled decoder.
+
+    Returns
+    -------
+    dict
+        Decoding time per packet (in microseconds) of both paths.
+    """
+    proto_parser = P4ProtoTxtParser(p4_info_path)
+    id2name_dict = proto_parser.get_packet_in_id2name_dict()
+    used_features = pd.read_csv(features_path)["feature_name"].tolist()
+    packet_in_dict = proto_parser.get_entry(
+        "controller_packet_metadata_packet_in")
+
+    # synthetic packets with random metadata values of the proper bit width
+    rng = np.random.default_rng(0)
+    metadata_spec_list = [(int(packet_in_dict[key]["id"]), int(packet_in_dict[key]["bitwidth"]))
+                          for key in packet_in_dict.keys() if "metadata" in key]
+    pkt_list = []
+    for _ in range(pkt_num):
+        metadata_list = []
+        for metadata_id, bitwidth in metadata_spec_list:
+            value = int(rng.integers(0, 2 ** min(bitwidth, 32)))
+            metadata_list.append(SimpleNamespace(metadata_id=metadata_id,
+                                                 value=value.to_bytes((bitwidth + 7) // 8, byteorder="big")))
+        pkt_list.append(SimpleNamespace(
+            packet=SimpleNamespace(metadata=metadata_list)))
+
+    # dictionary-based decoding (previous hot path of the controller)
+    start_timestamp = time.perf_counter()
+    dict_rows = []
+    for pkt in pkt_list:
+        feature_dict = {}
+        for metadata in pkt.packet.metadata:
+            feature_id = str(metadata.metadata_id)
+            feature_name = id2name_dict[feature_id]
+            feature_dict[feature_name] = int.from_bytes(
+                metadata.value, byteorder="big")
+        relevant_feature_dict = {}
+        for feature in used_features:
+            relevant_feature_dict[feature] = feature_dict[feature]
+        dict_rows.append(list(relevant_feature_dict.values()))
+    dict_time = time.perf_counter() - start_timestamp
+
+    # precompiled decoding into a preallocated batch buffer
+    decoder = PacketInDecoder(id2name_dict, used_features)
+    buffer = decoder.allocate_buffer(batch_size)
+    decoder_rows = []
+    start_timestamp = time.perf_counter()
+    for i in range(0, pkt_num, batch_size):
+        _, X = decoder.decode_batch(pkt_list[i:i + batch_size], buffer)
+        decoder_rows.append(X.copy())
+    decoder_time = time.perf_counter() - start_timestamp
+
+    if not np.array_equal(np.vstack(decoder_rows), np.array(dict_rows, dtype=float)):
+        raise ValueError("Decoded feature values differ between both paths.")
+
+    result = {"dict_us_per_pkt": dict_time / pkt_num * 1e6,
+              "decoder_us_per_pkt": decoder_time / pkt_num * 1e6}
+    print(f"Dictionary-based decoding: {result['dict_us_per_pkt']:.2f} us/packet, "
+          f"precompiled decoding: {result['decoder_us_per_pkt']:.2f} us/packet, "
+          f"speedup: {dict_time / decoder_time:.2f}x")
+    return result
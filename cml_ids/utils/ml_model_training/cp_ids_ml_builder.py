@@ -28,6 +28,8 @@ from keras.callbacks import EarlyStopping
 import matplotlib.pyplot as plt
 from xgboost import XGBClassifier
 
+from .ensemble_artifact import lower_keras_nn, fold_nn_ops, lower_sklearn_forest, lower_xgb_forest, save_ensemble, EnsembleScorer, CompactNN
+
 
 class CPIDSBuilder:
     """Build CP-IDS ML models.
@@ -342,6 +344,109 @@ class CPIDSBuilder:
         predict_classes = np.argmax(avg_probability, axis=1)
         return predict_classes
 
+    def optimize_nn(self, model_nn, nn_path, X_check, atol=1e-4):
+        """Build the compact inference model of the trained NN.
+
+        Each BatchNormalization is folded into the adjacent Dense weights and Dropout is removed. The compact 
+        model is saved as .npz and can be loaded by the controller instead of the Keras model.
+
+        Parameters
+        ----------
+        model_nn: 
+            Model of NN classifier.
+        nn_path: str
+            Path of the compact model (.npz).
+        X_check: DataFrame (pandas)
+            Dataset to check the outputs and to compare the latency of both models.
+        atol: float, default: 1e-4
+            Tolerance of the absolute output difference.
+
+        Returns
+        -------
+        CompactNN
+            The compact inference model.
+        """
+        nn_ops = lower_keras_nn(model_nn)
+        folded_nn_ops = fold_nn_ops(nn_ops)
+        compact_nn = CompactNN(folded_nn_ops)
+        compact_nn.save(nn_path)
+        print(
+            f"Folded NN from {len(model_nn.layers)} layers to {len(folded_nn_ops)} operations.")
+
+        # check the outputs of both models
+        X_check = np.asarray(X_check, dtype=np.float32)
+        max_diff = np.abs(model_nn.predict(X_check) -
+                          compact_nn.predict(X_check)).max()
+        if max_diff > atol:
+            raise ValueError(
+                f"Output of the compact NN differs from the original NN by {max_diff} (tolerance {atol}).")
+
+        # compare the latency of a single flow and of the whole dataset
+        for name, X in [("single flow", X_check[:1]), ("batch", X_check)]:
+            start_timestamp = time.time()
+            model_nn.predict(X)
+            nn_time = time.time() - start_timestamp
+            start_timestamp = time.time()
+            compact_nn.predict(X)
+            compact_nn_time = time.time() - start_timestamp
+            print(f"=== Latency ({name}, {len(X)} rows): Keras NN {nn_time * 1000:.3f} ms, "
+                  f"compact NN {compact_nn_time * 1000:.3f} ms ===")
+        logging.info(
+            f"Compact NN saved to {nn_path}, maximal output difference: {max_diff}")
+        return compact_nn
+
+    def export_ensemble(self, model_nn, model_rf, model_xgb, model_weights, artifact_path, X_check=None):
+        """Compile the trained models into a single NumPy artifact used by the controller.
+
+        The trees of RF and XGB are lowered into flat arrays, the NN into plain weight matrices with folded
+        BatchNormalization (see optimize_nn), and the
+        weighted averaging is folded into the artifact. The artifact is evaluated by EnsembleScorer without
+        Keras, sklearn or XGBoost.
+
+        Parameters
+        ----------
+        model_nn: 
+            Model of NN classifier.
+        model_rf: 
+            Model of RF classifier.
+        model_xgb: 
+            Model of XGB classifier.
+        model_weights: list
+            Weights for each model (RF, XGB, NN).
+        artifact_path: str
+            Path of the artifact (.npz).
+        X_check: DataFrame (pandas), default: None
+            Dataset to check that the artifact predicts the same classes as the trained models.
+
+        Returns
+        -------
+        EnsembleScorer
+            Scorer loaded from the saved artifact.
+        """
+        start_timestamp = time.time()
+        save_ensemble(artifact_path,
+                      fold_nn_ops(lower_keras_nn(model_nn)),
+                      lower_sklearn_forest(model_rf),
+                      lower_xgb_forest(model_xgb),
+                      model_weights)
+        end_timestamp = time.time()
+        logging.info(
+            f"Ensemble export takes time: {datetime.timedelta(seconds=(end_timestamp - start_timestamp))}")
+        scorer = EnsembleScorer(artifact_path)
+
+        if X_check is not None:
+            start_timestamp = time.time()
+            y_predict_models = self.predict(
+                X_check, model_nn, model_rf, model_xgb, model_weights)
+            models_time = time.time() - start_timestamp
+            start_timestamp = time.time()
+            y_predict_artifact = scorer.predict(np.asarray(X_check))
+            artifact_time = time.time() - start_timestamp
+            agreement = np.mean(y_predict_models == y_predict_artifact)
+            print(f"=== Ensemble artifact: {agreement * 100:.3f}% identical predictions, "
+                  f"prediction time {artifact_time:.3f} s (models: {models_time:.3f} s) ===")
+        return scorer
+
     def test(self, X_test, y_test, model_nn, model_rf, model_xgb, model_weights):
         """Test the trained models.
 
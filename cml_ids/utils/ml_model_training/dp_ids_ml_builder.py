@@ -9,12 +9,85 @@ import time
 import datetime
 import logging
 import pickle
+import os
+import csv
+import io
 
-from sklearn.model_selection import GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401, enables the halving searches
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, HalvingGridSearchCV, HalvingRandomSearchCV
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report, plot_confusion_matrix
+from sklearn.metrics import classification_report, plot_confusion_matrix, f1_score
 from sklearn.tree import plot_tree
 
+from ..dataset_processing.dataset_storage import read_dataset
+from ..dp_control.p4_code_generator import get_tree_level_node_nums, get_rf_level_entries, get_bitstring_width, \
+    NODE_ID_BITS
+
+
+# hyperparameter search of DPIDSBuilder.get_best_estimator()
+SEARCH_CV = {"grid": GridSearchCV,
+             "random": RandomizedSearchCV,
+             "halving_grid": HalvingGridSearchCV,
+             "halving_random": HalvingRandomSearchCV}
+
+
+class P4ResourceScorer:
+    """Score a fitted RF by its macro F1-score minus the cost of its P4 resources.
+
+    Each node of a tree is an entry of a match action table and each level of a tree is a table (see
+    P4CodeGenerator), so the score is f1_macro - rule_weight * rule_num - table_weight * table_num. Every call
+    (one fold of one candidate) is appended as a row to fold_results_path, so the results are on disk while
+    the search is running.
+
+    Attributes
+    ----------
+    rule_weight: float
+        Cost of one table entry (node) in F1-score.
+    table_weight: float
+        Cost of one match action table (tree level) in F1-score.
+    fold_results_path: str
+        Path of the per-fold results (.csv). Nothing is written if None.
+    param_names: list
+        Hyperparameters written with each fold result.
+    """
+
+    def __init__(self, rule_weight=0.0, table_weight=0.0, fold_results_path=None, param_names=()) -> None:
+        self.rule_weight = rule_weight
+        self.table_weight = table_weight
+        self.fold_results_path = fold_results_path
+        self.param_names = list(param_names)
+
+    def get_columns(self):
+        """Get the columns of the per-fold results.
+        """
+        return ["timestamp"] + self.param_names + ["sample_num", "f1_score", "rule_num", "table_num", "score"]
+
+    def __call__(self, estimator, X, y):
+        f1 = f1_score(y, estimator.predict(X), average="macro")
+        rule_num = 0
+        table_num = 0
+        for dt in estimator.estimators_:
+            level_node_nums = get_tree_level_node_nums(dt)
+            rule_num += int(level_node_nums.sum())
+            table_num += len(level_node_nums)
+        score = f1 - self.rule_weight * rule_num - self.table_weight * table_num
+
+        if self.fold_results_path is not None:
+            params = estimator.get_params()
+            # the bootstrap counts are sample weights, the root node holds the number of training samples
+            sample_num = int(round(estimator.estimators_[0].tree_.weighted_n_node_samples[0]))
+            row = [time.time()] + [params[name] for name in self.param_names] + \
+                [sample_num, f1, rule_num, table_num, score]
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(row)
+            # a single appending write, the search workers do not interleave their rows
+            fd = os.open(self.fold_results_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                os.write(fd, buffer.getvalue().encode())
+            finally:
+                os.close(fd)
+        return score
+
 
 class DPIDSBuilder:
     """The builder for generating CP-IDS RF classifier.
@@ -23,19 +96,42 @@ class DPIDSBuilder:
     def __init__(self) -> None:
         print("Start building RF classifier for DP-IDS.")
 
-    def get_best_estimator(self, cv_results_dir, params, X_train, y_train):
+    def get_best_estimator(self, cv_results_dir, params, X_train, y_train, search="grid", n_jobs=-1, cv=5,
+                           n_iter=10, factor=3, rule_weight=0.0, table_weight=0.0, seed=None):
         """Compute the best random forest estimator.
 
+        The candidates and folds run in parallel (n_jobs) while each RF trains with a single job, so the
+        nested parallelism does not oversubscribe the CPUs. The successive halving searches train all
+        candidates on a small part of the training dataset first and only the best 1/factor of them on
+        more samples. Every candidate is scored by P4ResourceScorer and the result of each fold is appended
+        to <cv results path without extension>_folds.csv while the search is running.
+
         Parameters
         ----------
         cv_results_dir: str
             Directary of saveing CV results.
         params: dict
-            Hyperparameters for the CV.
+            Hyperparameters for the CV (lists, or distributions for the random searches).
         X_train: DataFrame (pandas)
             Training dataset without label.
         y_train: DataFrame (pandas)
             Training dataset of the label.
+        search: str {'grid', 'random', 'halving_grid', 'halving_random'}, default: 'grid'
+            Search strategy (see SEARCH_CV).
+        n_jobs: int, default: -1
+            Number of candidates and folds trained in parallel.
+        cv: int, default: 5
+            Number of folds.
+        n_iter: int, default: 10
+            Number of sampled candidates of the random search.
+        factor: int, default: 3
+            Fraction of kept candidates (1/factor) and growth of the samples per iteration of the halving searches.
+        rule_weight: float, default: 0.0
+            Cost of one table entry (node) in F1-score.
+        table_weight: float, default: 0.0
+            Cost of one match action table (tree level) in F1-score.
+        seed: int, default: None
+            Seed of the RFs and of the random and halving searches.
 
         Returns
         -------
@@ -43,27 +139,55 @@ class DPIDSBuilder:
             CV result path.
 
         """
-        clf = RandomForestClassifier(n_jobs=-1)
+        if search not in SEARCH_CV:
+            raise ValueError(
+                f"Unknown search: {search}, should be one of {list(SEARCH_CV)}.")
+        # the search runs in parallel, thus each RF is trained with one job
+        clf = RandomForestClassifier(n_jobs=1, random_state=seed)
 
-        # use grid search to find the best hyperparamters
-        grid_search = GridSearchCV(
-            estimator=clf, param_grid=params, cv=5, n_jobs=-1, verbose=1, scoring="f1_macro")
-        grid_search.fit(X_train, y_train)
-
-        # save the results of each combination
-        df = pd.DataFrame(grid_search.cv_results_)
+        # name the results by the searched hyperparameters
         for param in params.keys():
+            # name distributions of the random searches as e.g. randint(1, 11)
+            param_values = params[param]
+            if hasattr(param_values, "rvs"):
+                param_values = f"{param_values.dist.name}{param_values.args}"
             cv_results_dir = cv_results_dir + \
-                param + '_' + str(params[param])
-
+                param + '_' + str(param_values)
+        if search != "grid":
+            cv_results_dir = cv_results_dir + '_' + search
         cv_results_path = cv_results_dir + ".csv"
+        fold_results_path = cv_results_dir + "_folds.csv"
+
+        scorer = P4ResourceScorer(rule_weight=rule_weight, table_weight=table_weight,
+                                  fold_results_path=fold_results_path, param_names=params.keys())
+        with open(fold_results_path, "w", newline="") as f:
+            csv.writer(f).writerow(scorer.get_columns())
+
+        search_params = {"estimator": clf, "cv": cv, "n_jobs": n_jobs, "verbose": 1, "scoring": scorer}
+        if search in ("grid", "halving_grid"):
+            search_params["param_grid"] = params
+        else:
+            search_params["param_distributions"] = params
+        if search != "grid":
+            search_params["random_state"] = seed
+        if search == "random":
+            search_params["n_iter"] = n_iter
+        elif search.startswith("halving"):
+            # only the testing folds are scored (and written to the fold results)
+            search_params["factor"] = factor
+            search_params["return_train_score"] = False
+        search_cv = SEARCH_CV[search](**search_params)
+        search_cv.fit(X_train, y_train)
+
+        # save the results of each combination
+        df = pd.DataFrame(search_cv.cv_results_)
         df.to_csv(cv_results_path)
 
-        print("Best score: " + str(grid_search.best_score_))
-        print("Best parameters: " + str(grid_search.best_params_))
+        print("Best score: " + str(search_cv.best_score_))
+        print("Best parameters: " + str(search_cv.best_params_))
 
         # # get the best estimator
-        # best_estimator = grid_search.best_estimator_
+        # best_estimator = search_cv.best_estimator_
         # return best_estimator
         
         return cv_results_path
@@ -113,6 +237,86 @@ class DPIDSBuilder:
         rf.fit(X_train, y_train)
         self.save_rf(rf_serialization_path, rf)
 
+    def train_rf_with_budget(self, rf_serialization_path, n_estimators, max_depth, X_train, y_train, table_size=100,
+                             stage_num=None, flow_size_bits=None, features=None, shrink_factor=0.8, seed=None):
+        """Train and save the RF model fitting into the match action tables of the P4 switch.
+
+        Each tree level is a match action table (see P4CodeGenerator), thus the depth of the trees is limited
+        to stage_num - 1. If the nodes of a level exceed table_size or the node ids exceed NODE_ID_BITS, the RF
+        is regrown with fewer leaves (max_leaf_nodes shrinks by shrink_factor) until every table fits. A level
+        of a tree with L leaves has at most L nodes, so the regrowing ends at min(table_size, 2^(NODE_ID_BITS-1))
+        leaves at the latest, a ValueError is raised if the trees still exceed the tables with these leaves.
+
+        Parameters
+        ----------
+        rf_serialization_path: str
+            Path for saving serialized RF.
+        n_estimators: int
+            The number of trees in the RF.
+        max_depth: int
+            The maximum depth of the tree in the RF.
+        X_train: DataFrame (pandas)
+            Training dataset without label.
+        y_train: DataFrame (pandas)
+            Training dataset of the label.
+        table_size: int, default: 100
+            Number of entries of each match action table (see P4CodeGenerator.generate_mathch_action_tables()).
+        stage_num: int, default: None
+            Number of match action tables (stages) per tree. Not limited if None.
+        flow_size_bits: int, default: None
+            Bits of the flow entry (FLOW_SIZE_BITS in P4). The features have to fit into it. Not checked if None.
+        features: list, default: None
+            Features of X_train stored in the flow entry. The columns of X_train if None.
+        shrink_factor: float, default: 0.8
+            Factor of the maximum number of leaves for regrowing the RF.
+        seed: int, default: None
+            Seed of the RF, the regrown RFs use the same bootstrap samples.
+
+        Returns
+        -------
+        DataFrame
+            Entries of each match action table (tree, level).
+        """
+        if table_size < 2:
+            raise ValueError("The tables need at least 2 entries, the children of the root node.")
+        if flow_size_bits is not None:
+            if features is None:
+                features = list(X_train.columns)
+            bitstring_bits = get_bitstring_width(features)
+            if bitstring_bits > flow_size_bits:
+                raise ValueError(
+                    f"The flow entry with the features needs {bitstring_bits} bits, only {flow_size_bits} bits are available.")
+        if stage_num is not None:
+            # the table of level 0 holds the dummy root node
+            max_depth = stage_num - 1 if max_depth is None else min(max_depth, stage_num - 1)
+            if max_depth < 1:
+                raise ValueError("At least 2 stages are required per tree.")
+        # node ids are index + 1, a binary tree with L leaves has 2L - 1 nodes
+        max_node_num = 2 ** NODE_ID_BITS - 1
+        fitting_leaf_num = max(2, min(table_size, (max_node_num + 1) // 2))
+
+        max_leaf_nodes = None
+        while True:
+            rf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, max_leaf_nodes=max_leaf_nodes,
+                                        n_jobs=-1, random_state=seed)
+            rf.fit(X_train, y_train)
+            level_entries = get_rf_level_entries(rf)
+            oversized_trees = [dt for dt, entries in zip(rf.estimators_, level_entries.to_numpy())
+                               if entries.max() > table_size or entries.sum() > max_node_num]
+            if not oversized_trees:
+                break
+            if max_leaf_nodes == fitting_leaf_num:
+                raise ValueError(f"{len(oversized_trees)} trees exceed the tables with {fitting_leaf_num} leaves, "
+                                 f"increase table_size or limit max_depth.")
+            leaf_num = max(dt.get_n_leaves() for dt in oversized_trees)
+            max_leaf_nodes = max(fitting_leaf_num, min(int(leaf_num * shrink_factor), leaf_num - 1))
+            print(f"{len(oversized_trees)} trees exceed the tables, regrow the RF with at most {max_leaf_nodes} leaves.")
+
+        print(f"Entries of the match action tables (size {table_size}):")
+        print(level_entries.to_string())
+        self.save_rf(rf_serialization_path, rf)
+        return level_entries
+
     def save_rf(self, rf_serialization_path, rf_estimator):
         """Serialize and save the random forest estimator into file.
 
@@ -180,7 +384,7 @@ class DPIDSBuilder:
             Path of testing dataset.
         """
         rf = self.load_rf(rf_serialization_path)
-        df = pd.read_csv(dataset_path)
+        df = read_dataset(dataset_path)
         label_mapping = {"Benign": 0, "Attack": 1}
         df["Label"] = df["Label"].map(label_mapping)
         y = df["Label"]
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import numpy as np
+
+
+# operations of the lowered NN, applied in order
+NN_DENSE = "dense"
+NN_AFFINE = "affine"
+NN_RELU = "relu"
+NN_LEAKY_RELU = "leaky_relu"
+NN_SIGMOID = "sigmoid"
+
+
+def lower_keras_nn(model_nn):
+    """Lower a trained Keras Sequential model into plain NumPy operations.
+
+    Dense layers become weight matrices, BatchNormalization layers become element-wise affine
+    transformations with the moving statistics and Dropout layers are removed (identity at inference).
+
+    Parameters
+    ----------
+    model_nn:
+        Trained Keras model built from Dense, LeakyReLU, ReLU, BatchNormalization and Dropout layers.
+
+    Returns
+    -------
+    list
+        (operation, parameter dict) tuples.
+    """
+    nn_ops = []
+    for layer in model_nn.layers:
+        layer_type = type(layer).__name__
+        config = layer.get_config()
+        if layer_type == "Dense":
+            weights = layer.get_weights()
+            bias = weights[1] if len(weights) > 1 else np.zeros(
+                weights[0].shape[1])
+            nn_ops.append((NN_DENSE, {"weight": weights[0], "bias": bias}))
+            activation = config.get("activation", "linear")
+            if activation == "relu":
+                nn_ops.append((NN_RELU, {}))
+            elif activation == "sigmoid":
+                nn_ops.append((NN_SIGMOID, {}))
+            elif activation != "linear":
+                raise ValueError(
+                    f"Activation '{activation}' of layer '{layer.name}' is not supported.")
+        elif layer_type == "LeakyReLU":
+            # the slope is named 'negative_slope' in Keras 3
+            alpha = config.get("alpha", config.get("negative_slope"))
+            nn_ops.append((NN_LEAKY_RELU, {"alpha": np.array(alpha)}))
+        elif layer_type == "ReLU":
+            nn_ops.append((NN_RELU, {}))
+        elif layer_type == "BatchNormalization":
+            weight_dict = {weight.name.split('/')[-1].split(':')[0]: value
+                           for weight, value in zip(layer.weights, layer.get_weights())}
+            moving_var = weight_dict["moving_variance"]
+            scale = weight_dict.get("gamma", np.ones_like(
+                moving_var)) / np.sqrt(moving_var + config["epsilon"])
+            shift = weight_dict.get("beta", np.zeros_like(
+                moving_var)) - weight_dict["moving_mean"] * scale
+            nn_ops.append((NN_AFFINE, {"scale": scale, "shift": shift}))
+        elif layer_type in ["Dropout", "InputLayer"]:
+            continue
+        else:
+            raise ValueError(
+                f"Layer '{layer.name}' of type {layer_type} is not supported.")
+    return nn_ops
+
+
+def fold_nn_ops(nn_ops):
+    """Fold the affine transformations (inference-mode BatchNormalization) into the adjacent Dense weights.
+
+    An affine transformation directly after a Dense layer is folded into that layer. Otherwise, it is folded 
+    into the directly following Dense layer (BatchNormalization placed after the activation).
+
+    Parameters
+    ----------
+    nn_ops: list
+        (operation, parameter dict) tuples returned by lower_keras_nn().
+
+    Returns
+    -------
+    list
+        Operations without foldable affine transformations.
+    """
+    folded_ops = []
+    pending_affine = None
+    for op, params in nn_ops:
+        if op == NN_AFFINE:
+            if pending_affine is not None:
+                # merge consecutive affine transformations
+                pending_affine = {"scale": pending_affine["scale"] * params["scale"],
+                                  "shift": pending_affine["shift"] * params["scale"] + params["shift"]}
+            elif folded_ops and folded_ops[-1][0] == NN_DENSE:
+                # (x W + b) * s + t = x (W * s) + (b * s + t)
+                dense_params = folded_ops[-1][1]
+                folded_ops[-1] = (NN_DENSE, {"weight": dense_params["weight"] * params["scale"],
+                                             "bias": dense_params["bias"] * params["scale"] + params["shift"]})
+            else:
+                pending_affine = params
+        elif op == NN_DENSE and pending_affine is not None:
+            # (x * s + t) W + b = x (s[:, None] * W) + (t W + b)
+            folded_ops.append((NN_DENSE, {"weight": pending_affine["scale"][:, np.newaxis] * params["weight"],
+                                          "bias": pending_affine["shift"] @ params["weight"] + params["bias"]}))
+            pending_affine = None
+        else:
+            if pending_affine is not None:
+                # not foldable, keep the affine transformation
+                folded_ops.append((NN_AFFINE, pending_affine))
+                pending_affine = None
+            folded_ops.append((op, params))
+    if pending_affine is not None:
+        folded_ops.append((NN_AFFINE, pending_affine))
+    return folded_ops
+
+
+def nn_forward(nn_ops, X):
+    """Run the lowered NN.
+
+    Parameters
+    ----------
+    nn_ops: list
+        (operation, parameter dict) tuples.
+    X: array (numpy)
+        Feature matrix.
+
+    Returns
+    -------
+    array (numpy)
+        Output of the last operation.
+    """
+    output = X
+    for op, params in nn_ops:
+        if op == NN_DENSE:
+            output = output @ params["weight"] + params["bias"]
+        elif op == NN_AFFINE:
+            output = output * params["scale"] + params["shift"]
+        elif op == NN_RELU:
+            output = np.maximum(output, 0)
+        elif op == NN_LEAKY_RELU:
+            output = np.where(output > 0, output, output * params["alpha"])
+        elif op == NN_SIGMOID:
+            output = 1 / (1 + np.exp(-output))
+    return output
+
+
+def _nn_ops_to_arrays(nn_ops):
+    arrays = {"nn_ops": np.array([op for op, _ in nn_ops])}
+    for i, (_, params) in enumerate(nn_ops):
+        for name, param in params.items():
+            arrays[f"nn_{i}_{name}"] = param
+    return arrays
+
+
+def _nn_ops_from_arrays(arrays):
+    nn_ops = []
+    for i, op in enumerate(arrays["nn_ops"]):
+        prefix = f"nn_{i}_"
+        params = {key[len(prefix):]: arrays[key]
+                  for key in arrays.files if key.startswith(prefix)}
+        nn_ops.append((str(op), params))
+    return nn_ops
+
+
+class CompactNN():
+    """Inference-only NN saved by CompactNN.save(), evaluated with NumPy.
+
+    Can be used in place of the Keras model, predict() returns the sigmoid output with the shape (samples, 1).
+
+    Attributes
+    ----------
+    nn_ops: list
+        (operation, parameter dict) tuples.
+    """
+
+    def __init__(self, nn_ops) -> None:
+        self.nn_ops = nn_ops
+
+    @classmethod
+    def load(cls, nn_path):
+        """Load the compact NN from a .npz file.
+        """
+        with np.load(nn_path) as arrays:
+            return cls(_nn_ops_from_arrays(arrays))
+
+    def save(self, nn_path):
+        """Save the compact NN into a .npz file.
+        """
+        np.savez(nn_path, **_nn_ops_to_arrays(self.nn_ops))
+
+    def predict(self, X):
+        """Predict the probability of the attack class.
+
+        Parameters
+        ----------
+        X: array (numpy)
+            Feature matrix.
+
+        Returns
+        -------
+        array (numpy)
+            Output of the NN with the shape (samples, 1).
+        """
+        return nn_forward(self.nn_ops, np.asarray(X, dtype=np.float32))
+
+
+def _flatten_trees(tree_list):
+    """Concatenate trees given as (feature, threshold, left, right, value) arrays into flat arrays.
+
+    Children indices are shifted to the flat index. Leaves point to themselves, so a traversal of
+    the maximal depth ends in the leaf of every tree.
+    """
+    feature_list, threshold_list, left_list, right_list, value_list, root_list = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for feature, threshold, left, right, value in tree_list:
+        node_num = len(feature)
+        node_index = np.arange(node_num) + offset
+        is_leaf = left < 0
+        feature_list.append(np.where(is_leaf, 0, feature))
+        threshold_list.append(threshold)
+        left_list.append(np.where(is_leaf, node_index, left + offset))
+        right_list.append(np.where(is_leaf, node_index, right + offset))
+        value_list.append(value)
+        root_list.append(offset)
+        offset += node_num
+
+        # depth of the tree, nodes are numbered so that children follow their parents
+        depth = np.zeros(node_num, dtype=np.int64)
+        for i in range(node_num):
+            if not is_leaf[i]:
+                depth[left[i]] = depth[i] + 1
+                depth[right[i]] = depth[i] + 1
+        max_depth = max(max_depth, int(depth.max()))
+
+    return {"feature": np.concatenate(feature_list).astype(np.int64),
+            "threshold": np.concatenate(threshold_list),
+            "left": np.concatenate(left_list).astype(np.int64),
+            "right": np.concatenate(right_list).astype(np.int64),
+            "value": np.concatenate(value_list),
+            "root": np.array(root_list, dtype=np.int64),
+            "max_depth": np.array(max_depth)}
+
+
+def lower_sklearn_forest(model_rf):
+    """Lower a trained sklearn RandomForestClassifier into flat NumPy arrays.
+
+    Parameters
+    ----------
+    model_rf:
+        Trained RF classifier.
+
+    Returns
+    -------
+    dict
+        Flat arrays of feature, threshold, left, right, value (class probability of the leaves),
+        root and max_depth.
+    """
+    tree_list = []
+    for estimator in model_rf.estimators_:
+        tree = estimator.tree_
+        value = tree.value[:, 0, :]
+        value = value / value.sum(axis=1, keepdims=True)
+        tree_list.append((tree.feature, tree.threshold,
+                         tree.children_left, tree.children_right, value))
+    return _flatten_trees(tree_list)
+
+
+def lower_xgb_forest(model_xgb):
+    """Lower a trained binary XGBClassifier into flat NumPy arrays.
+
+    Parameters
+    ----------
+    model_xgb:
+        Trained XGB classifier with the objective 'binary:logistic'.
+
+    Returns
+    -------
+    dict
+        Flat arrays of feature, threshold, left, right, value (leaf weight), root, max_depth and the base margin.
+    """
+    model_json = json.loads(model_xgb.get_booster().save_raw(raw_format="json"))
+    learner = model_json["learner"]
+    objective = learner["objective"]["name"]
+    if objective != "binary:logistic":
+        raise ValueError(f"Objective '{objective}' is not supported.")
+    # base_score is saved as '5E-1' or '[5E-1]' depending on the version
+    base_score = float(
+        learner["learner_model_param"]["base_score"].strip("[]"))
+
+    tree_list = []
+    for tree in learner["gradient_booster"]["model"]["trees"]:
+        left = np.array(tree["left_children"])
+        # the split condition of a leaf is its weight
+        split_conditions = np.array(tree["split_conditions"], dtype=np.float32)
+        tree_list.append((np.array(tree["split_indices"]),
+                          split_conditions,
+                          left,
+                          np.array(tree["right_children"]),
+                          split_conditions[:, np.newaxis].astype(np.float64)))
+    forest = _flatten_trees(tree_list)
+    forest["base_margin"] = np.array(np.log(base_score / (1 - base_score)))
+    return forest
+
+
+def predict_forest_leaves(X, forest, strict):
+    """Find the leaf of every tree for every sample in one vectorized traversal.
+
+    Parameters
+    ----------
+    X: array (numpy)
+        Feature matrix.
+    forest: dict
+        Flat arrays of the forest.
+    strict: bool
+        Go to the left child if the feature is strictly less than the threshold (XGB),
+        otherwise if it is less than or equal (sklearn).
+
+    Returns
+    -------
+    array (numpy)
+        Leaf values with the shape (samples, trees, values).
+    """
+    rows = np.arange(len(X))[:, np.newaxis]
+    node = np.broadcast_to(forest["root"], (len(X), len(forest["root"])))
+    for _ in range(int(forest["max_depth"])):
+        feature_value = X[rows, forest["feature"][node]]
+        if strict:
+            go_left = feature_value < forest["threshold"][node]
+        else:
+            go_left = feature_value <= forest["threshold"][node]
+        node = np.where(go_left, forest["left"][node], forest["right"][node])
+    return forest["value"][node]
+
+
+def save_ensemble(artifact_path, nn_ops, rf_forest, xgb_forest, model_weights):
+    """Save the lowered ensemble into a single .npz file.
+
+    The weighted averaging of the model probabilities is folded into the artifact. The RF weight is
+    multiplied into the leaf probabilities, so that summing the leaves gives the weighted RF share.
+
+    Parameters
+    ----------
+    artifact_path: str
+        Path of the artifact (.npz).
+    nn_ops: list
+        Lowered NN.
+    rf_forest: dict
+        Lowered RF.
+    xgb_forest: dict
+        Lowered XGB.
+    model_weights: list
+        Weights for each model (RF, XGB, NN).
+    """
+    model_weights = np.asarray(model_weights, dtype=np.float64)
+    model_weights = model_weights / model_weights.sum()
+
+    arrays = {"model_weights": model_weights}
+    arrays.update(_nn_ops_to_arrays(nn_ops))
+    for name, array in rf_forest.items():
+        if name == "value":
+            array = array * model_weights[0] / len(rf_forest["root"])
+        arrays[f"rf_{name}"] = array
+    for name, array in xgb_forest.items():
+        arrays[f"xgb_{name}"] = array
+    np.savez(artifact_path, **arrays)
+
+
+class EnsembleScorer():
+    """Evaluate the weighted RF, XGB and NN ensemble saved by save_ensemble() with NumPy only.
+
+    Attributes
+    ----------
+    model_weights: array (numpy)
+        Normalized weights of RF, XGB and NN.
+    nn_ops: list
+        Lowered NN.
+    rf_forest: dict
+        Lowered RF, leaf probabilities are scaled by the RF weight and the number of trees.
+    xgb_forest: dict
+        Lowered XGB.
+    """
+
+    def __init__(self, artifact_path) -> None:
+        with np.load(artifact_path) as artifact:
+            self.model_weights = artifact["model_weights"]
+            self.nn_ops = _nn_ops_from_arrays(artifact)
+            self.rf_forest = {key[len("rf_"):]: artifact[key]
+                              for key in artifact.files if key.startswith("rf_")}
+            self.xgb_forest = {key[len("xgb_"):]: artifact[key]
+                               for key in artifact.files if key.startswith("xgb_")}
+
+    def predict_proba(self, X):
+        """Predict the weighted class probabilities.
+
+        Parameters
+        ----------
+        X: array (numpy)
+            Feature matrix, columns ordered as in the training dataset.
+
+        Returns
+        -------
+        array (numpy)
+            Class probabilities with the shape (samples, 2).
+        """
+        X = np.asarray(X)
+        # sklearn and XGB compare the features in single precision
+        X_32 = X.astype(np.float32)
+
+        y_predict_rf = predict_forest_leaves(
+            X_32, self.rf_forest, strict=False).sum(axis=1)
+
+        margin = predict_forest_leaves(X_32, self.xgb_forest, strict=True)[
+            :, :, 0].sum(axis=1) + self.xgb_forest["base_margin"]
+        y_xgb = 1 / (1 + np.exp(-margin))
+
+        y_nn = nn_forward(self.nn_ops, X_32)[:, 0]
+
+        y_attack = y_predict_rf[:, 1] + self.model_weights[1] * \
+            y_xgb + self.model_weights[2] * y_nn
+        y_benign = y_predict_rf[:, 0] + self.model_weights[1] * \
+            (1 - y_xgb) + self.model_weights[2] * (1 - y_nn)
+        return np.column_stack([y_benign, y_attack])
+
+    def predict(self, X):
+        """Predict the classes.
+
+        Parameters
+        ----------
+        X: array (numpy)
+            Feature matrix, columns ordered as in the training dataset.
+
+        Returns
+        -------
+        array (numpy)
+            Predicted classes.
+        """
+        return self.predict_proba(X).argmax(axis=1)
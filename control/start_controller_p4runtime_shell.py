@@ -8,10 +8,10 @@ import pandas as pd
 import numpy as np
 import pickle
 import threading
-from keras.models import load_model
-from xgboost import XGBClassifier
+import time
 from utils.dp_control.controller_p4runtime_shell import Controller
 from utils.dp_control.p4_proto_parser import P4ProtoTxtParser
+from utils.dp_control.p4_code_generator import parse_p4_rules
 
 
 ############################################### setup ###############################################
@@ -21,6 +21,9 @@ p4_prog_name = "dp_ids_switch"
 p4_info_path = f"./cml_ids//p4/build/{p4_prog_name}.p4info.txt"
 p4_bin_path = f"./cml_ids//p4/build/{p4_prog_name}.json"
 switch_grpc_addr = "127.0.0.1:50052"
+# rules installed with batched P4Runtime writes (None: the rules are added by control/add_entries.sh)
+rules_path = None
+# rules_path = "./cml_ids/p4/rf_rules_thesis.txt"
 
 # used features
 features_path = "./cml_ids//base_files/used_features.csv"
@@ -29,24 +32,76 @@ features_path = "./cml_ids//base_files/used_features.csv"
 controller_ml_models_dir = "./cml_ids//ml_models/cp_ids_models/"
 
 nn_model_dir = controller_ml_models_dir + 'nn_model/'
+# compact NN saved by CPIDSBuilder.optimize_nn() (BatchNormalization folded, Dropout removed)
+# nn_model_dir = controller_ml_models_dir + 'nn_model_compact.npz'
 rf_model_path = controller_ml_models_dir + 'rf_cp_ids_model.pkl'
 xgb_model_path = controller_ml_models_dir + "xgb_model.json"
+# ensemble artifact exported by CPIDSBuilder.export_ensemble() (set to None to load the NN, RF and XGB models)
+ensemble_path = None
 
 # setup the connection
 my_controller = Controller(model_nn_dir=nn_model_dir,
-                           model_rf_path=rf_model_path, model_xgb_path=xgb_model_path, features_path=features_path)
+                           model_rf_path=rf_model_path, model_xgb_path=xgb_model_path, features_path=features_path,
+                           ensemble_path=ensemble_path)
 my_controller.setUp(device_grpc_addr=switch_grpc_addr,
                     device_id=0,
                     p4_info_path=p4_info_path,
                     p4_bin_path=p4_bin_path)
 
+# install the table entries of the rules
+if rules_path:
+    my_controller.install_table_entries(parse_p4_rules(rules_path))
+
 # parse the P4 proto text file
 proto_parser = P4ProtoTxtParser(p4_info_path)
 
 ############################################### process packetIn ###############################################
 
 model_weights = [1.9, 2.5, 1]
+# classify the flows in micro-batches (batch_size = 1: classify each packet directly in the sniff callback)
+batch_size = 256
+# maximum time (in seconds) to wait for filling a batch
+batch_timeout = 0.002
+# run receiver, inference workers and sender in separate threads (only used if batch_size > 1)
+use_pipeline = True
+inference_worker_num = 2
+# interval (in seconds) of reporting the pipeline queue depths and drop counters
+report_interval = 10
+# interval (in seconds) of polling the switch counters and trace registers (None: no polling)
+status_poll_interval = 1
+
+if status_poll_interval:
+    my_controller.start_status_polling(interval=status_poll_interval)
+
 # sniff the packets from switch
 pktIn_handler = my_controller.packetIn_handler
-pktIn_handler.my_sniff(
-    lambda pkt: my_controller.predict_flow(pkt, model_weights))
+if batch_size > 1 and use_pipeline:
+    my_controller.start_pipeline(model_weights,
+                                 worker_num=inference_worker_num,
+                                 batch_size=batch_size,
+                                 batch_timeout=batch_timeout)
+    try:
+        while True:
+            time.sleep(report_interval)
+            print(my_controller.get_pipeline_stats())
+            if status_poll_interval:
+                print(my_controller.get_status_rates(window=int(report_interval / status_poll_interval) + 1).to_dict())
+    except KeyboardInterrupt:
+        pass
+    my_controller.stop_pipeline()
+    print(my_controller.get_pipeline_stats())
+elif batch_size > 1:
+    my_controller.start_batch_classification(
+        model_weights, batch_size=batch_size, batch_timeout=batch_timeout)
+    pktIn_handler.my_sniff(my_controller.enqueue_flow)
+    my_controller.stop_batch_classification()
+else:
+    pktIn_handler.my_sniff(
+        lambda pkt: my_controller.predict_flow(pkt, model_weights))
+my_controller.stop_status_polling()
+
+if my_controller.get_batch_number() > 0:
+    print(f"Classified batches: {my_controller.get_batch_number()}, "
+          f"average batch size: {my_controller.get_batch_size_avg():.1f}, "
+          f"average batch latency: {my_controller.get_batch_latency_avg() * 1000:.3f} ms, "
+          f"maximum batch latency: {my_controller.get_batch_latency_max() * 1000:.3f} ms")